@@ -1,83 +1,46 @@
-import google.generativeai as genai
-import firebase_admin
-from firebase_admin import credentials, firestore
-from langchain_chroma import Chroma
+from firebase_admin import firestore
+from google.api_core.exceptions import Conflict, FailedPrecondition
+from google.cloud.firestore_v1.base_query import FieldFilter
 from decouple import config
-from langchain_huggingface import HuggingFaceEmbeddings
+import asyncio
 import time
 import traceback 
 
+from ai.followup import FOLLOWUP_LLM_FALLBACK, FOLLOWUP_MODE
+from ai.ids import is_ulid, new_ulid
+from ai.jobs import job_queue
+from ai.llm import llm
+from ai.metrics import record_followup, span, timed
+from ai.prompts import FOLLOWUP_PREFIX, build_rag_prompt, build_summary_prompt, format_history
+from ai.resources import get_answer_model, get_db, get_embeddings, get_fcm, get_question_bank
+from ai.retrieval import retrieval_executor, retrieve
+from ai.risk import classified, describe_risk_state, needs_classification, queued, update_risk_state
+from ai.semantic_cache import create_cache
+from ai.user_cache import cached_session, profile_cache, remember_session, session_cache
 
-api_key = config("GOOGLE_GEMINI_API_KEY")
 
-if not firebase_admin._apps:
-    try:
-        cred = credentials.Certificate("firebase-adminsdk.json")  
-        firebase_admin.initialize_app(cred)
-    except Exception as e:
-        print(f"❌ Firebase initialization failed: {e}")
-        exit(1)
-
-db = firestore.client()
-
-
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2", model_kwargs={"device": "cpu"})
-vector_db = Chroma(persist_directory="./chroma_db_ncd", embedding_function=embeddings)
-
-
-GEMINI_API_KEY = api_key
-genai.configure(api_key=GEMINI_API_KEY)
-genai_model = genai.GenerativeModel(model_name="gemini-1.5-flash")
-
-
-def generate_rag_prompt(query, context, conversation_history):
-    """🔹 Generate a comprehensive and responsible prompt for Gemini with enhanced safety and credibility"""
-    return f"""
-    ### AI Health Assistant Role
-    You are a professional AI health assistant specializing in Non-Communicable Diseases (NCDs).
-    - You are NOT a licensed medical professional
-    - Your goal is to provide general health information and guidance
-    - ALWAYS recommend consulting a healthcare professional for personalized medical advice
+ANSWER_TIMEOUT = config("ANSWER_TIMEOUT", default=30, cast=float)
+# How long the reply may wait for the follow-up question once the answer is ready
+FOLLOWUP_TIMEOUT = config("FOLLOWUP_TIMEOUT", default=1.5, cast=float)
+RISK_TIMEOUT = config("RISK_TIMEOUT", default=30, cast=float)
 
-    ### Communication Guidelines
-    - Respond in Thai with a compassionate and professional tone
-    - Be clear, concise, and use simple medical language
-    - Maximum response length: 3-4 sentences
-    - Focus on providing helpful, evidence-based information
+# Turns live one per document in conversations/{user_id}/messages; the parent
+# document only keeps a turn_count and the last RECENT_WINDOW entries
+RECENT_WINDOW = config("RECENT_WINDOW", default=5, cast=int)
+# Older turns are folded into a rolling `summary` by a background job, a few
+# at a time, once they are behind the last SUMMARY_KEEP_TURNS turns
+SUMMARY_KEEP_TURNS = config("SUMMARY_KEEP_TURNS", default=2, cast=int)
+SUMMARY_BATCH_TURNS = config("SUMMARY_BATCH_TURNS", default=2, cast=int)
+MESSAGE_PAGE_SIZE = config("MESSAGE_PAGE_SIZE", default=20, cast=int)
+MAX_MESSAGE_PAGE_SIZE = 100
 
-    ### Ethical and Safety Principles
-    1. Never diagnose medical conditions
-    2. Do not prescribe treatments or medications
-    3. Acknowledge the limitations of AI health advice
-    4. Emphasize the importance of professional medical consultation
-    5. Provide general health recommendations based on available context
+# Near-duplicate questions reuse retrieval results, and (for turns without
+# history, where the answer is not personalised) the generated answer
+context_cache = create_cache("context", config("CONTEXT_CACHE_THRESHOLD", default=0.95, cast=float))
+answer_cache = create_cache("answer", config("ANSWER_CACHE_THRESHOLD", default=0.97, cast=float))
 
-    ### Risk Communication Framework
-    - Use neutral, non-alarming language
-    - Provide constructive health suggestions
-    - Avoid causing unnecessary anxiety
-    - Encourage preventive health behaviors
-
-    ### Context from Knowledge Base:
-    {context}
-
-    ### Conversation History:
-    {conversation_history}
-
-    ### User's Question:
-    {query}
-
-    ### Response Requirements:
-    - Answer in Thai
-    - Include a clear disclaimer about consulting healthcare professionals
-    - Provide general, supportive health guidance
-    - If query is unrelated to health, politely redirect
-
-    ### AI's Recommended Response (in Thai):
-    """
 
-
-def generate_followup_question(conversation_history):
+async def generate_followup_question(conversation_history):
     """🔹 Generate targeted follow-up questions and analyze user's health risk"""
     if not conversation_history:
         return None
@@ -106,7 +69,7 @@ def generate_followup_question(conversation_history):
     ### Next Question (in Thai):
     """
     try:
-        response = genai_model.generate_content(prompt)
+        response = await llm.generate("followup", prompt, deadline=ANSWER_TIMEOUT)
         followup_text = response.text.strip() if response and response.text.strip() else None
         return None if "ไม่มีคำถามเพิ่มเติม" in followup_text else followup_text
     except Exception as e:
@@ -114,87 +77,559 @@ def generate_followup_question(conversation_history):
         return None
 
 
-def prepare_conversation_response(user_id, query):
+_last_id_millis = 0
+
+
+def new_session_id():
+    """🔹 Millisecond session id, strictly increasing within this process"""
+    global _last_id_millis
+    _last_id_millis = max(int(time.time() * 1000), _last_id_millis + 1)
+    return str(_last_id_millis)
+
+
+def new_message_id():
+    """🔹 ULID message id: unique, and sorts in the order messages were written"""
+    return new_ulid()
+
+
+class ConversationContext:
+    """🔹 Turn-scoped snapshot of conversations/{user_id}
+
+    The document is read once when the turn starts; every helper reads from
+    the snapshot and stages its writes here, and commit() flushes them as a
+    single batched write at the end of the turn.
+
+    New entries become documents in the `messages` subcollection; the parent
+    keeps `turn_count` and the rolling `recent` window so history and counts
+    never depend on conversation length. Documents written before that layout
+    still carry the full `conversation` array until migrate_conversations.py
+    has run, and are read from it transparently.
+    """
+
+    def __init__(self, user_id, doc_ref, exists, data, update_time=None, checked=False):
+        self.user_id = user_id
+        self.doc_ref = doc_ref
+        self.exists = exists
+        self.data = data if exists else {}
+        # Opening writes (start_chat/new_chat) are `checked`: committed only if
+        # the document is still at `update_time` (or still absent)
+        self.update_time = update_time
+        self.checked = checked
+        self.replaces = None
+        self._updates = {}
+        self._appended = []
+        self._query_vector = None
+
+    @classmethod
+    @timed("firestore.load")
+    async def load(cls, user_id):
+        doc_ref = get_db().collection("conversations").document(user_id)
+        snapshot = await doc_ref.get()
+        data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        await remember_session(user_id, snapshot.exists, data, snapshot.update_time)
+        return cls(user_id, doc_ref, snapshot.exists, data, snapshot.update_time)
+
+    @classmethod
+    @timed("firestore.load_opening")
+    async def load_for_opening(cls, user_id, fresh=False):
+        """🔹 Conversation and user name for start_chat/new_chat: (ctx, user_name)
+
+        Both come from the per-user caches when fresh; whatever is missing is
+        fetched in a single batched read. The cached conversation is only a
+        hint: the context is `checked`, so commit() raises StaleSession if
+        the document changed since. `fresh=True` skips the session cache.
+        """
+        db = get_db()
+        doc_ref = db.collection("conversations").document(user_id)
+        user_ref = db.collection("users").document(user_id)
+        profile = await profile_cache.get(user_id)
+        session = None if fresh else await cached_session(user_id)
+
+        missing = ([user_ref] if profile is None else []) + ([doc_ref] if session is None else [])
+        if missing:
+            async for snapshot in db.get_all(missing):
+                data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+                if snapshot.reference.path == user_ref.path:
+                    profile = {"name": data.get("name")}
+                    await profile_cache.put(user_id, profile)
+                else:
+                    session = (snapshot.exists, data, snapshot.update_time)
+                    await remember_session(user_id, *session)
+
+        return cls(user_id, doc_ref, *session, checked=True), profile.get("name") or "คุณ"
+
+    def restart(self):
+        """🔹 An empty context whose commit() replaces this conversation document (new_chat)"""
+        ctx = ConversationContext(self.user_id, self.doc_ref, False, {}, self.update_time, self.checked)
+        ctx.replaces = self.data if self.exists else None
+        return ctx
+
+    @property
+    def conversation(self):
+        """The last RECENT_WINDOW entries of the conversation, each with its `seq`"""
+        if "recent" in self.data:
+            entries = self.data["recent"]
+            first = self.turn_count - len(entries) + 1
+        else:
+            history = self.data.get("conversation", [])
+            entries = history[-RECENT_WINDOW:]
+            first = len(history) - len(entries) + 1
+        # Entries saved before `seq` was kept in the window are numbered by position
+        return [entry if "seq" in entry else {**entry, "seq": first + i} for i, entry in enumerate(entries)]
+
+    @property
+    def turn_count(self):
+        if "turn_count" in self.data:
+            return self.data["turn_count"]
+        return len(self.data.get("conversation", []))
+
+    def append(self, entry):
+        """Stage a new conversation entry; it gets its own message document"""
+        entry = dict(entry)
+        entry.setdefault("id", new_message_id())
+        self._appended.append(entry)
+        return entry["id"]
+
+    def update(self, fields):
+        """Stage field updates for the conversation document"""
+        self._updates.update(fields)
+
+    def get(self, field, default=None):
+        """A field of the document as it will be after commit()"""
+        return self._updates.get(field, self.data.get(field, default))
+
+    async def query_vector(self, query):
+        """🔹 Embedding of this turn's message, computed once for the answer and the follow-up"""
+        if self._query_vector is None:
+            self._query_vector = asyncio.ensure_future(embed_query(query))
+        # Shielded: a cancelled follow-up must not cancel the answer's embedding
+        return await asyncio.shield(self._query_vector)
+
+    @timed("firestore.commit")
+    async def commit(self):
+        """Write every staged change in one batch"""
+        if not self._appended and not self._updates:
+            return
+
+        batch = get_db().batch()
+        session_id = self._updates.get("session_id") or self.data.get("session_id") or new_session_id()
+        turn_count = self.turn_count + len(self._appended)
+        for seq, entry in enumerate(self._appended, start=self.turn_count + 1):
+            entry["seq"] = seq
+        recent = (self.conversation + self._appended)[-RECENT_WINDOW:]
+
+        messages_ref = self.doc_ref.collection("messages")
+        for entry in self._appended:
+            batch.set(messages_ref.document(entry["id"]), {
+                **entry,
+                "session_id": session_id,
+                "timestamp": firestore.SERVER_TIMESTAMP
+            })
+
+        db = get_db()
+        if not self.exists:
+            initial_data = {
+                "recent": recent,
+                "turn_count": turn_count,
+                "session_id": session_id,
+                "questions": [],
+                "last_question_index": 0,
+                "risk_level": "ไม่ระบุ",
+                "timestamp": firestore.SERVER_TIMESTAMP
+            }
+            initial_data.update(self._updates)
+            if self.checked and self.replaces is not None:
+                # Replace the document it was read as, field by field, only if it is unchanged
+                cleared = {field.split(".")[0] for field in self.replaces} - set(initial_data)
+                batch.update(self.doc_ref, {**{field: firestore.DELETE_FIELD for field in cleared}, **initial_data},
+                             option=db.write_option(last_update_time=self.update_time))
+            elif self.checked:
+                batch.create(self.doc_ref, initial_data)
+            else:
+                batch.set(self.doc_ref, initial_data)
+        else:
+            update_data = dict(self._updates)
+            if self._appended:
+                update_data["recent"] = recent
+                if "turn_count" in self.data:
+                    update_data["turn_count"] = firestore.Increment(len(self._appended))
+                else:
+                    update_data["turn_count"] = turn_count
+            if "session_id" not in self.data:
+                update_data["session_id"] = session_id
+            update_data.setdefault("timestamp", firestore.SERVER_TIMESTAMP)
+            if self.checked and self.update_time is not None:
+                batch.update(self.doc_ref, update_data, option=db.write_option(last_update_time=self.update_time))
+            else:
+                batch.update(self.doc_ref, update_data)
+        try:
+            results = await batch.commit()
+        except (FailedPrecondition, Conflict) as e:
+            if not self.checked:
+                raise
+            # Another worker wrote the conversation since it was cached
+            await session_cache.invalidate(self.user_id)
+            raise StaleSession(str(e)) from e
+
+        self.exists = True
+        # The conversation document is the batch's last write
+        self.update_time = results[-1].update_time if results else None
+        self.data.update(self._updates)
+        self.data.update({"recent": recent, "turn_count": turn_count, "session_id": session_id})
+        self._appended = []
+        self._updates = {}
+        await remember_session(self.user_id, True, self.data, self.update_time)
+
+
+class StaleSession(RuntimeError):
+    """The conversation changed after it was cached; the opening write was not applied"""
+
+
+async def with_fresh_retry(opening, user_id, *args):
+    """🔹 Run an opening write from the cached conversation, then once more from Firestore if it was stale"""
+    try:
+        return await opening(user_id, *args, fresh=False)
+    except StaleSession:
+        print(f"⚠️ Cached conversation of {user_id} was stale; reloading it")
+        return await opening(user_id, *args, fresh=True)
+
+
+async def prepare_conversation_response(ctx, query):
     """Prepare the core response logic for the conversation"""
     if not query.strip():
         return {"response": "ฉันไม่ได้ยินคุณเลยค่ะ ช่วยพูดอีกครั้งได้ไหมคะ?"}
 
-    context = get_relevant_context_from_db(query)
-    conversation_history = get_conversation_history(user_id)
-    
-    prompt = generate_rag_prompt(query, context, conversation_history)
+    conversation_history = get_conversation_history(ctx)
+    query_vector = await ctx.query_vector(query)
+
+    cached_answer = await lookup_cached_answer(query_vector, conversation_history)
+    if cached_answer:
+        return cached_answer, conversation_history
+
+    prompt = await build_conversation_prompt(query, query_vector, conversation_history)
     
     try:
-        response = genai_model.generate_content(prompt)
-        ai_response = response.text.strip() if response and response.text.strip() else "ขอโทษค่ะ ฉันไม่สามารถประมวลผลคำขอของคุณได้ในขณะนี้"
+        started = time.perf_counter()
+        # The user is waiting on this call, so it may be hedged (LLM_HEDGE_AFTER)
+        response = await llm.generate("answer", prompt, model=get_answer_model, deadline=ANSWER_TIMEOUT, hedge=True)
+        ai_response = response.text.strip() if response and response.text.strip() else None
+        if ai_response:
+            await store_answer(query_vector, conversation_history, ai_response, time.perf_counter() - started)
+        else:
+            ai_response = "ขอโทษค่ะ ฉันไม่สามารถประมวลผลคำขอของคุณได้ในขณะนี้"
     except Exception as e:
         print(f"❌ AI generation error: {e}")
         ai_response = "ขอโทษค่ะ ฉันไม่สามารถประมวลผลคำขอของคุณได้ในขณะนี้"
     
     return ai_response, conversation_history
 
-def handle_followup_and_risk(user_id, conversation_history, ai_response):
-    followup_question = generate_followup_question(conversation_history)
-    
-    conversation_count = get_conversation_count(user_id)
-    risk_result = None
-    
+
+async def build_conversation_prompt(query, query_vector, conversation_history):
+    """🔹 Retrieve context and assemble the token-budgeted RAG prompt for one turn
+
+    The fixed instructions are the answer model's system instruction, so only
+    the context, history and question are sent per call.
+    """
+    chunks = await get_relevant_context_from_db(query, query_vector)
+    return build_rag_prompt(query, chunks, conversation_history)
+
+
+async def lookup_cached_answer(query_vector, conversation_history):
+    """🔹 Reuse an answer to a near-identical question, only for turns without history
+
+    Once a conversation has history the prompt is personalised with it, so
+    those turns always go to the model (the retrieved context is still cached).
+    """
+    if conversation_history or query_vector is None:
+        return None
+    return await answer_cache.lookup(query_vector)
+
+
+async def store_answer(query_vector, conversation_history, ai_response, cost):
+    if not conversation_history and query_vector is not None:
+        await answer_cache.store(query_vector, ai_response, cost)
+
+
+async def get_cache_stats():
+    return {
+        "context": await context_cache.stats(),
+        "answer": await answer_cache.stats(),
+        "profile": profile_cache.stats(),
+        "session": session_cache.stats()
+    }
+
+async def wait_for_result(task, timeout, label):
+    """🔹 Wait for a concurrent LLM call, cancelling it after timeout seconds"""
+    if task is None:
+        return None
+    try:
+        return await asyncio.wait_for(task, timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"❌ {label} timed out after {timeout}s")
+    except Exception as e:
+        print(f"❌ Error in {label}: {e}")
+    return None
+
+
+def track_risk(ctx, query):
+    """🔹 Fold this turn's message into the running risk state
+
+    Returns the new state if it changed enough to be worth re-classifying,
+    otherwise None. The state is staged on the context and saved with the
+    turn, and so is the risk_pending marker of a classification about to be
+    queued, which holds off further ones until the risk job clears it.
+    """
+    risk_state, red_flag = update_risk_state(ctx.data.get("risk_state"), query)
+    ctx.update({"risk_state": risk_state})
+    if needs_classification(risk_state, ctx.data.get("risk_classification"), red_flag, ctx.data.get("risk_pending")):
+        ctx.update({"risk_pending": queued(risk_state)})
+        return risk_state
+    return None
+
+
+def take_risk_result(ctx):
+    """🔹 Hand out a classification the risk job finished since the last turn, once"""
+    classification = ctx.data.get("risk_classification")
+    if not classification or classification.get("delivered", True):
+        return None
+    ctx.update({"risk_classification.delivered": True})
+    return {
+        "status": "success" if classification["level"] in ("green", "red") else "error",
+        "original_risk_level": classification["level"],
+        "risk_level": ctx.data.get("risk_level")
+    }
+
+
+async def schedule_risk_analysis(ctx, risk_state):
+    """🔹 Queue the risk classification of this turn's state; returns the job id"""
+    if not risk_state:
+        return None
+    session_id = ctx.data.get("session_id")
+    return await job_queue.enqueue(
+        "risk_analysis",
+        {"user_id": ctx.user_id, "session_id": session_id, "risk_state": risk_state},
+        ordering_key=ctx.user_id,
+        idempotency_key=f"{ctx.user_id}:{session_id}:{risk_state['user_turns']}"
+    )
+
+
+async def schedule_summary(ctx):
+    """🔹 Queue folding the turns behind the kept window into the rolling summary"""
+    turns = unsummarized_turns(ctx)[:-SUMMARY_KEEP_TURNS]
+    if len(turns) < SUMMARY_BATCH_TURNS:
+        return None
+    return await job_queue.enqueue(
+        "summarize_history",
+        {"user_id": ctx.user_id, "session_id": ctx.data.get("session_id"), "turns": turns},
+        ordering_key=ctx.user_id,
+        idempotency_key=f"{ctx.user_id}:{turns[-1]['id']}"
+    )
+
+
+@job_queue.handler("summarize_history")
+async def summarize_history(user_id, session_id, turns):
+    """🔹 Background job: fold turns into `summary` (incrementally, from the previous summary)"""
+    chat_ref = get_db().collection("conversations").document(user_id)
+    snapshot = await chat_ref.get()
+    data = snapshot.to_dict() if snapshot.exists else {}
+    if data.get("session_id") != session_id:
+        return {"status": "stale"}
+
+    covered = summary_coverage(data, ConversationContext(user_id, chat_ref, True, data).conversation)
+    # Jobs queued before turns carried their seq have nothing to compare and are dropped
+    turns = [entry for entry in turns if entry.get("seq", 0) > covered]
+    if not turns:
+        return {"status": "skipped"}
+
+    prompt = build_summary_prompt(data.get("summary"), turns)
+    response = await llm.generate("summary", prompt, deadline=ANSWER_TIMEOUT)
+    summary = response.text.strip() if response and response.text else ""
+    if not summary:
+        raise RuntimeError("empty summary")
+
+    await chat_ref.update({
+        "summary": summary,
+        "summary_seq": turns[-1]["seq"],
+        "summary_upto": firestore.DELETE_FIELD
+    })
+    await session_cache.invalidate(user_id)
+    return {"status": "success", "turns": len(turns)}
+
+
+async def next_followup(ctx, query):
+    """🔹 This turn's follow-up question: from the question bank, Gemini only once it runs out
+
+    Questions asked this session are tracked in `questions` (bank ids) and
+    `last_question_index`, staged on the context and saved with the turn.
+    """
+    risk_state = ctx.get("risk_state") or {}
+    # Like the Gemini prompt, nothing to follow up on before the user's second message
+    if risk_state.get("user_turns", 0) < 2:
+        record_followup("none")
+        return None
+
+    if FOLLOWUP_MODE == "bank":
+        try:
+            loop = asyncio.get_running_loop()
+            # Loaded at warm-up from the vectors built at deploy time (python -m ai.followup)
+            bank = await loop.run_in_executor(retrieval_executor, get_question_bank)
+            asked = list(ctx.get("questions") or [])
+            index = bank.select(asked, ctx.get("last_question_index"), risk_state, await ctx.query_vector(query))
+            if index is not None:
+                question = bank.questions[index]
+                ctx.update({"questions": asked + [question["id"]], "last_question_index": index})
+                record_followup("bank")
+                return question["text"]
+        except Exception as e:
+            print(f"❌ Question bank unavailable: {e}")
+        if not FOLLOWUP_LLM_FALLBACK:
+            record_followup("none")
+            return None
+
+    question = await generate_followup_question(get_conversation_history(ctx))
+    record_followup("llm" if question else "none")
+    return question
+
+
+def start_followup(ctx, query):
+    """🔹 Start picking the follow-up so it runs alongside the main answer
+
+    Called after track_risk(), so factors from this very message are not asked about.
+    """
+    return asyncio.create_task(next_followup(ctx, query))
+
+
+async def collect_followup(followup_task):
+    # A slow follow-up is dropped rather than holding back the answer
+    return await wait_for_result(followup_task, FOLLOWUP_TIMEOUT, "follow-up question")
+
+
+def compose_response(ai_response, followup_question, risk_result):
+    """🔹 Append the follow-up question and risk summary to the answer text"""
     if followup_question:
-        ai_response += f"\n\nคำถามถัดไป: {followup_question}"
+        ai_response += f"\n\n{FOLLOWUP_PREFIX} {followup_question}"
     
-    if conversation_count >= 5 and conversation_count % 5 == 0:
-        risk_result = analyze_risk(user_id)
-        
-        if risk_result and risk_result["status"] == "success":
-            risk_level = risk_result["risk_level"]
-            ai_response += f"\n\n[{risk_level}]"
-            ai_response += "\n\nการวิเคราะห์เสร็จสิ้น หากมีข้อสงสัยเพิ่มเติมกรุณาเริ่มการสนทนาใหม่"
+    if risk_result and risk_result["status"] == "success":
+        risk_level = risk_result["risk_level"]
+        ai_response += f"\n\n[{risk_level}]"
+        ai_response += "\n\nการวิเคราะห์เสร็จสิ้น หากมีข้อสงสัยเพิ่มเติมกรุณาเริ่มการสนทนาใหม่"
     
-    return ai_response, risk_result
+    return ai_response
+
 
-def converse(user_id, query):
-    """Main conversation function with reduced complexity"""
-    ai_response, conversation_history = prepare_conversation_response(user_id, query)
+async def handle_followup_and_risk(ctx, followup_task, ai_response):
+    followup_question = await collect_followup(followup_task)
+    risk_result = take_risk_result(ctx)
+    return compose_response(ai_response, followup_question, risk_result), risk_result
+
+@timed("converse")
+async def converse(user_id, query):
+    """Main conversation function with reduced complexity
+
+    Risk classification runs as a background job; its result is returned
+    (and appended to the reply) on the first turn after it finishes, and is
+    also pushed over FCM.
+    """
+    ctx = await ConversationContext.load(user_id)
+
+    risk_state = track_risk(ctx, query)
+    followup_task = start_followup(ctx, query)
+
+    ai_response, conversation_history = await prepare_conversation_response(ctx, query)
     
-    ai_response, risk_result = handle_followup_and_risk(user_id, conversation_history, ai_response)
+    ai_response, risk_result = await handle_followup_and_risk(ctx, followup_task, ai_response)
     
     risk_level = risk_result["risk_level"] if risk_result and "risk_level" in risk_result else None
     
-    save_conversation_to_firestore(user_id, {"query": query, "response": ai_response}, risk_level=risk_level)
+    await save_conversation_to_firestore(ctx, {"query": query, "response": ai_response})
+    risk_job_id = await schedule_risk_analysis(ctx, risk_state)
+    await schedule_summary(ctx)
     
     return {
         "response": ai_response, 
-        "risk_level": risk_level
+        "risk_level": risk_level,
+        "risk_job_id": risk_job_id
     }
 
 
-def save_conversation_to_firestore(user_id, conversation_data, risk_level=None):
-    """🔹 Save conversation data (query, response) to Firestore with message ID"""
+async def converse_stream(ctx, query, result):
+    """🔹 Streaming variant of converse()
+
+    Yields (event, data) pairs: "token" chunks as Gemini produces them, then
+    "followup" once that call finishes and "risk" if a classification is
+    ready, then "done". The composed turn is left in `result` so the caller
+    can persist it with save_streamed_turn() after the stream has closed;
+    that is also when a new risk job is queued.
+    """
+    result["risk_state"] = track_risk(ctx, query)
+    followup_task = start_followup(ctx, query)
     try:
-        doc_ref = db.collection("conversations").document(user_id)
-        doc = doc_ref.get()
+        conversation_history = get_conversation_history(ctx)
+        query_vector = await ctx.query_vector(query)
 
-        message_id = f"{user_id}_{int(time.time() * 1000)}"
-        
-        conversation_data["id"] = message_id
+        ai_response = await lookup_cached_answer(query_vector, conversation_history)
+        if ai_response:
+            yield "token", {"text": ai_response}
+        else:
+            prompt = await build_conversation_prompt(query, query_vector, conversation_history)
 
-        if not doc.exists:
-            doc_ref.set({
-                "conversation": [],
-                "questions": [],
-                "last_question_index": 0,
-                "risk_level": "ไม่ระบุ"
-            })
+            chunks = []
+            try:
+                started = time.perf_counter()
+                async for text in llm.stream("answer", prompt, model=get_answer_model, deadline=ANSWER_TIMEOUT):
+                    chunks.append(text)
+                    yield "token", {"text": text}
+                ai_response = "".join(chunks).strip()
+                if ai_response:
+                    await store_answer(query_vector, conversation_history, ai_response, time.perf_counter() - started)
+            except Exception as e:
+                print(f"❌ AI streaming error: {e}")
+                ai_response = "".join(chunks).strip()
 
-        update_data = {
-            "conversation": firestore.ArrayUnion([conversation_data]),
-            "timestamp": firestore.SERVER_TIMESTAMP
-        }
+        if not ai_response:
+            ai_response = "ขอโทษค่ะ ฉันไม่สามารถประมวลผลคำขอของคุณได้ในขณะนี้"
+            yield "token", {"text": ai_response}
+
+        followup_question = await collect_followup(followup_task)
+        risk_result = take_risk_result(ctx)
+        if followup_question:
+            yield "followup", {"question": followup_question}
+
+        risk_level = risk_result["risk_level"] if risk_result and "risk_level" in risk_result else None
+        if risk_level:
+            yield "risk", {"risk_level": risk_level}
+
+        result["query"] = query
+        result["response"] = compose_response(ai_response, followup_question, risk_result)
+        result["risk_level"] = risk_level
+
+        yield "done", {}
+    finally:
+        # The client may disconnect mid-stream; do not leave the follow-up running
+        if not followup_task.done():
+            followup_task.cancel()
+
+
+async def save_streamed_turn(ctx, result):
+    """🔹 Persist a turn produced by converse_stream() once its stream has closed"""
+    if "response" not in result:
+        return None
+    message_id = await save_conversation_to_firestore(ctx, {"query": result["query"], "response": result["response"]})
+    await schedule_risk_analysis(ctx, result["risk_state"])
+    await schedule_summary(ctx)
+    return message_id
+
+
+async def save_conversation_to_firestore(ctx, conversation_data, risk_level=None):
+    """🔹 Save conversation data (query, response) to Firestore with message ID"""
+    try:
+        message_id = ctx.append(conversation_data)
+        ctx.update({"timestamp": firestore.SERVER_TIMESTAMP})
         
         if risk_level:
-            update_data["risk_level"] = risk_level
+            ctx.update({"risk_level": risk_level})
             
-        doc_ref.update(update_data)
+        await ctx.commit()
         
         return message_id
 
@@ -203,19 +638,17 @@ def save_conversation_to_firestore(user_id, conversation_data, risk_level=None):
         return None
 
 
-def analyze_risk(user_id):
-    """🔹 Analyze the user's risk level after 5 questions"""
-    doc_ref = db.collection("conversations").document(user_id)
-    doc = doc_ref.get()
+async def analyze_risk(risk_state, client=llm):
+    """🔹 Classify the user's risk level from the running risk state of the session
 
-    if not doc.exists or "conversation" not in doc.to_dict():
+    `client` lets batch jobs (rescore_risk.py) call Gemini under their own limits.
+    """
+    if not risk_state:
         return {"status": "error", "message": "ไม่พบข้อมูลการสนทนา"}
 
-    conversation = doc.to_dict().get("conversation", [])
-    
-    if len(conversation) >= 5:
+    if risk_state["user_turns"] > 0:
         analysis_prompt = f"""
-        Analyze the user's health from the conversation history and classify them as:
+        Analyze the user's health from the risk factors collected during the conversation and classify them as:
         - "green" (low risk)
         - "red" (high risk)
         
@@ -224,16 +657,16 @@ def analyze_risk(user_id):
         - Red (High Risk): Symptoms possibly related to NCDs, family history of NCDs, lack of exercise, unbalanced diet, smoking, regular alcohol consumption.
         
         -------------------------
-        ### Conversation History:
-        {conversation[-5:]}
+        ### Risk Factors Reported By The User:
+        {describe_risk_state(risk_state)}
         
         ### Instructions:
         1. First line of your response must be ONLY ONE of these exact words: "green" or "red" based on your analysis.
         2. On the next line, explain WHY you classified them this way in Thai language.
-        3. Provide specific health-related reasons based on their conversation history.
+        3. Provide specific health-related reasons based on the reported risk factors.
         """
         try:
-            response = genai_model.generate_content(analysis_prompt)
+            response = await client.generate("risk", analysis_prompt, deadline=RISK_TIMEOUT)
             full_response = response.text.strip() if response and response.text.strip() else "Unable to determine."
             
             lines = full_response.split('\n', 1)
@@ -248,10 +681,6 @@ def analyze_risk(user_id):
                 original_risk_level = "ไม่ระบุ"
                 full_risk_assessment = "ไม่สามารถระบุระดับความเสี่ยงได้"
             
-            doc_ref.update({
-                "risk_level": full_risk_assessment
-            })
-            
             return {
                 "status": "success", 
                 "original_risk_level": original_risk_level,
@@ -264,158 +693,314 @@ def analyze_risk(user_id):
         return {"status": "pending", "message": "ต้องการข้อมูลเพิ่มเติม"}
 
 
-def get_relevant_context_from_db(query):
-    """🔹 Retrieve relevant context from Chroma DB."""
+@job_queue.handler("risk_analysis")
+async def run_risk_analysis(user_id, session_id, risk_state):
+    """🔹 Background job: classify, store the result on the conversation, notify over FCM"""
+    risk_result = await analyze_risk(risk_state)
+    if risk_result["status"] != "success":
+        # Raising lets the queue retry with backoff
+        raise RuntimeError(risk_result["message"])
+
+    db = get_db()
+    chat_ref = db.collection("conversations").document(user_id)
+    level = risk_result["original_risk_level"]
+    for attempt in range(3):
+        snapshot = await chat_ref.get()
+        data = snapshot.to_dict() if snapshot.exists else {}
+        if data.get("session_id") != session_id:
+            # The user started a new chat meanwhile; this result belongs to the old session
+            return {"status": "stale"}
+
+        update = {
+            "risk_level": risk_result["risk_level"],
+            "risk_classification": {**classified(risk_state, level), "delivered": False}
+        }
+        if (data.get("risk_pending") or {}).get("at_turn", 0) <= risk_state["user_turns"]:
+            # Nothing newer was queued behind this one
+            update["risk_pending"] = firestore.DELETE_FIELD
+        try:
+            await chat_ref.update(update, option=db.write_option(last_update_time=snapshot.update_time))
+            break
+        except FailedPrecondition:
+            # A chat turn was saved in between, maybe queuing a newer classification; look again
+            if attempt == 2:
+                raise
+    await session_cache.invalidate(user_id)
+
+    await job_queue.enqueue(
+        "notification",
+        {
+            "user_id": user_id,
+            "title": "ผลการประเมินความเสี่ยง",
+            "body": risk_result["risk_level"],
+            "data": {"type": "risk_level", "risk_level": level, "session_id": session_id}
+        },
+        ordering_key=user_id,
+        idempotency_key=f"risk:{user_id}:{session_id}:{risk_state['user_turns']}"
+    )
+    # The same risk_level text the next /chat response carries, so the app shows it once
+    return {"status": "success", "level": level, "risk_level": risk_result["risk_level"]}
+
+
+async def embed_query(query):
+    """🔹 Embed the query once; retrieval and both caches reuse the vector"""
     try:
-        search_results = vector_db.similarity_search(query, k=5)
-        context = "\n".join([doc.page_content for doc in search_results])
-        return context
+        loop = asyncio.get_running_loop()
+        with span("embed"):
+            return await loop.run_in_executor(retrieval_executor, lambda: get_embeddings().embed_query(query))
     except Exception as e:
-        print(f"❌ Error retrieving context: {e}")
-        return ""
+        print(f"❌ Error embedding query: {e}")
+        return None
+
 
-def get_conversation_history(user_id, limit=5):
-    """🔹 ดึงประวัติการสนทนาเฉพาะ 5 รายการล่าสุด"""
+async def get_relevant_context_from_db(query, query_vector=None):
+    """🔹 Retrieve relevant chunks from Chroma DB, best match first"""
     try:
-        doc_ref = db.collection("conversations").document(user_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            history = doc.to_dict().get("conversation", [])
-            last_n_conversations = history[-limit:]  
+        if query_vector is None:
+            query_vector = await embed_query(query)
+        if query_vector is None:
+            return []
+
+        cached_context = await context_cache.lookup(query_vector)
+        if cached_context is not None:
+            # Entries cached before chunks were kept apart hold one joined string
+            return [cached_context] if isinstance(cached_context, str) else cached_context
+
+        started = time.perf_counter()
+        with span("retrieval"):
+            chunks = await retrieve(query, query_vector)
+        await context_cache.store(query_vector, chunks, time.perf_counter() - started)
+        return chunks
+    except Exception as e:
+        print(f"❌ Error retrieving context: {e}")
+        return []
+
+def summary_coverage(data, window):
+    """🔹 seq of the last turn the rolling summary covers (0 when none)
+
+    Summaries used to record the id of their last turn in `summary_upto`.
+    Ids do not order across the legacy `{user_id}_{ms}` and ULID formats, so
+    that id is only looked up in the window; once it has left the window
+    every turn still in it is newer.
+    """
+    if "summary_seq" in data:
+        return data["summary_seq"]
+    summary_upto = data.get("summary_upto")
+    for entry in window:
+        if summary_upto and entry.get("id") == summary_upto:
+            return entry["seq"]
+    return 0
 
-           
-            formatted_history = []
-            for entry in last_n_conversations:
-                query = entry.get("query", "ไม่ทราบคำถาม")
-                response = entry.get("response", "ไม่มีคำตอบ")
-                formatted_history.append(f"{query} {response}")
 
-            return "\n".join(formatted_history)
+def unsummarized_turns(ctx):
+    """🔹 User turns in the recent window that the rolling summary does not cover yet"""
+    window = ctx.conversation
+    covered = summary_coverage(ctx.data, window)
+    return [
+        entry for entry in window
+        # คำทักทายจาก start_chat ไม่มีคำถาม/คำตอบ
+        if entry.get("sender") != "bot" and entry["seq"] > covered
+    ]
+
+
+def get_conversation_history(ctx):
+    """🔹 ประวัติการสนทนา: สรุปส่วนที่เก่ากว่า + รอบล่าสุดเท่าที่อยู่ใน token budget"""
+    try:
+        if ctx.exists:
+            return format_history(ctx.data.get("summary"), unsummarized_turns(ctx))
 
         return ""
     except Exception as e:
         print(f"❌ Error retrieving conversation history: {e}")
         return ""
 
-def start_chat(user_id: str, user_name: str = "คุณ"):
-    """🔹 ให้ AI ทักทายด้วยชื่อที่รับมาจาก Firestore"""
-    try:
-        chat_ref = db.collection("conversations").document(user_id)
-        doc = chat_ref.get()
-        
-        previous_risk = None
-        if doc.exists:
-            previous_risk = doc.to_dict().get("risk_level")
-        
-        initial_message = f"สวัสดี! {user_name} วันนี้คุณรู้สึกอย่างไรบ้าง? กรุณาอธิบายอาการหรือความกังวลของคุณ"
-        
-        if previous_risk and previous_risk not in ["ไม่ระบุ"]:
-            initial_message += f"\n\nจากการสนทนาครั้งก่อน คุณอยู่ในกลุ่มความเสี่ยง: {previous_risk}"
-            
-        if not doc.exists:
-            chat_ref.set({
-                "conversation": [{"sender": "bot", "message": initial_message}],
-                "risk_level": "ไม่ระบุ",
-                "timestamp": firestore.SERVER_TIMESTAMP
-            })
-        else:
-            chat_ref.update({
-                "conversation": firestore.ArrayUnion([{"sender": "bot", "message": initial_message}]),
-                "timestamp": firestore.SERVER_TIMESTAMP
-            })
+def greeting(user_name, previous_risk=None):
+    message = f"สวัสดี! {user_name} วันนี้คุณรู้สึกอย่างไรบ้าง? กรุณาอธิบายอาการหรือความกังวลของคุณ"
+    if previous_risk and previous_risk not in ["ไม่ระบุ"]:
+        message += f"\n\nจากการสนทนาครั้งก่อน คุณอยู่ในกลุ่มความเสี่ยง: {previous_risk}"
+    return message
+
 
-        return {"response": initial_message, "previous_risk": previous_risk}
+@timed("start_chat")
+async def start_chat(user_id: str, user_name: str = None):
+    """🔹 ให้ AI ทักทายด้วยชื่อที่รับมาจาก Firestore
 
+    One (batched) read when the per-user caches are cold, none when warm, and
+    one write for the greeting.
+    """
+    try:
+        return await with_fresh_retry(_start_chat, user_id, user_name)
     except Exception as e:
         print(f"❌ Error in start_chat: {e}")
         return {"response": "ขอโทษค่ะ มีข้อผิดพลาดในการเริ่มการสนทนา"}
 
 
-def get_user_name(user_id):
-    """🔹 ดึงชื่อผู้ใช้จาก Firestore"""
-    try:
-        user_doc = db.collection("users").document(user_id).get()
-        if user_doc.exists:
-            return user_doc.to_dict().get("name", "คุณ")  
-    except Exception as e:
-        print(f"❌ Error fetching user name: {e}")
-    return "คุณ"
+async def _start_chat(user_id, user_name, fresh):
+    ctx, cached_name = await ConversationContext.load_for_opening(user_id, fresh)
+    user_name = user_name or cached_name
 
-def new_chat(user_id: str):
-    """🔹 เริ่มแชทใหม่โดยการย้ายประวัติการสนทนาเดิมไปยัง sessions"""
+    previous_risk = None
+    if ctx.exists:
+        previous_risk = ctx.data.get("risk_level")
+
+    initial_message = greeting(user_name, previous_risk)
+
+    ctx.append({"sender": "bot", "message": initial_message})
+    await ctx.commit()
+
+    return {"response": initial_message, "previous_risk": previous_risk}
+
+
+@timed("new_chat")
+async def new_chat(user_id: str):
+    """🔹 เริ่มแชทใหม่โดยการย้ายประวัติการสนทนาเดิมไปยัง sessions
+
+    The reset conversation and its greeting go out as one batched write, and
+    the old session is archived only once that write went through.
+    """
     try:
-        chat_ref = db.collection("conversations").document(user_id)
-        current_chat = chat_ref.get()
-        
-        # บันทึกแชทเก่าไปยัง sessions
-        if current_chat.exists:
-            current_data = current_chat.to_dict()
-            
-            if current_data and "conversation" in current_data and current_data["conversation"]:
-                session_id = str(int(time.time() * 1000))
-                chat_ref.collection("sessions").document(session_id).set({
-                    "conversation": current_data.get("conversation", []),
-                    "risk_level": current_data.get("risk_level", "ไม่ระบุ"),
-                    "timestamp": current_data.get("timestamp", firestore.SERVER_TIMESTAMP),
-                    "session_id": session_id
-                })
-        
-        # ล้างข้อมูลการสนทนาปัจจุบัน
-        new_session_id = str(int(time.time() * 1000))
-        chat_ref.set({
-            "conversation": [],
-            "risk_level": "ไม่ระบุ",
-            "timestamp": firestore.SERVER_TIMESTAMP,
-            "session_id": new_session_id
-        })
-
-        # เรียกใช้ start_chat เพื่อเริ่มต้นการสนทนาใหม่
-        user_name = get_user_name(user_id)
-        start_response = start_chat(user_id, user_name)
-        
-        # ส่งค่ากลับพร้อมสถานะว่าเป็นการเริ่มแชทใหม่
-        return {
-            "response": start_response["response"], 
-            "is_new_chat": True,
-            "session_id": new_session_id
-        }
-    
+        return await with_fresh_retry(_new_chat, user_id)
     except Exception as e:
         print(f"❌ Error in new_chat: {e}")
         return {"response": "ขอโทษค่ะ มีข้อผิดพลาดในการเริ่มแชทใหม่"}
 
 
-def get_specific_message(user_id, message_id):
+async def _new_chat(user_id, fresh):
+    current_chat, user_name = await ConversationContext.load_for_opening(user_id, fresh)
+
+    # ล้างข้อมูลการสนทนาปัจจุบัน: the restarted context replaces the old
+    # document together with the greeting, if nobody wrote it since it was read
+    next_session_id = new_session_id()
+    ctx = current_chat.restart()
+    ctx.update({"session_id": next_session_id})
+    initial_message = greeting(user_name)
+    ctx.append({"sender": "bot", "message": initial_message})
+    await ctx.commit()
+
+    # บันทึกแชทเก่าไปยัง sessions
+    archive_job_id = None
+    if current_chat.exists and current_chat.turn_count:
+        current_data = current_chat.data
+        # ข้อความของ session อยู่ใน messages แล้ว (อ้างอิงด้วย session_id) จึงเก็บแค่ข้อมูลสรุป
+        session_id = current_data.get("session_id") or new_session_id()
+        session_data = {
+            "risk_level": current_data.get("risk_level", "ไม่ระบุ"),
+            "timestamp": current_data.get("timestamp", firestore.SERVER_TIMESTAMP),
+            "session_id": session_id,
+            "turn_count": current_chat.turn_count
+        }
+        if current_data.get("conversation"):
+            # เอกสารรูปแบบเดิมที่ยังไม่ได้ migrate: ข้อความอยู่ใน array เท่านั้น
+            session_data["conversation"] = current_data["conversation"]
+        # เขียน sessions ใน background job ไม่ต้องรอก่อนตอบกลับ
+        archive_job_id = await job_queue.enqueue(
+            "archive_session",
+            {"user_id": user_id, "session_id": session_id, "session_data": session_data},
+            ordering_key=user_id,
+            idempotency_key=f"{user_id}:{session_id}"
+        )
+
+    # ส่งค่ากลับพร้อมสถานะว่าเป็นการเริ่มแชทใหม่
+    return {
+        "response": initial_message,
+        "is_new_chat": True,
+        "session_id": next_session_id,
+        "archive_job_id": archive_job_id
+    }
+
+
+@job_queue.handler("archive_session")
+async def archive_session(user_id, session_id, session_data):
+    """🔹 Background job: write the finished session's summary to sessions/{session_id}"""
+    chat_ref = get_db().collection("conversations").document(user_id)
+    await chat_ref.collection("sessions").document(session_id).set(session_data)
+    return {"session_id": session_id}
+
+
+@timed("firestore.get_message")
+async def get_specific_message(user_id, message_id):
     """🔹 ดึงข้อความสนทนาตาม message_id ที่ระบุ"""
     try:
         
-        doc_ref = db.collection("conversations").document(user_id)
-        doc = doc_ref.get()
+        doc_ref = get_db().collection("conversations").document(user_id)
+        messages_ref = doc_ref.collection("messages")
+
+        # message_id คือ key ของเอกสารใน messages อ่านเอกสารเดียว
+        message_doc = await messages_ref.document(message_id).get()
+        if message_doc.exists:
+            return {"message": message_doc.to_dict().get("response", "")}
+
+        if is_ulid(message_id):
+            return {"error": "ไม่พบข้อความที่ระบุ"}
+
+        # id รูปแบบเดิม ({user_id}_{ms}) ที่ migrate มาแล้วจะเก็บไว้ใน legacy_id
+        query = messages_ref.where(filter=FieldFilter("legacy_id", "==", message_id)).limit(1)
+        async for legacy_doc in query.stream():
+            return {"message": legacy_doc.to_dict().get("response", "")}
+
+        # เอกสารรูปแบบเดิมที่ยังเก็บข้อความไว้ใน array (ยังไม่ได้ migrate)
+        doc = await doc_ref.get()
         
         if not doc.exists:
             return {"error": "ไม่พบข้อมูลผู้ใช้"}
         
-        conversation = doc.to_dict().get("conversation", [])
-            
-        try:
-            message_index = int(message_id)
-            if 0 <= message_index < len(conversation):
-                return {"message": conversation[message_index].get("response", "")}
-            else:
-                return {"error": "ไม่พบข้อความที่ระบุ"}
-        except ValueError:
-            for message in conversation:
-                if message.get("id") == message_id:
-                    return {"message": message.get("response", "")}
-            return {"error": "ไม่พบข้อความที่ระบุ"}
+        for message in doc.to_dict().get("conversation", []):
+            if message.get("id") == message_id:
+                return {"message": message.get("response", "")}
+        return {"error": "ไม่พบข้อความที่ระบุ"}
             
     except Exception as e:
         print(f"❌ Error fetching specific message: {e}")
         traceback.print_exc()
         return {"error": f"ข้อผิดพลาดในการค้นหาข้อความ: {str(e)}"}
 
+def message_summary(snapshot):
+    data = snapshot.to_dict()
+    timestamp = data.get("timestamp")
+    return {
+        "id": snapshot.id,
+        "session_id": data.get("session_id"),
+        "seq": data.get("seq"),
+        "sender": data.get("sender", "user"),
+        "query": data.get("query"),
+        "response": data.get("response") or data.get("message"),
+        "timestamp": timestamp.isoformat() if hasattr(timestamp, "isoformat") else timestamp
+    }
+
+
+@timed("firestore.list_messages")
+async def get_messages(user_id, after=None, before=None, limit=MESSAGE_PAGE_SIZE, session_id=None):
+    """🔹 One page of messages, ordered by id (= time, since ids are ULIDs)
+
+    `after` pages forward from a message id, `before` pages backward (newest
+    first, for the history screen). The returned cursor is the id to pass as
+    `after`/`before` for the next page, or None when there is no more.
+    """
+    limit = max(1, min(int(limit), MAX_MESSAGE_PAGE_SIZE))
+    query = get_db().collection("conversations").document(user_id).collection("messages")
+    if session_id:
+        query = query.where(filter=FieldFilter("session_id", "==", session_id))
+
+    if before:
+        query = query.order_by("__name__", direction="DESCENDING").start_after({"__name__": before})
+    else:
+        query = query.order_by("__name__")
+        if after:
+            query = query.start_after({"__name__": after})
+
+    # One extra document tells whether another page exists
+    snapshots = [snapshot async for snapshot in query.limit(limit + 1).stream()]
+    messages = [message_summary(snapshot) for snapshot in snapshots[:limit]]
+    return {
+        "messages": messages,
+        "next_cursor": messages[-1]["id"] if len(snapshots) > limit else None
+    }
+
+
 def send_fcm_notification(token, title, body, data=None):
     """ส่งการแจ้งเตือนผ่าน FCM API v1 โดย Firebase Admin SDK"""
+    from firebase_admin import messaging
+
     try:
         message = messaging.Message(
             notification=messaging.Notification(
@@ -425,25 +1010,26 @@ def send_fcm_notification(token, title, body, data=None):
             data=data or {},
             token=token
         ) 
-        response = messaging.send(message)
+        response = get_fcm().send(message)
         print(f"Successfully sent message: {response}")
         return True
     except Exception as e:
         print(f"Error sending message: {e}")
         return False
 
-def get_conversation_count(user_id):
-    """🔹 Get the count of conversation entries for a user"""
-    try:
-        doc_ref = db.collection("conversations").document(user_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            return 0
-            
-        conversation = doc.to_dict().get("conversation", [])
-        return len(conversation)
-        
-    except Exception as e:
-        print(f"❌ Error getting conversation count: {e}")
-        return 0
\ No newline at end of file
+@job_queue.handler("notification")
+async def deliver_notification(user_id, title, body, data=None):
+    """🔹 Background job: look up the user's FCM token and send the notification"""
+    user_doc = await get_db().collection("users").document(user_id).get()
+    if not user_doc.exists:
+        return {"success": False, "error": "User not found"}
+
+    fcm_token = user_doc.to_dict().get("fcmToken")
+    if not fcm_token:
+        return {"success": False, "error": "FCM token not found for user"}
+
+    # FCM only accepts string values in the data payload
+    data = {key: str(value) for key, value in (data or {}).items()}
+    if not await asyncio.to_thread(send_fcm_notification, fcm_token, title, body, data):
+        raise RuntimeError("FCM send failed")
+    return {"success": True}
@@ -0,0 +1,152 @@
+"""🔹 Local follow-up questions from a curated NCD question bank
+
+The bank (question_bank.json) covers diet, exercise, family history, sleep,
+stress, smoking, alcohol and symptoms. Its embeddings depend on the
+embedding model, so they are built at deploy time, next to the model
+download, and the app only reads them: picking a question costs one small
+matrix product per turn instead of a Gemini call. The app refuses to load
+a missing or stale file rather than writing one itself, which would fail on
+read-only deployments and race between workers.
+
+    python -m ai.followup        # (re)build question_bank.npz for the current model
+"""
+import hashlib
+import json
+import os
+from collections import Counter
+
+import numpy as np
+from decouple import config
+
+from ai.resources import embedding_model_name, get_embeddings
+
+
+BANK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "question_bank.json")
+QUESTION_VECTORS_FILE = config("QUESTION_VECTORS_FILE", default=os.path.splitext(BANK_FILE)[0] + ".npz")
+# bank: pick from the question bank, calling Gemini only once it has nothing
+# left to ask; llm: a Gemini call every turn
+FOLLOWUP_MODE = config("FOLLOWUP_MODE", default="bank")
+FOLLOWUP_LLM_FALLBACK = config("FOLLOWUP_LLM_FALLBACK", default=True, cast=bool)
+# Bonus for a topic not asked yet this session (and penalty for the topic just
+# asked), against the cosine similarity of a question to the user's message
+FOLLOWUP_COVERAGE_WEIGHT = config("FOLLOWUP_COVERAGE_WEIGHT", default=0.3, cast=float)
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+class QuestionBank:
+    """🔹 The questions with their unit-length embeddings; select() picks the next one"""
+
+    def __init__(self, questions, vectors):
+        self.questions = questions
+        self.vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        self.topics = sorted({question["topic"] for question in questions})
+
+    def select(self, asked, last_index=None, risk_state=None, query_vector=None):
+        """🔹 Index of the next question to ask, or None when nothing is left
+
+        Skips questions already asked this session and those whose risk
+        factor or symptom the user has already told us about. Among the
+        rest, prefers topics not covered yet, avoids repeating the last
+        question's topic, and leans towards what the user is talking about.
+        """
+        asked = set(asked or [])
+        risk_state = risk_state or {}
+        known_factors = set(risk_state.get("factors") or {})
+        reported_symptoms = set(risk_state.get("symptoms") or [])
+        candidates = [
+            i for i, question in enumerate(self.questions)
+            if question["id"] not in asked
+            and question.get("factor") not in known_factors
+            and question.get("symptom") not in reported_symptoms
+        ]
+        if not candidates:
+            return None
+
+        covered = Counter(question["topic"] for question in self.questions if question["id"] in asked)
+        last_topic = None
+        if asked and last_index is not None and 0 <= last_index < len(self.questions):
+            last_topic = self.questions[last_index]["topic"]
+
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        if query_vector is not None:
+            scores += self.vectors[candidates] @ _normalize(np.asarray(query_vector, dtype=np.float32))
+        for position, i in enumerate(candidates):
+            topic = self.questions[i]["topic"]
+            if not covered[topic]:
+                scores[position] += FOLLOWUP_COVERAGE_WEIGHT
+            if topic == last_topic:
+                scores[position] -= FOLLOWUP_COVERAGE_WEIGHT
+        # Ties keep the bank's order
+        return candidates[int(np.argmax(scores))]
+
+
+def read_questions(path=BANK_FILE):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def bank_digest(questions, model_name):
+    """Identifies a vectors file: the question texts and the model that embedded them"""
+    payload = json.dumps([model_name] + [question["text"] for question in questions], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def embed_questions(questions):
+    return np.asarray(get_embeddings().embed_documents([question["text"] for question in questions]),
+                      dtype=np.float32)
+
+
+class QuestionVectorsError(RuntimeError):
+    """question_bank.npz is missing or was not built for these questions and this model"""
+
+
+def save_question_vectors(questions, vectors, path=None):
+    path = path or QUESTION_VECTORS_FILE
+    # Written under a temporary name first, so a crash never leaves half a file
+    temporary = f"{path}.{os.getpid()}.npz"
+    np.savez(temporary, vectors=vectors, digest=bank_digest(questions, embedding_model_name()))
+    os.replace(temporary, path)
+
+
+def vectors_match(questions, vectors):
+    """Spot check: the live embedder must still produce the stored vector of the first question"""
+    probe = _normalize(np.asarray(get_embeddings().embed_query(questions[0]["text"]), dtype=np.float32))
+    return probe.shape == vectors[0].shape and float(probe @ _normalize(vectors[0])) >= 0.99
+
+
+def load_question_bank(path=None):
+    """🔹 The bank with the vectors built by `python -m ai.followup`
+
+    Raises QuestionVectorsError when the file is missing or was built for
+    other questions or another embedding model; nothing is written here.
+    """
+    path = path or QUESTION_VECTORS_FILE
+    questions = read_questions()
+    rebuild = f"run `python -m ai.followup` at deploy time to build it for {embedding_model_name()}"
+    try:
+        with np.load(path) as stored:
+            vectors = stored["vectors"]
+            digest = str(stored["digest"])
+    except FileNotFoundError:
+        raise QuestionVectorsError(f"{path} not found; {rebuild}") from None
+    if digest != bank_digest(questions, embedding_model_name()) or not vectors_match(questions, vectors):
+        raise QuestionVectorsError(f"{path} does not match question_bank.json or the embedding model; {rebuild}")
+    return QuestionBank(questions, vectors)
+
+
+def build_question_bank(path=None):
+    """🔹 Embed the questions with the current model and store them (deploy step)"""
+    questions = read_questions()
+    vectors = embed_questions(questions)
+    save_question_vectors(questions, vectors, path)
+    return QuestionBank(questions, vectors)
+
+
+if __name__ == "__main__":
+    built = build_question_bank()
+    print(f"✅ {len(built.questions)} questions embedded with {embedding_model_name()} "
+          f"({built.vectors.shape[1]} dims) into {QUESTION_VECTORS_FILE}")
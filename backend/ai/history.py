@@ -0,0 +1,250 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+
+from decouple import config
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from ai.metrics import timed
+from ai.resources import get_db
+
+
+# Archived sessions are conversations/{user_id}/sessions/{session_id} (ids are
+# millisecond timestamps); their turns are conversations/{user_id}/messages
+# documents tagged with the session_id (ids are ULIDs). Both sort by key in
+# time order, so every listing pages on the document id alone. A user's
+# messages are paged by ai.converse.get_messages (/messages); this module adds
+# sessions and the exports.
+SESSION_FIELDS = ("session_id", "risk_level", "timestamp", "turn_count")
+MESSAGE_FIELDS = ("id", "session_id", "seq", "sender", "query", "response", "message", "timestamp")
+HISTORY_PAGE_SIZE = config("HISTORY_PAGE_SIZE", default=50, cast=int)
+MAX_HISTORY_PAGE_SIZE = 500
+# Documents per query while exporting
+EXPORT_PAGE_SIZE = config("EXPORT_PAGE_SIZE", default=300, cast=int)
+# Users read at the same time in a cohort export, and records buffered ahead
+# of a slow reader; together they bound an export's memory
+EXPORT_CONCURRENCY = config("EXPORT_CONCURRENCY", default=8, cast=int)
+EXPORT_BUFFER = config("EXPORT_BUFFER", default=1000, cast=int)
+# Bytes collected before a chunk of NDJSON/CSV is handed to the response
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+KINDS = {"sessions": SESSION_FIELDS, "messages": MESSAGE_FIELDS}
+
+
+def projection(fields, kind):
+    """🔹 Validated field list for `kind` from "a,b" or a list; None or empty means every field"""
+    allowed = KINDS[kind]
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    if not fields:
+        return list(allowed)
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"unknown {kind} field(s): {', '.join(unknown)}; choose from {', '.join(allowed)}")
+    return list(dict.fromkeys(fields))
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def to_record(user_id, snapshot, fields, key=None):
+    """One row: user_id, `key` (the cursor field of a listing) and the projected fields, timestamps as ISO strings"""
+    data = snapshot.to_dict() or {}
+    record = {"user_id": user_id}
+    if key and key not in fields:
+        fields = [key] + fields
+    for field in fields:
+        value = data.get(field)
+        if value is None and field in ("id", "session_id"):
+            # The key doubles as the id; old session documents lack the field
+            value = snapshot.id
+        record[field] = _plain(value)
+    return record
+
+
+def _sessions_ref(user_id):
+    return get_db().collection("conversations").document(user_id).collection("sessions")
+
+
+def _messages_ref(user_id):
+    return get_db().collection("conversations").document(user_id).collection("messages")
+
+
+def _stored_fields(fields):
+    # "id" is the document key, not a stored field
+    return [field for field in fields if field != "id"]
+
+
+async def _page(query, fields, cursor, limit, descending):
+    limit = max(1, min(int(limit), MAX_HISTORY_PAGE_SIZE))
+    query = query.order_by("__name__", direction="DESCENDING" if descending else "ASCENDING")
+    if cursor:
+        query = query.start_after({"__name__": cursor})
+    # One extra document tells whether another page exists
+    snapshots = [snapshot async for snapshot in query.select(_stored_fields(fields)).limit(limit + 1).stream()]
+    return snapshots[:limit], snapshots[limit - 1].id if len(snapshots) > limit else None
+
+
+@timed("firestore.list_sessions")
+async def list_sessions(user_id, cursor=None, limit=HISTORY_PAGE_SIZE, fields=None):
+    """🔹 One page of a user's archived sessions, newest first
+
+    Pass the returned next_cursor as `cursor` for the following page (None
+    when there is no more). `fields` limits what Firestore sends back.
+    """
+    fields = projection(fields, "sessions")
+    snapshots, next_cursor = await _page(_sessions_ref(user_id), fields, cursor, limit, descending=True)
+    return {
+        "sessions": [to_record(user_id, snapshot, fields, key="session_id") for snapshot in snapshots],
+        "next_cursor": next_cursor
+    }
+
+
+async def iter_documents(query, fields=None, page_size=EXPORT_PAGE_SIZE, start_after=None):
+    """🔹 Every document of `query` in key order, one page in memory at a time
+
+    `fields=None` reads whole documents; a list (possibly empty) selects
+    only those fields. `start_after` resumes after that document id.
+    """
+    query = query.order_by("__name__")
+    if fields is not None:
+        query = query.select(fields)
+    cursor = start_after
+    while True:
+        page = query.start_after({"__name__": cursor}) if cursor else query
+        snapshots = [snapshot async for snapshot in page.limit(page_size).stream()]
+        for snapshot in snapshots:
+            yield snapshot
+        if len(snapshots) < page_size:
+            return
+        cursor = snapshots[-1].id
+
+
+async def iter_user_records(user_id, kind, fields, page_size=EXPORT_PAGE_SIZE):
+    """🔹 Every session or message record of one user, oldest first"""
+    query = _sessions_ref(user_id) if kind == "sessions" else _messages_ref(user_id)
+    async for snapshot in iter_documents(query, _stored_fields(fields), page_size):
+        yield to_record(user_id, snapshot, fields)
+
+
+async def iter_user_ids(user_ids=None, where=None, page_size=EXPORT_PAGE_SIZE):
+    """🔹 The cohort: the given ids, or every conversations/{user_id} matching `where`
+
+    `where` is [[field, op, value], ...] against the conversation document
+    (e.g. [["risk_level", "==", "สูง"]]); only document keys are read.
+    """
+    if user_ids:
+        for user_id in dict.fromkeys(user_ids):
+            yield user_id
+        return
+    query = get_db().collection("conversations")
+    for field_path, op, value in where or []:
+        query = query.where(filter=FieldFilter(field_path, op, value))
+    async for snapshot in iter_documents(query, [], page_size):
+        yield snapshot.id
+
+
+async def export_records(kind, user_ids=None, where=None, fields=None, concurrency=EXPORT_CONCURRENCY,
+                         page_size=EXPORT_PAGE_SIZE):
+    """🔹 Stream the session or message records of a cohort
+
+    Up to `concurrency` users are read at once. Records wait in a bounded
+    buffer, so a slow consumer holds back the reads instead of letting them
+    pile up in memory. Each user's records come out in order; records of
+    different users interleave. A failed read ends the export with its error.
+    """
+    fields = projection(fields, kind)
+    concurrency = max(1, concurrency)
+    user_queue = asyncio.Queue(maxsize=concurrency * 2)
+    records = asyncio.Queue(maxsize=EXPORT_BUFFER)
+    finished = object()
+
+    async def feed():
+        try:
+            async for user_id in iter_user_ids(user_ids, where, page_size):
+                await user_queue.put(user_id)
+            for _ in range(concurrency):
+                await user_queue.put(None)
+        except Exception as e:
+            await records.put(e)
+
+    async def read_users():
+        try:
+            while (user_id := await user_queue.get()) is not None:
+                async for record in iter_user_records(user_id, kind, fields, page_size):
+                    await records.put(record)
+            await records.put(finished)
+        except Exception as e:
+            # Handed to the consumer, which stops the export
+            await records.put(e)
+
+    tasks = [asyncio.create_task(feed())] + [asyncio.create_task(read_users()) for _ in range(concurrency)]
+    try:
+        running = concurrency
+        while running:
+            item = await records.get()
+            if item is finished:
+                running -= 1
+            elif isinstance(item, Exception):
+                print(f"❌ History export failed: {item}")
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _chunked(lines):
+    buffer, size = [], 0
+    async for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+async def to_ndjson(records):
+    """🔹 One JSON object per line, in chunks ready to write or stream"""
+    async def lines():
+        async for record in records:
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    async for chunk in _chunked(lines()):
+        yield chunk
+
+
+async def to_csv(records, columns):
+    """🔹 CSV with a header row, in chunks ready to write or stream"""
+    async def lines():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        async for record in records:
+            writer.writerow(record)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    async for chunk in _chunked(lines()):
+        yield chunk
+
+
+def export_stream(kind, output_format, user_ids=None, where=None, fields=None, concurrency=EXPORT_CONCURRENCY):
+    """🔹 Chunks of a cohort export as NDJSON or CSV; raises ValueError for bad arguments up front"""
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    if output_format not in ("ndjson", "csv"):
+        raise ValueError("format must be ndjson or csv")
+    fields = projection(fields, kind)
+    records = export_records(kind, user_ids, where, fields, concurrency)
+    if output_format == "csv":
+        return to_csv(records, ["user_id"] + fields)
+    return to_ndjson(records)
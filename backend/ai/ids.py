@@ -0,0 +1,54 @@
+import hashlib
+import secrets
+import threading
+import time
+
+
+# ULID: 48-bit millisecond timestamp + 80 random bits in Crockford base32
+# (26 characters). Ids sort lexicographically by creation time, so message
+# documents can be paged in order by their key alone.
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+RANDOM_BITS = 80
+RANDOM_MAX = (1 << RANDOM_BITS) - 1
+
+_lock = threading.Lock()
+_last_millis = 0
+_last_random = 0
+
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def _format(millis, random_part):
+    return _encode(millis, 10) + _encode(random_part, 16)
+
+
+def new_ulid():
+    """🔹 Monotonic ULID: ids made in the same millisecond still sort in creation order"""
+    global _last_millis, _last_random
+    with _lock:
+        millis = int(time.time() * 1000)
+        if millis <= _last_millis:
+            millis = _last_millis
+            random_part = _last_random + 1
+            if random_part > RANDOM_MAX:
+                millis, random_part = millis + 1, secrets.randbits(RANDOM_BITS)
+        else:
+            random_part = secrets.randbits(RANDOM_BITS)
+        _last_millis, _last_random = millis, random_part
+    return _format(millis, random_part)
+
+
+def ulid_at(millis, seed):
+    """ULID for a past moment; the same seed always gives the same id (for re-runnable migrations)"""
+    digest = hashlib.sha1(seed.encode("utf-8")).digest()
+    return _format(millis, int.from_bytes(digest[:10], "big"))
+
+
+def is_ulid(value):
+    return len(value) == 26 and all(char in CROCKFORD for char in value) and value[0] <= "7"
@@ -0,0 +1,447 @@
+import asyncio
+import contextvars
+import hashlib
+import os
+import random
+import socket
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from decouple import config
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from ai.resources import get_db
+
+
+JOB_BACKEND = config("JOB_BACKEND", default="memory")
+JOB_WORKERS = config("JOB_WORKERS", default=4, cast=int)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=3, cast=int)
+# Base delay of the exponential backoff between attempts (jittered)
+JOB_RETRY_DELAY = config("JOB_RETRY_DELAY", default=1.0, cast=float)
+JOB_COLLECTION = config("JOB_COLLECTION", default="jobs")
+# How long shutdown waits for queued jobs before cancelling the workers
+JOB_DRAIN_TIMEOUT = config("JOB_DRAIN_TIMEOUT", default=10, cast=float)
+JOB_MAX_RETAINED = config("JOB_MAX_RETAINED", default=10000, cast=int)
+# A queued or running job belongs to the worker that holds its lease; other
+# workers (or nodes) only take it over once the lease has run out
+JOB_LEASE_SECONDS = config("JOB_LEASE_SECONDS", default=600, cast=float)
+JOB_RECLAIM_INTERVAL = config("JOB_RECLAIM_INTERVAL", default=60, cast=float)
+# A running job's lease (and its ordering key's) is pushed out this often, so
+# a handler that runs longer than JOB_LEASE_SECONDS is not taken over
+JOB_HEARTBEAT_INTERVAL = config("JOB_HEARTBEAT_INTERVAL", default=60, cast=float)
+# How soon a worker looks again at an ordering key another worker is running a job of
+JOB_KEY_RETRY_DELAY = config("JOB_KEY_RETRY_DELAY", default=1.0, cast=float)
+
+UNFINISHED = ("queued", "running")
+
+# Id of the job a handler is running for, for handlers that keep records of their own under it
+current_job_id = contextvars.ContextVar("current_job_id", default=None)
+
+
+def job_id_for(kind, idempotency_key=None):
+    """Same kind + idempotency key always maps to the same job id"""
+    if idempotency_key is None:
+        return uuid.uuid4().hex
+    return hashlib.sha1(f"{kind}:{idempotency_key}".encode("utf-8")).hexdigest()[:32]
+
+
+class InMemoryJobBackend:
+    """🔹 Process-local job records; queued jobs are lost on restart"""
+
+    durable = False
+
+    def __init__(self, max_retained=JOB_MAX_RETAINED):
+        self.max_retained = max_retained
+        self._jobs = OrderedDict()
+
+    async def create(self, job):
+        if job["id"] in self._jobs:
+            return False
+        self._jobs[job["id"]] = dict(job)
+        while len(self._jobs) > self.max_retained:
+            oldest = next(iter(self._jobs))
+            if self._jobs[oldest]["status"] in UNFINISHED:
+                break
+            self._jobs.popitem(last=False)
+        return True
+
+    async def save(self, job):
+        self._jobs[job["id"]] = dict(job)
+
+    async def get(self, job_id):
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    async def unfinished(self):
+        return []
+
+    async def claim(self, job, owner, lease_until):
+        job.update(owner=owner, lease_until=lease_until)
+        await self.save(job)
+        return True
+
+    async def lock_key(self, ordering_key, owner, lease_until):
+        # One process: its lanes already run a key's jobs one at a time
+        return True
+
+    async def extend(self, job, lock, lease_until):
+        job["lease_until"] = lease_until
+        return lock
+
+    async def unlock_key(self, ordering_key, lock):
+        pass
+
+
+class FirestoreJobBackend:
+    """🔹 Durable job records in the `jobs` collection
+
+    Jobs that were queued or running when the process stopped are picked up
+    again by JobQueue.start(), and create() relies on Firestore's
+    create-if-absent so an idempotency key is honoured across workers.
+
+    An ordering key is locked in `{collection}_keys` while one of its jobs
+    runs, so jobs of one user run one at a time across every worker too.
+    Each worker runs its own jobs of a key in the order it enqueued them;
+    between workers the order is whichever takes the lock first.
+    """
+
+    durable = True
+
+    def __init__(self, collection=JOB_COLLECTION):
+        self.collection = collection
+
+    def _ref(self, job_id):
+        return get_db().collection(self.collection).document(job_id)
+
+    async def create(self, job):
+        try:
+            await self._ref(job["id"]).create(job)
+            return True
+        except AlreadyExists:
+            return False
+
+    async def save(self, job):
+        await self._ref(job["id"]).set(job)
+
+    async def get(self, job_id):
+        snapshot = await self._ref(job_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    async def unfinished(self):
+        query = (
+            get_db().collection(self.collection)
+            .where(filter=FieldFilter("status", "in", list(UNFINISHED)))
+            .order_by("created_at")
+        )
+        return [snapshot.to_dict() async for snapshot in query.stream()]
+
+    async def claim(self, job, owner, lease_until):
+        """Take over a job whose lease ran out; exactly one worker wins the claim marker"""
+        marker = get_db().collection(f"{self.collection}_claims").document(f"{job['id']}-{job.get('lease_until', 0)!r}")
+        try:
+            await marker.create({"owner": owner, "claimed_at": time.time()})
+        except AlreadyExists:
+            return False
+        job.update(owner=owner, lease_until=lease_until)
+        await self.save(job)
+        return True
+
+    def _key_ref(self, ordering_key):
+        # Ordering keys are user ids and names like "notifications:bulk"; hashed into a valid document id
+        key_id = hashlib.sha1(ordering_key.encode("utf-8")).hexdigest()
+        return get_db().collection(f"{self.collection}_keys").document(key_id)
+
+    async def lock_key(self, ordering_key, owner, lease_until):
+        """Lock the ordering key for this worker; returns the lock, or None while another worker holds it"""
+        ref = self._key_ref(ordering_key)
+        lock = {"ordering_key": ordering_key, "owner": owner, "lease_until": lease_until}
+        try:
+            return (await ref.create(lock)).update_time
+        except AlreadyExists:
+            pass
+        snapshot = await ref.get()
+        held = snapshot.to_dict() or {}
+        if snapshot.exists and held.get("lease_until", 0) > time.time():
+            return None
+        # Its holder stopped without unlocking; take it over unless another worker just did
+        try:
+            return (await ref.update(lock, option=get_db().write_option(last_update_time=snapshot.update_time))).update_time
+        except (FailedPrecondition, NotFound):
+            return None
+
+    async def extend(self, job, lock, lease_until):
+        """Push out the job's and its key's lease; returns the key's new lock"""
+        job["lease_until"] = lease_until
+        await self._ref(job["id"]).update({"lease_until": lease_until})
+        result = await self._key_ref(job["ordering_key"]).update(
+            {"lease_until": lease_until}, option=get_db().write_option(last_update_time=lock)
+        )
+        return result.update_time
+
+    async def unlock_key(self, ordering_key, lock):
+        try:
+            await self._key_ref(ordering_key).delete(option=get_db().write_option(last_update_time=lock))
+        except (FailedPrecondition, NotFound):
+            # The lease ran out and another worker took the key over
+            pass
+
+
+class JobQueue:
+    """🔹 In-process background worker pool
+
+    Jobs that share an ordering key (the user id) run one at a time in the
+    order they were enqueued; different keys run in parallel on up to
+    `workers` tasks. With a durable backend the key is also locked while
+    its job runs, so a key's jobs queued by different processes do not
+    overlap either; a running job's lease is renewed every
+    JOB_HEARTBEAT_INTERVAL until it finishes. A failing job is retried with backoff up to
+    `max_attempts` times before it is marked failed, and keeps its place at
+    the head of its lane meanwhile so later jobs of that user wait for it.
+
+    Kinds registered `at_most_once` (sending a campaign) are never run twice:
+    the job is recorded as running before its one attempt starts, and one
+    found running by reclaim() is marked failed instead of run again.
+    """
+
+    def __init__(self, backend, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS, retry_delay=JOB_RETRY_DELAY):
+        self.backend = backend
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.handlers = {}
+        self.at_most_once = set()
+        self._lanes = {}
+        self._scheduled = set()
+        self._ready = None
+        self._idle = None
+        self._tasks = []
+        self._reclaimer = None
+
+    @property
+    def owner(self):
+        # Worth recomputing: with a preloaded app the queue is built before the fork
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def handler(self, kind, at_most_once=False):
+        """Decorator registering the coroutine that runs jobs of `kind`"""
+        def decorator(func):
+            self.handlers[kind] = func
+            if at_most_once:
+                self.at_most_once.add(kind)
+            return func
+        return decorator
+
+    def _ensure_workers(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Fresh context: workers may be started lazily from inside a request and
+        # must not keep writing into that request's timings
+        self._tasks = [
+            asyncio.create_task(self._worker(), context=contextvars.Context()) for _ in range(self.workers)
+        ]
+
+    async def start(self):
+        """Start the workers and resume jobs a durable backend still has pending"""
+        self._ensure_workers()
+        await self.reclaim()
+        if self.backend.durable and self._reclaimer is None:
+            self._reclaimer = asyncio.create_task(self._reclaim_periodically(), context=contextvars.Context())
+
+    async def reclaim(self):
+        """🔹 Schedule pending jobs whose owner's lease has run out (it stopped or crashed)"""
+        try:
+            now = time.time()
+            for job in await self.backend.unfinished():
+                if job["id"] in self._scheduled or job.get("lease_until", 0) > now:
+                    continue
+                if not await self.backend.claim(job, self.owner, now + JOB_LEASE_SECONDS):
+                    continue
+                if job["status"] == "running" and job["kind"] in self.at_most_once:
+                    # It may have done part of its work (or all of it, and failed to record that)
+                    job.update(status="failed", error="interrupted while running; not run again")
+                    print(f"❌ Job {job['kind']} {job['id']} was interrupted; it is not run again")
+                    await self._save(job)
+                else:
+                    self._schedule(job)
+        except Exception as e:
+            print(f"❌ Could not resume pending jobs: {e}")
+
+    async def _reclaim_periodically(self):
+        while True:
+            await asyncio.sleep(JOB_RECLAIM_INTERVAL * random.uniform(0.8, 1.2))
+            await self.reclaim()
+
+    async def stop(self, timeout=JOB_DRAIN_TIMEOUT):
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"❌ {sum(len(lane) for lane in self._lanes.values())} jobs still pending at shutdown")
+        if self._reclaimer is not None:
+            self._reclaimer.cancel()
+            self._reclaimer = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._lanes.clear()
+        self._scheduled.clear()
+
+    async def join(self):
+        """Wait until every scheduled job has finished"""
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def enqueue(self, kind, payload, ordering_key, idempotency_key=None):
+        """🔹 Queue a job and return its id
+
+        Enqueuing again with the same kind and idempotency key returns the
+        existing job's id without running it twice.
+        """
+        job = {
+            "id": job_id_for(kind, idempotency_key),
+            "kind": kind,
+            "payload": payload,
+            "ordering_key": ordering_key,
+            "status": "queued",
+            "attempts": 0,
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "owner": self.owner,
+            "lease_until": time.time() + JOB_LEASE_SECONDS
+        }
+        if await self.backend.create(job):
+            self._schedule(job)
+        return job["id"]
+
+    async def get(self, job_id):
+        return await self.backend.get(job_id)
+
+    def _schedule(self, job):
+        self._ensure_workers()
+        if job["id"] in self._scheduled:
+            return
+        self._scheduled.add(job["id"])
+        self._idle.clear()
+
+        key = job["ordering_key"]
+        lane = self._lanes.get(key)
+        if lane is None:
+            self._lanes[key] = deque([job])
+            self._ready.put_nowait(key)
+        else:
+            lane.append(job)
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            job = lane[0]
+            lease = {"lock": await self._lock_key(key)}
+            if lease["lock"] is None:
+                # Another worker is running a job of this key; the lane keeps its place
+                delay = JOB_KEY_RETRY_DELAY * random.uniform(0.5, 1.5)
+                asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, key)
+                continue
+            heartbeat = asyncio.create_task(self._heartbeat(job, lease))
+            try:
+                await self._run(job)
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+                await self._unlock_key(key, lease["lock"])
+                lane.popleft()
+                self._scheduled.discard(job["id"])
+                if lane:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._lanes[key]
+                    if not self._lanes:
+                        self._idle.set()
+
+    async def _lock_key(self, key):
+        try:
+            return await self.backend.lock_key(key, self.owner, time.time() + JOB_LEASE_SECONDS)
+        except Exception as e:
+            print(f"❌ Could not lock ordering key {key}: {e}")
+            return None
+
+    async def _unlock_key(self, key, lock):
+        try:
+            await self.backend.unlock_key(key, lock)
+        except Exception as e:
+            # Left to expire with its lease
+            print(f"⚠️ Could not unlock ordering key {key}: {e}")
+
+    async def _heartbeat(self, job, lease):
+        """Renew the running job's lease (and its key's) until it is cancelled"""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+            try:
+                lease["lock"] = await self.backend.extend(job, lease["lock"], time.time() + JOB_LEASE_SECONDS)
+            except Exception as e:
+                print(f"⚠️ Could not renew the lease of job {job['kind']} {job['id']}: {e}")
+
+    async def _run(self, job):
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            job.update({"status": "failed", "error": f"no handler for {job['kind']}"})
+            await self._save(job)
+            return
+
+        once = job["kind"] in self.at_most_once
+        current_job_id.set(job["id"])
+        while True:
+            job["attempts"] += 1
+            job["status"] = "running"
+            if once and not await self._save(job):
+                # Nothing ran yet; the job stays queued until its lease runs out and it is reclaimed
+                return
+            try:
+                job["result"] = await handler(**job["payload"])
+                job.update({"status": "done", "error": None})
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job["error"] = str(e)
+                if once or job["attempts"] >= self.max_attempts:
+                    job["status"] = "failed"
+                    print(f"❌ Job {job['kind']} {job['id']} failed after {job['attempts']} attempts: {e}")
+                    break
+                job["lease_until"] = time.time() + JOB_LEASE_SECONDS
+                await self._save(job)
+                delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        if not await self._save(job) and job["result"] is not None:
+            # Record at least the outcome, so the job is not left running (e.g. a result over the size limit)
+            job.update(result=None, error=f"result could not be stored ({job['status']})")
+            await self._save(job)
+
+    async def _save(self, job):
+        """Write the job record; False if it could not be written"""
+        try:
+            await self.backend.save(job)
+            return True
+        except Exception as e:
+            print(f"❌ Could not save job {job['id']}: {e}")
+            return False
+
+
+def create_job_queue():
+    """🔹 Build the queue on the backend chosen by JOB_BACKEND (memory | firestore)"""
+    if JOB_BACKEND == "firestore":
+        backend = FirestoreJobBackend()
+    else:
+        backend = InMemoryJobBackend()
+    return JobQueue(backend)
+
+
+job_queue = create_job_queue()
@@ -0,0 +1,309 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+from decouple import config
+from google.api_core import exceptions as api_exceptions
+
+from ai.metrics import record_llm_event, record_llm_usage, span
+from ai.resources import get_genai_model
+
+
+LLM_DEADLINE = config("LLM_DEADLINE", default=30, cast=float)
+# Token bucket shared by every request of this process; 0 disables it
+LLM_RATE_LIMIT = config("LLM_RATE_LIMIT", default=10.0, cast=float)
+LLM_BURST = config("LLM_BURST", default=20, cast=int)
+LLM_MAX_CONCURRENCY = config("LLM_MAX_CONCURRENCY", default=32, cast=int)
+LLM_MAX_ATTEMPTS = config("LLM_MAX_ATTEMPTS", default=3, cast=int)
+# Base delay of the jittered exponential backoff between attempts
+LLM_RETRY_DELAY = config("LLM_RETRY_DELAY", default=0.5, cast=float)
+# The breaker opens when at least this share of the last LLM_BREAKER_WINDOW
+# attempts failed transiently, and stays open for the cooldown
+LLM_BREAKER_WINDOW = config("LLM_BREAKER_WINDOW", default=20, cast=int)
+LLM_BREAKER_FAILURE_RATIO = config("LLM_BREAKER_FAILURE_RATIO", default=0.5, cast=float)
+LLM_BREAKER_COOLDOWN = config("LLM_BREAKER_COOLDOWN", default=20, cast=float)
+# Seconds before a hedged call sends a second, identical request; 0 disables hedging
+LLM_HEDGE_AFTER = config("LLM_HEDGE_AFTER", default=0.0, cast=float)
+
+# 429 and 5xx: worth retrying, and a sign of trouble for the breaker
+TRANSIENT_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class LLMUnavailable(RuntimeError):
+    """Raised without calling Gemini: the breaker is open or the rate limit would overrun the deadline"""
+
+
+def is_transient(exception):
+    return isinstance(exception, TRANSIENT_ERRORS)
+
+
+class TokenBucket:
+    """🔹 Requests-per-second limiter; waiters reserve tokens, so they are served in order"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        if not self.rate:
+            return True
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self, deadline_at):
+        """Wait for a token; raises LLMUnavailable if that would pass the deadline"""
+        if not self.rate:
+            return
+        self._refill()
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        if time.monotonic() + wait > deadline_at:
+            raise LLMUnavailable("rate limit: no capacity before the deadline")
+        self.tokens -= 1
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """🔹 Fail fast while most recent attempts fail; one probe call is let through per cooldown"""
+
+    def __init__(self, window=LLM_BREAKER_WINDOW, failure_ratio=LLM_BREAKER_FAILURE_RATIO,
+                 cooldown=LLM_BREAKER_COOLDOWN):
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)
+        self.opened_at = None
+        self.probe_at = None
+        self.opened = 0
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def check(self):
+        state = self.state
+        if state == "closed":
+            return
+        now = time.monotonic()
+        if state == "half_open" and (self.probe_at is None or now - self.probe_at >= self.cooldown):
+            self.probe_at = now
+            return
+        raise LLMUnavailable("circuit open: Gemini is failing, not calling it for now")
+
+    def record_success(self):
+        self.outcomes.append(True)
+        if self.opened_at is not None:
+            # The probe got through: start counting afresh
+            self.outcomes.clear()
+            self.opened_at = self.probe_at = None
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        if self.opened_at is not None:
+            # A failed probe keeps the breaker open for another cooldown
+            self.opened_at = time.monotonic()
+            self.probe_at = None
+            return
+        # Half a window is enough evidence to open; fewer outcomes never open it
+        failed = self.outcomes.count(False)
+        if len(self.outcomes) >= self.outcomes.maxlen // 2 and failed >= self.failure_ratio * len(self.outcomes):
+            self.opened += 1
+            self.opened_at = time.monotonic()
+            print(f"❌ Gemini circuit opened: {failed} of the last {len(self.outcomes)} attempts failed")
+
+
+class LLMClient:
+    """🔹 Every Gemini call goes through here
+
+    A call gets one deadline covering rate-limit waits, queueing for a
+    concurrency slot, every attempt and the backoff between them. 429/5xx
+    and timeouts are retried with jittered exponential backoff and feed a
+    circuit breaker shared by all call sites. Hedged calls send a second
+    request when the first is slower than `hedge_after` and keep whichever
+    answers first.
+
+    `model` is a zero-argument callable returning an object with Gemini's
+    generate_content_async(); tests and benchmarks install a stub through
+    ai.resources.set_resource like every other component.
+    """
+
+    def __init__(self, rate=LLM_RATE_LIMIT, burst=LLM_BURST, max_concurrency=LLM_MAX_CONCURRENCY,
+                 max_attempts=LLM_MAX_ATTEMPTS, retry_delay=LLM_RETRY_DELAY, hedge_after=LLM_HEDGE_AFTER,
+                 breaker=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = None
+        self.counts = {"requests": 0, "retries": 0, "hedges": 0, "rejected": 0, "failures": 0}
+
+    @property
+    def semaphore(self):
+        # Created on first use so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def share_limits(self, parts):
+        """🔹 Keep to this process's share when `parts` worker processes call Gemini
+
+        The quota is per project, not per process: N workers each allowed the
+        full rate would overrun it N times over.
+        """
+        parts = max(1, parts)
+        self.bucket = TokenBucket(self.bucket.rate / parts, max(1, self.bucket.capacity // parts))
+        self.max_concurrency = max(1, self.max_concurrency // parts)
+        self._semaphore = None
+
+    @staticmethod
+    def remaining(deadline_at):
+        return deadline_at - time.monotonic()
+
+    async def _request(self, model, prompt, deadline_at, rate_limited=True, **kwargs):
+        """One Gemini request within the deadline; the result is awaited fully unless streaming"""
+        if rate_limited:
+            await self.bucket.acquire(deadline_at)
+
+        async def send():
+            async with self.semaphore:
+                self.counts["requests"] += 1
+                timeout = max(0.1, self.remaining(deadline_at))
+                return await model().generate_content_async(prompt, request_options={"timeout": timeout}, **kwargs)
+
+        remaining = self.remaining(deadline_at)
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        return await asyncio.wait_for(send(), remaining)
+
+    async def _hedged(self, call, model, prompt, deadline_at):
+        primary = asyncio.create_task(self._request(model, prompt, deadline_at))
+        done, _ = await asyncio.wait({primary}, timeout=min(self.hedge_after, self.remaining(deadline_at)))
+        # No hedge when the bucket is empty: hedges must not add load under pressure
+        if done or not self.bucket.try_acquire():
+            return await primary
+
+        self.counts["hedges"] += 1
+        record_llm_event(call, "hedge")
+        backup = asyncio.create_task(self._request(model, prompt, deadline_at, rate_limited=False))
+        pending = {primary, backup}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _with_retries(self, call, deadline_at, operation):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.breaker.check()
+            except LLMUnavailable:
+                self.counts["rejected"] += 1
+                record_llm_event(call, "rejected")
+                raise
+            try:
+                result = await operation()
+            except LLMUnavailable:
+                self.counts["rejected"] += 1
+                record_llm_event(call, "rejected")
+                raise
+            except Exception as e:
+                if not is_transient(e):
+                    # Gemini answered (e.g. 400): it is up, the request was bad
+                    self.breaker.record_success()
+                    record_llm_event(call, "error")
+                    raise
+                self.breaker.record_failure()
+                self.counts["failures"] += 1
+                delay = self.retry_delay * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                if attempt >= self.max_attempts or self.remaining(deadline_at) <= delay:
+                    record_llm_event(call, "error")
+                    raise
+                self.counts["retries"] += 1
+                record_llm_event(call, "retry")
+                print(f"⚠️ Gemini {call} attempt {attempt} failed ({type(e).__name__}: {e}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            record_llm_event(call, "success")
+            return result
+
+    async def generate(self, call, prompt, model=get_genai_model, deadline=LLM_DEADLINE, hedge=False):
+        """🔹 Complete response for `prompt`; `call` labels metrics and logs"""
+        deadline_at = time.monotonic() + deadline
+
+        def operation():
+            if hedge and self.hedge_after > 0:
+                return self._hedged(call, model, prompt, deadline_at)
+            return self._request(model, prompt, deadline_at)
+
+        with span(f"llm.{call}"):
+            response = await self._with_retries(call, deadline_at, operation)
+        record_llm_usage(call, response)
+        return response
+
+    async def stream(self, call, prompt, model=get_genai_model, deadline=LLM_DEADLINE):
+        """🔹 Yield text chunks; attempts are retried only until the first chunk has arrived"""
+        deadline_at = time.monotonic() + deadline
+
+        async def open_stream():
+            response = await self._request(model, prompt, deadline_at, stream=True)
+            chunks = response.__aiter__()
+            try:
+                first = await asyncio.wait_for(chunks.__anext__(), self.remaining(deadline_at))
+            except StopAsyncIteration:
+                first = None
+            return response, chunks, first
+
+        with span(f"llm.{call}.first_chunk"):
+            response, chunks, first = await self._with_retries(call, deadline_at, open_stream)
+        if first is None:
+            return
+        if first.text:
+            yield first.text
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, self.remaining(deadline_at)))
+            except StopAsyncIteration:
+                break
+            if chunk.text:
+                yield chunk.text
+        record_llm_usage(call, response)
+
+    def stats(self):
+        return {**self.counts, "circuit": self.breaker.state, "circuit_opened": self.breaker.opened}
+
+
+llm = LLMClient()
@@ -0,0 +1,119 @@
+import contextvars
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+
+STAGE_SECONDS = Histogram(
+    "ncd_stage_duration_seconds",
+    "Time spent in each stage of the conversation pipeline",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+LLM_TOKENS = Counter("ncd_llm_tokens_total", "Gemini tokens by call site", ["call", "kind"])
+LLM_PROMPT_TOKENS = Histogram(
+    "ncd_llm_prompt_tokens",
+    "Prompt size of each Gemini call",
+    ["call"],
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 5000, 8000),
+)
+LLM_EVENTS = Counter(
+    "ncd_llm_events_total",
+    "Outcomes of Gemini calls: success, retry, hedge, error, rejected (breaker / rate limit)",
+    ["call", "event"],
+)
+CACHE_LOOKUPS = Counter("ncd_cache_lookups_total", "Semantic cache lookups", ["cache", "result"])
+CACHE_SAVED_SECONDS = Counter("ncd_cache_saved_seconds_total", "Latency saved by semantic cache hits", ["cache"])
+FOLLOWUP_QUESTIONS = Counter(
+    "ncd_followup_questions_total",
+    "Where each turn's follow-up question came from: bank, llm or none",
+    ["source"],
+)
+
+logger = logging.getLogger("ncd.llm")
+
+# Stages recorded while serving the current request, for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def span(stage):
+    """🔹 Time a block into the stage histogram (and the current request's timings)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage=stage).observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def timed(stage):
+    """🔹 Decorator form of span() for coroutine functions"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request_timing():
+    """Collect spans of this request (and tasks it starts) from here on"""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings):
+    totals = {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in totals.items())
+
+
+def record_llm_usage(call, response):
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    prompt_tokens = usage.prompt_token_count or 0
+    completion_tokens = usage.candidates_token_count or 0
+    LLM_TOKENS.labels(call=call, kind="prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(call=call, kind="completion").inc(completion_tokens)
+    LLM_PROMPT_TOKENS.labels(call=call).observe(prompt_tokens)
+    logger.info("LLM %s: %d prompt tokens, %d completion tokens", call, prompt_tokens, completion_tokens)
+
+
+def record_llm_event(call, event):
+    LLM_EVENTS.labels(call=call, event=event).inc()
+
+
+def record_cache_lookup(cache, hit, saved_seconds=0.0):
+    CACHE_LOOKUPS.labels(cache=cache, result="hit" if hit else "miss").inc()
+    if hit:
+        CACHE_SAVED_SECONDS.labels(cache=cache).inc(saved_seconds)
+
+
+def record_followup(source):
+    FOLLOWUP_QUESTIONS.labels(source=source).inc()
+
+
+def export_metrics():
+    """Prometheus text exposition of every metric: (body, content type)
+
+    Under gunicorn (PROMETHEUS_MULTIPROC_DIR set, see gunicorn.conf.py) each
+    worker writes its samples to that directory and this merges all of them,
+    so any worker answers for the whole server.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
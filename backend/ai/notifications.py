@@ -0,0 +1,220 @@
+import asyncio
+from collections import Counter
+
+from decouple import config
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from ai.jobs import JOB_COLLECTION, current_job_id, job_queue
+from ai.resources import get_db, get_fcm
+
+
+# FCM accepts at most 500 tokens per multicast request
+FCM_MULTICAST_LIMIT = 500
+FCM_MAX_CONCURRENCY = config("FCM_MAX_CONCURRENCY", default=4, cast=int)
+# Document references per get_all() round trip
+TOKEN_READ_CHUNK = config("TOKEN_READ_CHUNK", default=300, cast=int)
+# Writes per batched commit (pruning tokens, per-user results); Firestore allows 500
+WRITE_BATCH_LIMIT = 450
+# Distinct failure messages kept in a campaign's result
+MAX_REPORTED_ERRORS = 10
+# A campaign's per-user outcomes are {JOB_COLLECTION}/{job_id}/results/{user_id}
+# documents ({user_id, status, error}), paged by list_campaign_results
+RESULT_STATUSES = ("sent", "failed", "invalid_token", "no_token")
+RESULTS_PAGE_SIZE = config("RESULTS_PAGE_SIZE", default=500, cast=int)
+MAX_RESULTS_PAGE_SIZE = 1000
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def is_invalid_token_error(exception):
+    """Whether FCM says the token itself will never work again
+
+    Only these two errors are about the token: INVALID_ARGUMENT (and a bare
+    NOT_FOUND code) also come back for a malformed message, and pruning on
+    them would wipe valid tokens of every user in a broken campaign.
+    """
+    from firebase_admin import messaging
+
+    return isinstance(exception, (messaging.UnregisteredError, messaging.SenderIdMismatchError))
+
+
+async def tokens_for_users(user_ids):
+    """🔹 Resolve {user_id: fcmToken} with batched get_all() reads; missing users map to None"""
+    db = get_db()
+    tokens = {}
+    for chunk in chunked(list(dict.fromkeys(user_ids)), TOKEN_READ_CHUNK):
+        references = [db.collection("users").document(user_id) for user_id in chunk]
+        async for snapshot in db.get_all(references, field_paths=["fcmToken"]):
+            tokens[snapshot.id] = (snapshot.to_dict() or {}).get("fcmToken") if snapshot.exists else None
+    return tokens
+
+
+async def tokens_for_query(where=None, limit=None):
+    """🔹 Resolve {user_id: fcmToken} for users matching `where` ([[field, op, value], ...])"""
+    query = get_db().collection("users")
+    for field_path, op, value in where or []:
+        query = query.where(filter=FieldFilter(field_path, op, value))
+    if limit:
+        query = query.limit(limit)
+    query = query.select(["fcmToken"])
+
+    tokens = {}
+    async for snapshot in query.stream():
+        tokens[snapshot.id] = (snapshot.to_dict() or {}).get("fcmToken")
+    return tokens
+
+
+async def send_multicast(tokens, title, body, data, semaphore):
+    """Send one chunk of at most 500 tokens; returns [(token, error or None), ...]"""
+    from firebase_admin import messaging
+
+    message = messaging.MulticastMessage(
+        tokens=tokens,
+        notification=messaging.Notification(title=title, body=body),
+        data=data
+    )
+    async with semaphore:
+        try:
+            batch_response = await asyncio.to_thread(get_fcm().send_each_for_multicast, message)
+        except Exception as e:
+            print(f"❌ Multicast of {len(tokens)} tokens failed: {e}")
+            # The whole request failed, which says nothing about the tokens themselves
+            error = RuntimeError(f"multicast failed: {e}")
+            return [(token, error) for token in tokens]
+    return [(token, response.exception) for token, response in zip(tokens, batch_response.responses)]
+
+
+async def prune_tokens(user_tokens):
+    """🔹 Remove invalid tokens from users/{id}, in batched writes"""
+    db = get_db()
+    for chunk in chunked(list(user_tokens.items()), WRITE_BATCH_LIMIT):
+        batch = db.batch()
+        for user_id, _ in chunk:
+            batch.update(db.collection("users").document(user_id), {"fcmToken": firestore.DELETE_FIELD})
+        await batch.commit()
+
+
+def _results_ref(job_id):
+    return get_db().collection(JOB_COLLECTION).document(job_id).collection("results")
+
+
+async def save_campaign_results(job_id, outcomes):
+    """🔹 Write {user_id: (status, error)} as the campaign's results documents, in batched writes"""
+    db = get_db()
+    results = _results_ref(job_id)
+    for chunk in chunked(list(outcomes.items()), WRITE_BATCH_LIMIT):
+        batch = db.batch()
+        for user_id, (status, error) in chunk:
+            batch.set(results.document(user_id), {"user_id": user_id, "status": status, "error": error})
+        await batch.commit()
+
+
+async def list_campaign_results(job_id, cursor=None, limit=RESULTS_PAGE_SIZE, status=None):
+    """🔹 One page of a campaign's per-user outcomes in user id order
+
+    Pass the returned next_cursor as `cursor` for the following page (None
+    when there is no more); `status` keeps only one of RESULT_STATUSES.
+    """
+    if status is not None and status not in RESULT_STATUSES:
+        raise ValueError(f"unknown status {status}; choose from {', '.join(RESULT_STATUSES)}")
+    limit = max(1, min(int(limit), MAX_RESULTS_PAGE_SIZE))
+    query = _results_ref(job_id)
+    if status is not None:
+        query = query.where(filter=FieldFilter("status", "==", status))
+    query = query.order_by("__name__")
+    if cursor:
+        query = query.start_after({"__name__": cursor})
+    # One extra document tells whether another page exists
+    snapshots = [snapshot async for snapshot in query.limit(limit + 1).stream()]
+    return {
+        "results": [snapshot.to_dict() for snapshot in snapshots[:limit]],
+        "next_cursor": snapshots[limit - 1].id if len(snapshots) > limit else None
+    }
+
+
+# A campaign that stopped part way is not sent again: users would get it twice
+@job_queue.handler("bulk_notification", at_most_once=True)
+async def send_bulk_notification(title, body, data=None, user_ids=None, query=None):
+    """🔹 Send one notification to many users
+
+    Tokens come from `user_ids` (read with batched get_all) or from a users
+    `query` ({"where": [[field, op, value], ...], "limit": n}). They are sent
+    in multicast chunks of 500 with at most FCM_MAX_CONCURRENCY requests in
+    flight, and tokens FCM reports as invalid are removed from their user.
+
+    Returns counts only (users, sent, failed, invalid_token, pruned,
+    no_token and the most common failure messages), so the job record stays
+    small however large the campaign. Run as a job, it also stores each
+    user's outcome under the job (see list_campaign_results); results_saved
+    says whether that worked.
+    """
+    if user_ids is not None:
+        user_tokens = await tokens_for_users(user_ids)
+    else:
+        query = query or {}
+        user_tokens = await tokens_for_query(query.get("where"), query.get("limit"))
+
+    users_by_token = {}
+    outcomes = {}
+    for user_id, token in user_tokens.items():
+        if token:
+            users_by_token.setdefault(token, []).append(user_id)
+        else:
+            outcomes[user_id] = ("no_token", None)
+    report = {
+        "users": len(user_tokens),
+        "sent": 0,
+        "failed": 0,
+        "invalid_token": 0,
+        "pruned": 0,
+        # Users without a token or without a users/{id} document
+        "no_token": sum(1 for token in user_tokens.values() if not token),
+    }
+
+    # FCM only accepts string values in the data payload
+    data = {key: str(value) for key, value in (data or {}).items()}
+    semaphore = asyncio.Semaphore(FCM_MAX_CONCURRENCY)
+    chunks = await asyncio.gather(*(
+        send_multicast(tokens, title, body, data, semaphore)
+        for tokens in chunked(list(users_by_token), FCM_MULTICAST_LIMIT)
+    ))
+
+    invalid = {}
+    errors = Counter()
+    for token, error in (outcome for chunk in chunks for outcome in chunk):
+        users = users_by_token[token]
+        if error is None:
+            report["sent"] += len(users)
+            outcomes.update((user_id, ("sent", None)) for user_id in users)
+        elif is_invalid_token_error(error):
+            invalid.update((user_id, token) for user_id in users)
+            outcomes.update((user_id, ("invalid_token", str(error))) for user_id in users)
+        else:
+            report["failed"] += len(users)
+            errors[str(error)] += len(users)
+            outcomes.update((user_id, ("failed", str(error))) for user_id in users)
+
+    if invalid:
+        try:
+            await prune_tokens(invalid)
+            report["pruned"] = len(invalid)
+        except Exception as e:
+            print(f"❌ Error pruning invalid tokens: {e}")
+
+    report["invalid_token"] = len(invalid)
+    report["errors"] = dict(errors.most_common(MAX_REPORTED_ERRORS))
+
+    report["results_saved"] = False
+    job_id = current_job_id.get()
+    if job_id:
+        try:
+            await save_campaign_results(job_id, outcomes)
+            report["results_saved"] = True
+        except Exception as e:
+            # The notifications went out; only the per-user breakdown is missing
+            print(f"❌ Error saving the results of campaign {job_id}: {e}")
+    return report
@@ -0,0 +1,171 @@
+import re
+
+from decouple import config
+
+
+# Budgets are in estimated tokens for the per-turn part of the answer prompt;
+# the static instructions travel separately as the model's system instruction
+PROMPT_TOKEN_BUDGET = config("PROMPT_TOKEN_BUDGET", default=1200, cast=int)
+HISTORY_TOKEN_BUDGET = config("HISTORY_TOKEN_BUDGET", default=400, cast=int)
+SUMMARY_MAX_TOKENS = config("SUMMARY_MAX_TOKENS", default=150, cast=int)
+TURN_MAX_TOKENS = config("TURN_MAX_TOKENS", default=150, cast=int)
+QUERY_MAX_TOKENS = config("QUERY_MAX_TOKENS", default=300, cast=int)
+# Rough chars-per-token for Thai/English mixed text; only used for budgeting,
+# the real counts come back in usage_metadata and are logged per call
+CHARS_PER_TOKEN = config("CHARS_PER_TOKEN", default=3.0, cast=float)
+
+# Appended to the answer by compose_response(); stripped again from history
+FOLLOWUP_PREFIX = "คำถามถัดไป:"
+RISK_SUFFIX_PATTERN = re.compile(r"\n\n\[(ระดับความเสี่ยง|ไม่สามารถระบุระดับความเสี่ยง).*", re.DOTALL)
+
+RAG_SYSTEM_INSTRUCTION = """
+### AI Health Assistant Role
+You are a professional AI health assistant specializing in Non-Communicable Diseases (NCDs).
+- You are NOT a licensed medical professional
+- Your goal is to provide general health information and guidance
+- ALWAYS recommend consulting a healthcare professional for personalized medical advice
+
+### Communication Guidelines
+- Respond in Thai with a compassionate and professional tone
+- Be clear, concise, and use simple medical language
+- Maximum response length: 3-4 sentences
+- Focus on providing helpful, evidence-based information
+
+### Ethical and Safety Principles
+1. Never diagnose medical conditions
+2. Do not prescribe treatments or medications
+3. Acknowledge the limitations of AI health advice
+4. Emphasize the importance of professional medical consultation
+5. Provide general health recommendations based on available context
+
+### Risk Communication Framework
+- Use neutral, non-alarming language
+- Provide constructive health suggestions
+- Avoid causing unnecessary anxiety
+- Encourage preventive health behaviors
+
+### Response Requirements
+- Answer in Thai
+- Include a clear disclaimer about consulting healthcare professionals
+- Provide general, supportive health guidance
+- If query is unrelated to health, politely redirect
+- Each message gives you context from the knowledge base, a summary of the
+  earlier conversation, the latest turns and the user's question
+""".strip()
+
+
+def estimate_tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN) + 1 if text else 0
+
+
+def trim_to_tokens(text, max_tokens):
+    """🔹 Cut text to about max_tokens, at a line or word boundary where possible"""
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind("\n"), cut.rfind(" "))
+    if boundary > max_chars // 2:
+        cut = cut[:boundary]
+    return cut.rstrip() + " …"
+
+
+def dedupe_chunks(chunks):
+    """🔹 Drop repeated chunks and the lines neighbouring chunks share through overlap"""
+    seen = set()
+    unique = []
+    for chunk in chunks:
+        lines = []
+        for line in chunk.splitlines():
+            key = " ".join(line.split())
+            if key and key not in seen:
+                seen.add(key)
+                lines.append(line.strip())
+        if lines:
+            unique.append("\n".join(lines))
+    return unique
+
+
+def strip_appendix(response):
+    """Answer text without the risk summary compose_response() appended; returns (answer, follow-up)"""
+    response = RISK_SUFFIX_PATTERN.sub("", response or "")
+    answer, _, followup = response.partition(f"\n\n{FOLLOWUP_PREFIX}")
+    return answer.strip(), followup.strip() or None
+
+
+def format_turn(entry, with_followup=False):
+    answer, followup = strip_appendix(entry.get("response", ""))
+    lines = [f"ผู้ใช้: {entry.get('query', '')}", f"ผู้ช่วย: {trim_to_tokens(answer, TURN_MAX_TOKENS)}"]
+    if with_followup and followup:
+        # The user's next message usually answers this question
+        lines.append(f"ผู้ช่วยถามต่อ: {followup}")
+    return "\n".join(lines)
+
+
+def format_history(summary, turns, budget=HISTORY_TOKEN_BUDGET):
+    """🔹 Rolling summary plus as many of the latest turns as fit in the budget"""
+    parts = []
+    if summary:
+        parts.append(f"สรุปการสนทนาก่อนหน้า: {trim_to_tokens(summary, SUMMARY_MAX_TOKENS)}")
+    remaining = budget - sum(estimate_tokens(part) for part in parts)
+
+    recent = []
+    for index, entry in enumerate(reversed(turns)):
+        text = format_turn(entry, with_followup=index == 0)
+        cost = estimate_tokens(text)
+        if cost > remaining:
+            break
+        recent.append(text)
+        remaining -= cost
+    return "\n\n".join(parts + list(reversed(recent)))
+
+
+def build_rag_prompt(query, chunks, conversation_history, budget=PROMPT_TOKEN_BUDGET):
+    """🔹 Per-turn part of the answer prompt, kept within `budget` tokens
+
+    The question and the (already budgeted) history go in first; retrieved
+    chunks, deduplicated and in rank order, fill what is left.
+    """
+    query = trim_to_tokens(query, QUERY_MAX_TOKENS)
+    remaining = budget - estimate_tokens(query) - estimate_tokens(conversation_history)
+
+    context = []
+    for chunk in dedupe_chunks(chunks):
+        if remaining <= 0:
+            break
+        cost = estimate_tokens(chunk)
+        if cost > remaining:
+            chunk = trim_to_tokens(chunk, remaining)
+            cost = remaining
+        context.append(chunk)
+        remaining -= cost
+
+    return f"""### Context from Knowledge Base:
+{chr(10).join(context) or "-"}
+
+### Conversation History:
+{conversation_history or "-"}
+
+### User's Question:
+{query}
+
+### AI's Recommended Response (in Thai):
+"""
+
+
+def build_summary_prompt(previous_summary, turns):
+    """🔹 Prompt that folds the given turns into the running conversation summary"""
+    conversation = "\n\n".join(format_turn(entry) for entry in turns)
+    return f"""
+    Update the running summary of a Thai health conversation with the new turns below.
+    Keep every health fact the user shared (symptoms, habits, family history, measurements)
+    and the topics already covered. Write in Thai, at most 80 words, as plain text.
+
+    ### Current Summary:
+    {previous_summary or "-"}
+
+    ### New Turns:
+    {conversation}
+
+    ### Updated Summary:
+    """
@@ -0,0 +1,358 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from decouple import config
+from firebase_admin import firestore
+from google.api_core.exceptions import Conflict, FailedPrecondition
+
+from ai.converse import analyze_risk
+from ai.history import EXPORT_PAGE_SIZE, iter_documents, iter_user_records
+from ai.llm import LLMClient
+from ai.resources import get_db
+from ai.risk import classified, update_risk_state
+from ai.user_cache import session_cache
+
+
+# Users re-scored at the same time, and Gemini calls per second for the whole
+# run: keep the rate well under the project quota, the live chat shares it
+RESCORE_CONCURRENCY = config("RESCORE_CONCURRENCY", default=8, cast=int)
+RESCORE_RATE = config("RESCORE_RATE", default=4.0, cast=float)
+# Firestore allows 500 writes per batch
+RESCORE_BATCH_WRITES = config("RESCORE_BATCH_WRITES", default=400, cast=int)
+# A partly filled batch is committed after this many seconds, so the
+# checkpoint keeps moving at low rates
+RESCORE_FLUSH_INTERVAL = config("RESCORE_FLUSH_INTERVAL", default=10, cast=float)
+RESCORE_CHECKPOINT_FILE = config("RESCORE_CHECKPOINT_FILE", default="rescore_checkpoint.json")
+
+# current: the open session on conversations/{user_id}; sessions: archived
+# sessions/{session_id}; all: both
+SCOPES = ("current", "sessions", "all")
+CONVERSATION_FIELDS = ["session_id", "risk_state", "risk_level", "risk_classification"]
+
+
+def level_of(risk_level):
+    """"red"/"green" from a stored risk_level text ("ระดับความเสี่ยง: **แดง (red)** ..."), else None"""
+    for level in ("red", "green"):
+        if f"({level})" in (risk_level or ""):
+            return level
+    return None
+
+
+async def session_states(user_id, page_size=EXPORT_PAGE_SIZE):
+    """🔹 The risk state of each of a user's sessions, rebuilt from their messages"""
+    states = {}
+    async for record in iter_user_records(user_id, "messages", ["session_id", "query"], page_size):
+        if record.get("query"):
+            session_id = record["session_id"]
+            states[session_id], _ = update_risk_state(states.get(session_id), record["query"])
+    return states
+
+
+async def plan_user(snapshot, scope, page_size=EXPORT_PAGE_SIZE):
+    """🔹 What to classify for one user: [(session_id or "current", risk_state, stored level)]
+
+    The open session's state is the one the chat keeps on the conversation
+    document; archived sessions only kept their risk_level text, so their
+    states are folded again from the messages. Sessions still holding a
+    legacy `conversation` array have no messages and are skipped (run
+    migrate_conversations.py first).
+    """
+    user_id = snapshot.id
+    data = snapshot.to_dict() or {}
+    open_session = data.get("session_id")
+    states = {}
+    if scope != "current" or not data.get("risk_state"):
+        states = await session_states(user_id, page_size)
+
+    targets = []
+    if scope in ("current", "all"):
+        state = data.get("risk_state") or states.get(open_session)
+        if state and state["user_turns"]:
+            stored = (data.get("risk_classification") or {}).get("level") or level_of(data.get("risk_level"))
+            targets.append(("current", state, stored))
+    if scope in ("sessions", "all"):
+        async for record in iter_user_records(user_id, "sessions", ["session_id", "risk_level"], page_size):
+            state = states.get(record["session_id"])
+            if record["session_id"] != open_session and state:
+                targets.append((record["session_id"], state, level_of(record["risk_level"])))
+    return targets
+
+
+class StubRiskModel:
+    """🔹 Local stand-in for Gemini's risk call, for reproducible dry runs
+
+    Answers "red" when the prompt lists a risk factor as present or any
+    symptom, "green" otherwise, after `latency` seconds.
+    """
+
+    def __init__(self, latency=0.2):
+        self.latency = latency
+        self.calls = 0
+
+    async def generate_content_async(self, prompt, request_options=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if ": yes" in prompt or "- Reported symptoms: none" not in prompt:
+            text = "red\nมีปัจจัยเสี่ยงหรืออาการที่อาจเกี่ยวข้องกับโรค NCDs"
+        else:
+            text = "green\nไม่พบปัจจัยเสี่ยงหรืออาการที่เกี่ยวข้องกับโรค NCDs"
+        return SimpleNamespace(text=text, usage_metadata=None)
+
+
+class Rescorer:
+    """🔹 Re-classify every user's stored risk level with the current prompt
+
+    conversations documents are read a page at a time in key order and up
+    to `concurrency` users are scored at once, with Gemini calls held to
+    `rate` per second by the run's own LLMClient. Results go out in batched
+    writes; after each commit the checkpoint records the last user below
+    which every user is written, so an interrupted run resumes there (users
+    finished past it are scored again, which rewrites the same fields).
+
+    The conversation document is only updated if it has not changed since
+    it was read: a user who chatted (or started a new session) meanwhile is
+    skipped and counted as stale, so the batch never overwrites a newer risk
+    state or the live risk job's result. Run again with --user for them.
+    """
+
+    def __init__(self, scope="all", concurrency=RESCORE_CONCURRENCY, rate=RESCORE_RATE,
+                 batch_writes=RESCORE_BATCH_WRITES, flush_interval=RESCORE_FLUSH_INTERVAL,
+                 checkpoint_file=RESCORE_CHECKPOINT_FILE, dry_run=False, page_size=EXPORT_PAGE_SIZE):
+        if scope not in SCOPES:
+            raise ValueError(f"unknown scope {scope!r}; choose from {', '.join(SCOPES)}")
+        self.scope = scope
+        self.concurrency = max(1, concurrency)
+        self.client = LLMClient(rate=rate, burst=max(1, int(rate)), max_concurrency=self.concurrency)
+        self.batch_writes = max(1, min(batch_writes, 500))
+        self.flush_interval = flush_interval
+        self.checkpoint_file = checkpoint_file
+        self.dry_run = dry_run
+        self.page_size = page_size
+
+        self.cursor = None
+        self.counts = {"users": 0, "sessions": 0, "failed": 0, "stale": 0, "unchanged": 0, "to_red": 0,
+                       "to_green": 0, "new": 0, "writes": 0, "commits": 0}
+        self.failed_users = []
+        self.stale_users = []
+        self.started = None
+        self.run_users = 0
+
+        self._order = deque()
+        self._written = set()
+        self._batch = None
+        self._batch_users = []
+        self._batch_writes = 0
+        self._batch_since = None
+        self._flush_lock = asyncio.Lock()
+
+    # ------------------------------------------------------------ checkpoint ---
+
+    def load_checkpoint(self):
+        """🔹 Pick up an interrupted run; returns False when there is none
+
+        The carried-over counts include users finished past the cursor, who
+        are scored and counted again.
+        """
+        if not self.checkpoint_file or not os.path.exists(self.checkpoint_file):
+            return False
+        with open(self.checkpoint_file, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint["scope"] != self.scope:
+            raise ValueError(f"the checkpoint is for --scope {checkpoint['scope']}; "
+                             f"finish that run or start over with --restart")
+        self.cursor = checkpoint["cursor"]
+        self.counts.update(checkpoint["counts"])
+        self.failed_users = checkpoint["failed_users"]
+        self.stale_users = checkpoint.get("stale_users", [])
+        return True
+
+    def save_checkpoint(self):
+        if self.dry_run or not self.checkpoint_file:
+            return
+        checkpoint = {"scope": self.scope, "cursor": self.cursor, "counts": self.counts,
+                      "failed_users": self.failed_users, "stale_users": self.stale_users}
+        # Written aside and renamed over, so a crash never leaves half a file
+        temporary = f"{self.checkpoint_file}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+        os.replace(temporary, self.checkpoint_file)
+
+    def clear_checkpoint(self):
+        if self.checkpoint_file and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    # --------------------------------------------------------------- writes ---
+
+    async def _stage(self, user_id, writes, outcomes, current):
+        """Queue one user's writes; they always land in the same batch
+
+        `writes` are (ref, data, option) and `outcomes` the user's session
+        outcomes, counted once the writes are committed.
+        """
+        async with self._flush_lock:
+            if self._batch_writes and self._batch_writes + len(writes) > self.batch_writes:
+                await self._commit()
+            if self._batch is None:
+                self._batch = get_db().batch()
+                self._batch_since = time.monotonic()
+            for ref, data, option in writes:
+                self._batch.update(ref, data, option=option)
+            self._batch_writes += len(writes)
+            self._batch_users.append((user_id, writes, outcomes, current))
+            if self._batch_writes >= self.batch_writes or time.monotonic() - self._batch_since >= self.flush_interval:
+                await self._commit()
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._commit()
+
+    async def _commit(self):
+        if self._batch is None:
+            return
+        users = self._batch_users
+        written = users
+        if self._batch_writes and not self.dry_run:
+            try:
+                await self._batch.commit()
+                self.counts["commits"] += 1
+            except (FailedPrecondition, Conflict):
+                # Someone in the batch chatted since being read; nothing was
+                # applied, so write each user on their own to find who
+                written = await self._commit_each(users)
+        self._batch, self._batch_users, self._batch_writes = None, [], 0
+
+        for user_id, writes, outcomes, current in written:
+            self.counts["writes"] += len(writes)
+            self.counts["sessions"] += len(outcomes)
+            for outcome in outcomes:
+                self.counts[outcome] += 1
+            if current and not self.dry_run:
+                # API workers must not keep serving the old level from cache
+                await session_cache.invalidate(user_id)
+        for user_id, *_ in users:
+            self._written.add(user_id)
+        # The checkpoint only moves past users whose predecessors are all written
+        while self._order and self._order[0] in self._written:
+            self.cursor = self._order.popleft()
+            self._written.discard(self.cursor)
+        self.save_checkpoint()
+        print(f"✅ {self.counts['users']} users, {self.counts['sessions']} sessions re-scored "
+              f"({self.users_per_minute():.0f} users/min), checkpoint at {self.cursor}")
+
+    async def _commit_each(self, users):
+        """Commit users one batch each; returns those written, counting the stale ones"""
+        written = []
+        for user_id, writes, outcomes, current in users:
+            batch = get_db().batch()
+            for ref, data, option in writes:
+                batch.update(ref, data, option=option)
+            try:
+                await batch.commit()
+                self.counts["commits"] += 1
+                written.append((user_id, writes, outcomes, current))
+            except (FailedPrecondition, Conflict):
+                print(f"⚠️ {user_id} chatted during the re-score; skipped")
+                self.counts["stale"] += 1
+                self.stale_users.append(user_id)
+        return written
+
+    # -------------------------------------------------------------- scoring ---
+
+    async def score_user(self, snapshot):
+        """🔹 Classify one user's sessions and stage the updates"""
+        user_id = snapshot.id
+        db = get_db()
+        chat_ref = db.collection("conversations").document(user_id)
+        # The chat may write a newer risk state (or a new session) while this one is scored
+        unchanged = db.write_option(last_update_time=snapshot.update_time) if snapshot.update_time else None
+        targets = await plan_user(snapshot, self.scope, self.page_size)
+        results = await asyncio.gather(*(analyze_risk(state, self.client) for _, state, _ in targets))
+
+        writes = []
+        outcomes = []
+        failed = False
+        for (target, state, stored), result in zip(targets, results):
+            if result["status"] != "success":
+                failed = True
+                continue
+            level = result["original_risk_level"]
+            outcomes.append("new" if stored is None else "unchanged" if stored == level else f"to_{level}")
+            update = {"risk_level": result["risk_level"], "risk_rescored_at": firestore.SERVER_TIMESTAMP}
+            if target == "current":
+                # Already delivered: a batch re-score is not announced in the chat
+                update["risk_classification"] = {**classified(state, level), "delivered": True}
+                writes.append((chat_ref, update, unchanged))
+            else:
+                writes.append((chat_ref.collection("sessions").document(target), update, None))
+
+        if failed:
+            if self.client.breaker.state != "closed":
+                # Left before the checkpoint, so a resumed run scores this user again
+                raise RuntimeError("Gemini is failing (circuit open); stopping so the run can resume later")
+            self.counts["failed"] += 1
+            self.failed_users.append(user_id)
+        self.counts["users"] += 1
+        self.run_users += 1
+        await self._stage(user_id, writes, outcomes, current=any(ref is chat_ref for ref, _, _ in writes))
+
+    def users_per_minute(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return self.run_users / elapsed * 60 if elapsed else 0.0
+
+    async def _snapshots(self, user_ids):
+        if user_ids:
+            conversations = get_db().collection("conversations")
+            for user_id in dict.fromkeys(user_ids):
+                snapshot = await conversations.document(user_id).get()
+                if snapshot.exists:
+                    yield snapshot
+            return
+        async for snapshot in iter_documents(get_db().collection("conversations"), CONVERSATION_FIELDS,
+                                             self.page_size, start_after=self.cursor):
+            yield snapshot
+
+    async def run(self, user_ids=None):
+        """🔹 Re-score every user after the checkpoint (or just `user_ids`); returns the counts"""
+        self.started = time.monotonic()
+        user_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def feed():
+            async for snapshot in self._snapshots(user_ids):
+                self._order.append(snapshot.id)
+                await user_queue.put(snapshot)
+            for _ in range(self.concurrency):
+                await user_queue.put(None)
+
+        async def work():
+            while (snapshot := await user_queue.get()) is not None:
+                await self.score_user(snapshot)
+
+        tasks = [asyncio.create_task(feed())] + [asyncio.create_task(work()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            try:
+                # Keep what finished before the failure
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Re-score batch commit failed: {e}")
+            raise
+        await self.flush()
+        return self.report()
+
+    def report(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return {
+            **self.counts,
+            "seconds": round(elapsed, 1),
+            "users_per_minute": round(self.users_per_minute(), 1),
+            "model_calls": self.client.counts["requests"],
+            "failed_users": self.failed_users,
+            "stale_users": self.stale_users,
+        }
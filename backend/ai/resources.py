@@ -0,0 +1,273 @@
+import json
+import os
+import threading
+
+from decouple import config
+
+
+FIREBASE_CREDENTIALS = config("FIREBASE_CREDENTIALS", default="firebase-adminsdk.json")
+CHROMA_DIR = config("CHROMA_DIR", default="./chroma_db_ncd")
+# Empty means "the model chroma_db_ncd was built with" (recorded by reindex.py),
+# so swapping in a rebuilt store also switches the query model
+EMBEDDING_MODEL = config("EMBEDDING_MODEL", default="")
+LEGACY_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# torch | onnx | onnx-int8 (dynamically quantized ONNX, the fastest on CPU)
+EMBEDDING_BACKEND = config("EMBEDDING_BACKEND", default="torch")
+EMBEDDING_ONNX_INT8_FILE = config("EMBEDDING_ONNX_INT8_FILE", default="onnx/model_qint8_avx512_vnni.onnx")
+# 0 leaves the thread count to torch / onnxruntime
+EMBEDDING_THREADS = config("EMBEDDING_THREADS", default=0, cast=int)
+EMBEDDING_BATCH_SIZE = config("EMBEDDING_BATCH_SIZE", default=32, cast=int)
+INDEX_INFO_FILE = "embedding.json"
+# Base URL of retrieval_service.py. When set, embedding and retrieval run in
+# that one process and API workers never load the embedder or open Chroma
+RETRIEVAL_URL = config("RETRIEVAL_URL", default="")
+GEMINI_MODEL = config("GEMINI_MODEL", default="gemini-1.5-flash")
+# Multilingual (incl. Thai) cross-encoder for reranking; empty disables the stage
+RERANK_MODEL = config("RERANK_MODEL", default="cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+
+# Heavy clients are created on first use (or by warm_up() at startup), so that
+# importing the backend stays cheap for workers, --reload and scripts
+_lock = threading.RLock()
+_resources = {}
+_errors = {}
+
+
+def _load(name, loader):
+    resource = _resources.get(name)
+    if resource is not None:
+        return resource
+
+    with _lock:
+        if name not in _resources:
+            try:
+                _resources[name] = loader()
+                _errors.pop(name, None)
+            except Exception as e:
+                _errors[name] = str(e)
+                raise
+        return _resources[name]
+
+
+def init_firebase():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _lock:
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS))
+
+
+def _load_firestore():
+    from firebase_admin import firestore_async
+
+    init_firebase()
+    return firestore_async.client()
+
+
+def read_index_info(directory=CHROMA_DIR):
+    """🔹 Embedding settings a Chroma directory was built with"""
+    try:
+        with open(os.path.join(directory, INDEX_INFO_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Stores from before reindex.py were all built with MiniLM
+        return {"model": LEGACY_EMBEDDING_MODEL}
+
+
+def embedding_model_name():
+    return EMBEDDING_MODEL or read_index_info().get("model", LEGACY_EMBEDDING_MODEL)
+
+
+def create_embeddings(model_name=None, backend=EMBEDDING_BACKEND, threads=EMBEDDING_THREADS,
+                      batch_size=EMBEDDING_BATCH_SIZE):
+    """🔹 sentence-transformers embeddings on CPU with the torch or ONNX runtime"""
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    model_kwargs = {"device": "cpu"}
+    if backend == "torch":
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+    elif backend in ("onnx", "onnx-int8"):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError(f"EMBEDDING_BACKEND={backend} requires `optimum[onnxruntime]`") from e
+
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+        onnx_kwargs = {"provider": "CPUExecutionProvider", "session_options": session_options}
+        if backend == "onnx-int8":
+            onnx_kwargs["file_name"] = EMBEDDING_ONNX_INT8_FILE
+        model_kwargs.update(backend="onnx", model_kwargs=onnx_kwargs)
+    else:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    return HuggingFaceEmbeddings(
+        model_name=model_name or embedding_model_name(),
+        model_kwargs=model_kwargs,
+        # Chroma ranks by L2 distance, which only matches cosine on unit vectors
+        encode_kwargs={"batch_size": batch_size, "normalize_embeddings": True},
+    )
+
+
+def _load_embeddings():
+    if RETRIEVAL_URL:
+        from ai.retrieval_client import RemoteEmbeddings
+
+        return RemoteEmbeddings(RETRIEVAL_URL)
+    return create_embeddings()
+
+
+def _load_vector_db():
+    from langchain_chroma import Chroma
+
+    built_with = read_index_info().get("model")
+    if built_with != embedding_model_name():
+        raise RuntimeError(
+            f"{CHROMA_DIR} was built with {built_with}, not {embedding_model_name()}; "
+            f"rebuild it with: python reindex.py --model {embedding_model_name()}"
+        )
+    return Chroma(persist_directory=CHROMA_DIR, embedding_function=get_embeddings())
+
+
+def _load_genai_model():
+    import google.generativeai as genai
+
+    genai.configure(api_key=config("GOOGLE_GEMINI_API_KEY"))
+    return genai.GenerativeModel(model_name=GEMINI_MODEL)
+
+
+def _load_answer_model():
+    import google.generativeai as genai
+
+    from ai.prompts import RAG_SYSTEM_INSTRUCTION
+
+    get_genai_model()  # configures the API key
+    # The fixed instructions are sent as the system instruction, once per model
+    return genai.GenerativeModel(model_name=GEMINI_MODEL, system_instruction=RAG_SYSTEM_INSTRUCTION)
+
+
+def _load_reranker():
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(RERANK_MODEL, device="cpu", max_length=256)
+
+
+def _load_question_bank():
+    from ai.followup import load_question_bank
+
+    return load_question_bank()
+
+
+def _load_fcm():
+    from firebase_admin import messaging
+
+    init_firebase()
+    # The module itself is the transport: send() / send_each_for_multicast()
+    return messaging
+
+
+def get_db():
+    return _load("firestore", _load_firestore)
+
+
+def get_embeddings():
+    return _load("embeddings", _load_embeddings)
+
+
+def get_vector_db():
+    return _load("vector_db", _load_vector_db)
+
+
+def get_genai_model():
+    return _load("genai_model", _load_genai_model)
+
+
+def get_answer_model():
+    return _load("answer_model", _load_answer_model)
+
+
+def get_reranker():
+    return _load("reranker", _load_reranker)
+
+
+def get_question_bank():
+    return _load("question_bank", _load_question_bank)
+
+
+def get_fcm():
+    return _load("fcm", _load_fcm)
+
+
+def set_resource(name, resource):
+    """🔹 Install a ready-made component, e.g. a local stand-in for benchmarks"""
+    with _lock:
+        _resources[name] = resource
+        _errors.pop(name, None)
+
+
+COMPONENTS = {
+    "firestore": get_db,
+    "embeddings": get_embeddings,
+    "question_bank": get_question_bank,
+    "vector_db": get_vector_db,
+    "genai_model": get_genai_model,
+    "answer_model": get_answer_model,
+    "fcm": get_fcm,
+}
+if RERANK_MODEL:
+    COMPONENTS["reranker"] = get_reranker
+if RETRIEVAL_URL:
+    # Both live in the retrieval service
+    COMPONENTS.pop("vector_db")
+    COMPONENTS.pop("reranker", None)
+
+
+def preload_shared():
+    """🔹 Load the models forked workers can share (gunicorn preload_app)
+
+    Weights are read-only once loaded, so workers keep sharing their pages
+    copy-on-write. gRPC clients (Firestore, Gemini, FCM) and Chroma's SQLite
+    handle are not fork-safe and still load in each worker. Nothing may run
+    inference here: a torch thread pool started before fork hangs the workers.
+    """
+    if RETRIEVAL_URL:
+        return
+    get_embeddings()
+    if RERANK_MODEL:
+        get_reranker()
+
+
+def configure_worker_threads(workers):
+    """Give each of `workers` processes its share of the cores for torch inference"""
+    if RETRIEVAL_URL or EMBEDDING_THREADS or EMBEDDING_BACKEND != "torch":
+        return
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def warm_up():
+    """🔹 Load every component up front; failures are reported by readiness()"""
+    for name, loader in COMPONENTS.items():
+        try:
+            loader()
+            print(f"✅ {name} ready")
+        except Exception as e:
+            print(f"❌ {name} failed to load: {e}")
+
+
+def readiness():
+    status = {}
+    for name in COMPONENTS:
+        if name in _resources:
+            status[name] = "ready"
+        elif name in _errors:
+            status[name] = f"error: {_errors[name]}"
+        else:
+            status[name] = "not_loaded"
+    return status
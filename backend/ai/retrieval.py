@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from decouple import config
+
+from ai.metrics import span
+from ai.resources import RERANK_MODEL, RETRIEVAL_URL, get_reranker, get_vector_db
+from ai.retrieval_client import remote_retrieve
+
+
+# Embedding, Chroma, BM25 and the reranker are CPU/SQLite bound, so they get a
+# small bounded pool instead of running on the event loop or in Starlette's
+# shared threadpool
+retrieval_executor = ThreadPoolExecutor(max_workers=config("RETRIEVAL_MAX_WORKERS", default=4, cast=int))
+
+RETRIEVAL_K = config("RETRIEVAL_K", default=5, cast=int)
+# Candidates taken from each of vector and keyword search, and handed to the reranker
+RETRIEVAL_CANDIDATES = config("RETRIEVAL_CANDIDATES", default=20, cast=int)
+# Whole-pipeline latency budget; the rerank stage is skipped when it would overrun
+RETRIEVAL_BUDGET_MS = config("RETRIEVAL_BUDGET_MS", default=400, cast=float)
+HYBRID_RETRIEVAL = config("HYBRID_RETRIEVAL", default=True, cast=bool)
+RRF_K = 60
+RERANK_CACHE_SIZE = config("RERANK_CACHE_SIZE", default=4096, cast=int)
+# How often the keyword index checks the collection for newly ingested chunks
+BM25_REFRESH_SECONDS = config("BM25_REFRESH_SECONDS", default=60, cast=float)
+
+# Query keywords -> the `category` metadata written by ingest.py --category
+CATEGORY_KEYWORDS = {
+    "diabetes": ("เบาหวาน", "น้ำตาลในเลือด", "อินซูลิน", "diabetes"),
+    "hypertension": ("ความดันโลหิต", "ความดันสูง", "hypertension", "blood pressure"),
+    "heart_disease": ("โรคหัวใจ", "หัวใจขาดเลือด", "heart disease"),
+    "stroke": ("หลอดเลือดสมอง", "อัมพาต", "stroke"),
+    "kidney_disease": ("โรคไต", "ไตวาย", "ไตเสื่อม", "kidney"),
+    "cancer": ("มะเร็ง", "cancer"),
+    "copd": ("ถุงลมโป่งพอง", "ปอดอุดกั้น", "copd"),
+    "dyslipidemia": ("ไขมันในเลือด", "คอเลสเตอรอล", "cholesterol"),
+    "obesity": ("โรคอ้วน", "น้ำหนักเกิน", "obesity"),
+}
+
+THAI_RUN = re.compile(r"[\u0e00-\u0e7f]+")
+LATIN_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """🔹 Latin words plus character bigrams of Thai runs (Thai has no spaces between words)"""
+    text = text.lower()
+    tokens = LATIN_WORD.findall(text)
+    for run in THAI_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """🔹 In-memory Okapi BM25 over the chunks of the Chroma collection"""
+
+    def __init__(self, documents, metadatas, k1=1.5, b=0.75):
+        self.documents = documents
+        self.categories = [(metadata or {}).get("category") for metadata in metadatas]
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        lengths = []
+        for index, document in enumerate(documents):
+            counts = Counter(tokenize(document))
+            lengths.append(sum(counts.values()))
+            for token, count in counts.items():
+                self.postings[token].append((index, count))
+        self.lengths = np.array(lengths, dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if documents else 0.0
+        total = len(documents)
+        self.idf = {
+            token: math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+            for token, posting in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.documents)
+
+    def known_categories(self):
+        return {category for category in self.categories if category}
+
+    def search(self, query, k, category=None):
+        """Return [(chunk text, score), ...] best first"""
+        if not self.documents:
+            return []
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for token, query_count in Counter(tokenize(query)).items():
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for index, count in self.postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.average_length)
+                scores[index] += query_count * idf * count * (self.k1 + 1) / (count + norm)
+
+        if category:
+            mask = np.array([c == category for c in self.categories])
+            scores = np.where(mask, scores, 0.0)
+
+        top = np.argsort(-scores)[:k]
+        return [(self.documents[index], float(scores[index])) for index in top if scores[index] > 0]
+
+
+_index_lock = threading.Lock()
+_index = None
+_index_size = -1
+_index_checked = 0.0
+
+
+def get_keyword_index():
+    """🔹 BM25 index over the vector store's chunks, rebuilt when the collection grows"""
+    global _index, _index_size, _index_checked
+    if _index is not None and time.monotonic() - _index_checked < BM25_REFRESH_SECONDS:
+        return _index
+
+    with _index_lock:
+        if _index is not None and time.monotonic() - _index_checked < BM25_REFRESH_SECONDS:
+            return _index
+        collection = get_vector_db()._collection
+        size = collection.count()
+        if _index is None or size != _index_size:
+            records = collection.get(include=["documents", "metadatas"])
+            _index = BM25Index(records["documents"] or [], records["metadatas"] or [])
+            _index_size = size
+            print(f"✅ keyword index built over {size} chunks")
+        _index_checked = time.monotonic()
+        return _index
+
+
+def detect_category(query, known_categories):
+    """A category filter is applied only when the query names exactly one indexed category"""
+    lowered = query.lower()
+    matches = {
+        category for category, keywords in CATEGORY_KEYWORDS.items()
+        if category in known_categories and any(keyword in lowered for keyword in keywords)
+    }
+    return matches.pop() if len(matches) == 1 else None
+
+
+def vector_search(query_vector, k, category=None):
+    kwargs = {"filter": {"category": category}} if category else {}
+    documents = get_vector_db().similarity_search_by_vector(query_vector, k=k, **kwargs)
+    return [document.page_content for document in documents]
+
+
+def fuse(*rankings):
+    """🔹 Reciprocal rank fusion of several ranked chunk lists"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, text in enumerate(ranking):
+            scores[text] += 1.0 / (RRF_K + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+_rerank_cache = OrderedDict()
+_rerank_lock = threading.Lock()
+
+
+def _pair_key(query, text):
+    return hashlib.sha1(f"{query}\0{text}".encode("utf-8")).hexdigest()
+
+
+def rerank(query, candidates):
+    """🔹 Order candidates by cross-encoder score; pair scores are cached (LRU)"""
+    keys = [_pair_key(query, text) for text in candidates]
+    with _rerank_lock:
+        scores = {key: _rerank_cache[key] for key in keys if key in _rerank_cache}
+        for key in scores:
+            _rerank_cache.move_to_end(key)
+
+    missing = [(key, text) for key, text in zip(keys, candidates) if key not in scores]
+    if missing:
+        predicted = get_reranker().predict([(query, text) for _, text in missing])
+        with _rerank_lock:
+            for (key, _), score in zip(missing, predicted):
+                scores[key] = _rerank_cache[key] = float(score)
+            while len(_rerank_cache) > RERANK_CACHE_SIZE:
+                _rerank_cache.popitem(last=False)
+
+    order = sorted(range(len(candidates)), key=lambda i: scores[keys[i]], reverse=True)
+    return [candidates[i] for i in order]
+
+
+async def _stage(stage, func, *args):
+    loop = asyncio.get_running_loop()
+    with span(stage):
+        return await loop.run_in_executor(retrieval_executor, func, *args)
+
+
+async def retrieve(query, query_vector, k=RETRIEVAL_K, category=None, hybrid=HYBRID_RETRIEVAL,
+                   use_reranker=bool(RERANK_MODEL), budget_ms=RETRIEVAL_BUDGET_MS):
+    """🔹 Hybrid retrieval: vector + BM25 candidates, fused, then reranked within the budget
+
+    `category` restricts both searches to chunks with that metadata; when it
+    is not given it is detected from the query. Any stage that fails or runs
+    out of budget is skipped, so the result degrades to plain vector search
+    rather than failing the turn.
+
+    With RETRIEVAL_URL set the whole pipeline runs in the retrieval service.
+    """
+    if RETRIEVAL_URL:
+        with span("retrieval.remote"):
+            return await remote_retrieve(
+                query, query_vector, k=k, category=category, hybrid=hybrid,
+                use_reranker=use_reranker, budget_ms=budget_ms
+            )
+
+    deadline = time.perf_counter() + budget_ms / 1000
+
+    index = None
+    if hybrid:
+        try:
+            index = await _stage("retrieval.keyword_index", get_keyword_index)
+        except Exception as e:
+            print(f"❌ Keyword index unavailable: {e}")
+    if category is None and index is not None:
+        category = detect_category(query, index.known_categories())
+
+    candidates = RETRIEVAL_CANDIDATES if (hybrid or use_reranker) else k
+    searches = [_stage("retrieval.vector", vector_search, query_vector, candidates, category)]
+    if index is not None:
+        searches.append(_stage("retrieval.keyword", index.search, query, candidates, category))
+    rankings = []
+    for result in await asyncio.gather(*searches, return_exceptions=True):
+        if isinstance(result, Exception):
+            print(f"❌ Retrieval stage failed: {result}")
+            continue
+        rankings.append([item[0] if isinstance(item, tuple) else item for item in result])
+
+    ranked = fuse(*rankings)[:RETRIEVAL_CANDIDATES]
+    remaining = deadline - time.perf_counter()
+    if use_reranker and len(ranked) > 1:
+        if remaining <= 0:
+            print("⚠️ Retrieval budget spent before rerank; using fused order")
+        else:
+            try:
+                ranked = await asyncio.wait_for(_stage("retrieval.rerank", rerank, query, ranked), remaining)
+            except asyncio.TimeoutError:
+                print("⚠️ Rerank exceeded the retrieval budget; using fused order")
+            except Exception as e:
+                print(f"❌ Rerank failed: {e}")
+    return ranked[:k]
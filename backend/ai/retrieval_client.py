@@ -0,0 +1,49 @@
+import httpx
+from decouple import config
+
+
+RETRIEVAL_TIMEOUT = config("RETRIEVAL_TIMEOUT", default=5, cast=float)
+
+_async_client = None
+
+
+class RemoteEmbeddings:
+    """🔹 The embeddings interface, served by retrieval_service.py
+
+    Called from the retrieval executor's threads like the local model, so it
+    uses a blocking (thread-safe, pooled) client.
+    """
+
+    def __init__(self, url, timeout=RETRIEVAL_TIMEOUT):
+        self.client = httpx.Client(base_url=url, timeout=timeout)
+        # Fail the component load (and readiness) while the service is down
+        self.client.get("/health").raise_for_status()
+
+    def _embed(self, texts, query):
+        response = self.client.post("/embed", json={"texts": texts, "query": query})
+        response.raise_for_status()
+        return response.json()["vectors"]
+
+    def embed_query(self, text):
+        return self._embed([text], query=True)[0]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, query=False)
+
+
+def get_async_client():
+    # Created on first use, i.e. inside the worker process and its event loop
+    global _async_client
+    if _async_client is None:
+        from ai.resources import RETRIEVAL_URL
+
+        _async_client = httpx.AsyncClient(base_url=RETRIEVAL_URL, timeout=RETRIEVAL_TIMEOUT)
+    return _async_client
+
+
+async def remote_retrieve(query, query_vector, **options):
+    """🔹 Run ai.retrieval.retrieve() in the retrieval service"""
+    vector = [float(value) for value in query_vector] if query_vector is not None else None
+    response = await get_async_client().post("/retrieve", json={"query": query, "vector": vector, **options})
+    response.raise_for_status()
+    return response.json()["chunks"]
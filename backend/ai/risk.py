@@ -0,0 +1,194 @@
+import json
+import re
+import time
+
+from decouple import config
+
+
+# Classification is skipped until the user has said enough to judge, and after
+# that only re-runs when the extracted factors change
+RISK_MIN_TURNS = config("RISK_MIN_TURNS", default=3, cast=int)
+# Without any extracted factor the first classification waits this long instead
+RISK_FALLBACK_TURNS = config("RISK_FALLBACK_TURNS", default=5, cast=int)
+# Minor changes are batched up until this many user turns have passed
+RISK_MIN_INTERVAL = config("RISK_MIN_INTERVAL", default=3, cast=int)
+# A queued classification holds off the next one until it finishes, or until
+# this many seconds passed (its job failed for good)
+RISK_PENDING_TIMEOUT = config("RISK_PENDING_TIMEOUT", default=300, cast=float)
+
+# How far back (in characters) a "ไม่"/"not" negates a keyword
+NEGATION_WINDOW = 12
+NEGATION = re.compile(r"ไม่|ไม่เคย|ไม่ได้|เลิก|\bno\b|\bnot\b|\bnever\b|n't\b", re.IGNORECASE)
+
+# factor -> (pattern meaning the risk is present, pattern meaning it is absent).
+# True in the state always means "risky": smoking, drinking, little exercise...
+FACTOR_PATTERNS = {
+    "smoking": (
+        r"สูบบุหรี่|บุหรี่|ยาสูบ|smok|cigarette|vape",
+        r"(ไม่|ไม่เคย|เลิก)สูบ|non-?smoker|quit smoking",
+    ),
+    "alcohol": (
+        r"ดื่มเหล้า|ดื่มเบียร์|แอลกอฮอล์|เหล้า|เบียร์|ไวน์|alcohol|beer|wine",
+        r"(ไม่|ไม่เคย|เลิก)ดื่ม(เหล้า|เบียร์|แอลกอฮอล์)?|don't drink|quit drinking",
+    ),
+    "physical_inactivity": (
+        r"(ไม่|ไม่ค่อย|ไม่ได้|ไม่เคย)(ได้)?ออกกำลัง|ออกกำลังกาย(น้อย|นานๆ ?ครั้ง)|นั่งทั้งวัน|no exercise|sedentary",
+        r"ออกกำลังกาย(ทุกวัน|เป็นประจำ|สม่ำเสมอ|(สัปดาห์|อาทิตย์)ละ\s*[3-7])|วิ่ง|ว่ายน้ำ|ปั่นจักรยาน|เข้ายิม|exercise (daily|regularly)",
+    ),
+    "unhealthy_diet": (
+        r"เค็ม|หวาน|ของทอด|ของมัน|น้ำอัดลม|ชานม|ฟาสต์ฟู้ด|fast ?food|junk food|soda|salty|sugary|fried",
+        r"(ไม่|ลด|เลี่ยง)(กิน|ทาน)?(เค็ม|หวาน|ของทอด|ของมัน)|กินผัก|ผักผลไม้|อาหารคลีน|healthy diet|vegetables",
+    ),
+    "family_history": (
+        r"(พ่อ|แม่|ปู่|ย่า|ตา|ยาย|พี่|น้อง|ครอบครัว|ญาติ).{0,20}(เป็น|มีประวัติ|ป่วย).{0,20}"
+        r"(เบาหวาน|ความดัน|หัวใจ|มะเร็ง|ไขมัน|หลอดเลือดสมอง|อัมพาต|ไต)|family history",
+        r"(ครอบครัว|ญาติ).{0,10}ไม่มี(ใคร)?(เป็น|ป่วย)|ไม่มีประวัติ.{0,10}ครอบครัว|no family history",
+    ),
+    "poor_sleep": (
+        r"นอนไม่(ค่อย)?หลับ|นอนน้อย|หลับยาก|อดนอน|insomnia",
+        r"นอน(หลับ)?(เพียงพอ|ครบ|วันละ\s*[7-9])|sleep well",
+    ),
+    "stress": (
+        r"เครียด|วิตกกังวล|กังวล|stress|anxious|anxiety",
+        r"ไม่(ค่อย)?เครียด|ไม่มีความเครียด",
+    ),
+}
+
+SYMPTOM_PATTERNS = {
+    "chest_pain": r"เจ็บหน้าอก|แน่นหน้าอก|chest pain",
+    "shortness_of_breath": r"หายใจไม่อิ่ม|หายใจลำบาก|หอบ|เหนื่อยง่าย|short(ness)? of breath",
+    "frequent_urination": r"ปัสสาวะบ่อย|ฉี่บ่อย|frequent urination",
+    "excessive_thirst": r"กระหายน้ำ|หิวน้ำบ่อย|คอแห้งบ่อย|thirst",
+    "blurred_vision": r"ตาพร่า|ตามัว|มองไม่ชัด|blurred vision",
+    "numbness": r"(มือ|เท้า)ชา|ชา(ปลาย)?(มือ|เท้า)|numb",
+    "headache_dizziness": r"ปวดหัว|ปวดศีรษะ|เวียนหัว|เวียนศีรษะ|มึนหัว|headache|dizz",
+    "weight_change": r"น้ำหนัก(ลด|ขึ้น)|อ้วนขึ้น|weight (loss|gain)",
+    "fatigue": r"อ่อนเพลีย|เหนื่อยล้า|fatigue|tired",
+    # Only measured values, so questions like "ความดันสูงมีอาการอย่างไร" do not count
+    "high_readings": r"(วัด|ตรวจ|ค่า)(ความดัน|น้ำตาล|ไขมัน|คอเลสเตอรอล).{0,15}(สูง|เกิน)|my (blood pressure|blood sugar|cholesterol) is high",
+}
+
+FACTOR_LABELS = {
+    "smoking": "Smoking",
+    "alcohol": "Regular alcohol consumption",
+    "physical_inactivity": "Lack of exercise",
+    "unhealthy_diet": "Unbalanced diet (salty / sweet / fried)",
+    "family_history": "Family history of NCDs",
+    "poor_sleep": "Poor sleep",
+    "stress": "Stress",
+}
+
+_factor_regexes = {
+    name: (re.compile(present, re.IGNORECASE), re.compile(absent, re.IGNORECASE))
+    for name, (present, absent) in FACTOR_PATTERNS.items()
+}
+_symptom_regexes = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in SYMPTOM_PATTERNS.items()}
+
+
+def _negated(text, start):
+    return bool(NEGATION.search(text[max(0, start - NEGATION_WINDOW):start]))
+
+
+def extract_factors(text):
+    """🔹 Pull risk factors and symptoms out of one user message
+
+    Returns ({factor: bool}, [symptom, ...]) with only what the message
+    actually mentions; an explicit denial ("ไม่สูบบุหรี่") records False.
+    """
+    factors = {}
+    for name, (present, absent) in _factor_regexes.items():
+        denial = absent.search(text)
+        if denial and not _negated(text, denial.start()):
+            factors[name] = False
+            continue
+        match = present.search(text)
+        if match:
+            factors[name] = not _negated(text, match.start())
+        elif denial:
+            # A negated healthy habit, e.g. "ไม่ได้วิ่ง"
+            factors[name] = True
+
+    symptoms = []
+    for name, pattern in _symptom_regexes.items():
+        match = pattern.search(text)
+        if match and not _negated(text, match.start()):
+            symptoms.append(name)
+    return factors, symptoms
+
+
+def new_risk_state():
+    return {"user_turns": 0, "factors": {}, "symptoms": []}
+
+
+def signature(state):
+    """Stable fingerprint of what the classification depends on"""
+    return json.dumps([sorted(state["factors"].items()), sorted(state["symptoms"])], ensure_ascii=False)
+
+
+def update_risk_state(state, text):
+    """🔹 Fold one user message into the running risk state
+
+    Returns (new_state, red_flag) where red_flag means the message added a
+    symptom or turned a risk factor on, which is worth re-classifying for
+    straight away.
+    """
+    state = {**new_risk_state(), **(state or {})}
+    state["factors"] = dict(state["factors"])
+    state["symptoms"] = list(state["symptoms"])
+    state["user_turns"] += 1
+
+    factors, symptoms = extract_factors(text)
+    red_flag = False
+    for name, present in factors.items():
+        if present and not state["factors"].get(name):
+            red_flag = True
+        state["factors"][name] = present
+    for name in symptoms:
+        if name not in state["symptoms"]:
+            state["symptoms"].append(name)
+            red_flag = True
+    return state, red_flag
+
+
+def needs_classification(state, classification=None, red_flag=False, pending=None):
+    """🔹 Whether the state changed enough since the last LLM classification
+
+    `classification` is what classified() recorded for the previous run; it
+    is kept apart from the state because the two are written by different
+    code paths (the chat turn vs. the background risk job). `pending` is
+    what queued() recorded for a classification not finished yet: until it
+    is, only a red flag that changed the signature queues another.
+    """
+    if pending and time.time() - pending["since"] < RISK_PENDING_TIMEOUT:
+        return red_flag and signature(state) != pending["signature"]
+
+    if not classification:
+        has_signal = bool(state["factors"] or state["symptoms"])
+        return (has_signal and state["user_turns"] >= RISK_MIN_TURNS) or state["user_turns"] >= RISK_FALLBACK_TURNS
+
+    if signature(state) == classification["signature"]:
+        return False
+    return red_flag or state["user_turns"] - classification["at_turn"] >= RISK_MIN_INTERVAL
+
+
+def classified(state, level):
+    """Record of a classification run over `state`"""
+    return {"signature": signature(state), "at_turn": state["user_turns"], "level": level}
+
+
+def queued(state):
+    """Record of a classification of `state` that was queued and has not finished"""
+    return {"signature": signature(state), "at_turn": state["user_turns"], "since": time.time()}
+
+
+def describe_risk_state(state):
+    """🔹 Compact, human-readable summary of the state for the classification prompt"""
+    lines = [f"- User messages so far: {state['user_turns']}"]
+    for name, label in FACTOR_LABELS.items():
+        if name in state["factors"]:
+            lines.append(f"- {label}: {'yes' if state['factors'][name] else 'no'}")
+    if state["symptoms"]:
+        lines.append(f"- Reported symptoms: {', '.join(name.replace('_', ' ') for name in state['symptoms'])}")
+    else:
+        lines.append("- Reported symptoms: none")
+    return "\n".join(lines)
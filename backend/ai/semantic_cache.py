@@ -0,0 +1,218 @@
+import json
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from decouple import config
+
+from ai.metrics import record_cache_lookup
+from ai.resources import embedding_model_name
+
+
+CACHE_BACKEND = config("CACHE_BACKEND", default="memory")
+CACHE_TTL = config("CACHE_TTL", default=24 * 60 * 60, cast=int)
+CACHE_MAX_ENTRIES = config("CACHE_MAX_ENTRIES", default=1024, cast=int)
+REDIS_URL = config("REDIS_URL", default="redis://localhost:6379/0")
+# Redis buckets vectors by the signs of CACHE_LSH_BITS random projections
+# (SimHash); a lookup reads its own bucket and those one bit away, where the
+# neighbours above the 0.95+ thresholds used here land
+CACHE_LSH_BITS = config("CACHE_LSH_BITS", default=7, cast=int)
+CACHE_BUCKET_MAX_ENTRIES = config("CACHE_BUCKET_MAX_ENTRIES", default=64, cast=int)
+# Every worker draws the same projections, so they agree on the buckets
+CACHE_LSH_SEED = 6
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class InMemoryCacheBackend:
+    """🔹 Process-local LRU + TTL store of (vector, value) entries"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    async def search(self, vector, threshold):
+        """Return (value, cost, similarity) of the closest live entry at or above threshold"""
+        now = time.time()
+        best_key, best_similarity = None, threshold
+        for key, (entry_vector, _, _, expires_at) in list(self._entries.items()):
+            if expires_at <= now:
+                del self._entries[key]
+                continue
+            similarity = float(np.dot(vector, entry_vector))
+            if similarity >= best_similarity:
+                best_key, best_similarity = key, similarity
+
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        _, value, cost, _ = self._entries[best_key]
+        return value, cost, best_similarity
+
+    async def put(self, vector, value, cost):
+        self._entries[uuid.uuid4().hex] = (vector, value, cost, time.time() + self.ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def size(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """🔹 Shared store so every worker process sees the same cache
+
+    Vectors live in one hash per LSH bucket, values in keys that expire after
+    the TTL, and a sorted set of last-access times drives LRU eviction. A
+    lookup fetches 1 + CACHE_LSH_BITS buckets of at most
+    CACHE_BUCKET_MAX_ENTRIES vectors each, however large the cache.
+    """
+
+    def __init__(self, namespace, url=REDIS_URL, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL,
+                 bits=CACHE_LSH_BITS, bucket_max_entries=CACHE_BUCKET_MAX_ENTRIES):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the `redis` package (pip install redis)") from e
+
+        self.client = redis.from_url(url)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bits = bits
+        self.bucket_max_entries = bucket_max_entries
+        # Entry keys are "{bucket}:{id}", so an entry's bucket is known from its key alone
+        self.bucket_prefix = f"ncd:cache:{namespace}:bucket:"
+        self.lru_key = f"ncd:cache:{namespace}:lru"
+        self.value_prefix = f"ncd:cache:{namespace}:value:"
+        self._planes = None
+
+    def bucket(self, vector):
+        """SimHash of the vector: bit i is set when it lies on the positive side of plane i"""
+        if self._planes is None or self._planes.shape[1] != len(vector):
+            rng = np.random.default_rng(CACHE_LSH_SEED)
+            self._planes = rng.standard_normal((self.bits, len(vector))).astype(np.float32)
+        signs = self._planes @ np.asarray(vector, dtype=np.float32) >= 0
+        return sum(1 << bit for bit, positive in enumerate(signs) if positive)
+
+    def probes(self, bucket):
+        return [bucket] + [bucket ^ (1 << bit) for bit in range(self.bits)]
+
+    async def search(self, vector, threshold):
+        pipe = self.client.pipeline()
+        for bucket in self.probes(self.bucket(vector)):
+            pipe.hgetall(f"{self.bucket_prefix}{bucket}")
+        candidates = []
+        for stored in await pipe.execute():
+            for key, raw in stored.items():
+                similarity = float(np.dot(vector, np.frombuffer(raw, dtype=np.float32)))
+                if similarity >= threshold:
+                    candidates.append((similarity, key.decode()))
+
+        for similarity, key in sorted(candidates, reverse=True):
+            raw_value = await self.client.get(self.value_prefix + key)
+            if raw_value is None:
+                # Value expired: forget its vector too
+                await self._remove(key)
+                continue
+            await self.client.zadd(self.lru_key, {key: time.time()})
+            entry = json.loads(raw_value)
+            return entry["value"], entry["cost"], similarity
+        return None
+
+    async def put(self, vector, value, cost):
+        bucket = self.bucket(vector)
+        bucket_key = f"{self.bucket_prefix}{bucket}"
+        key = f"{bucket}:{uuid.uuid4().hex}"
+        pipe = self.client.pipeline()
+        pipe.set(self.value_prefix + key, json.dumps({"value": value, "cost": cost}, ensure_ascii=False), ex=self.ttl)
+        pipe.hset(bucket_key, key, np.asarray(vector, dtype=np.float32).tobytes())
+        pipe.zadd(self.lru_key, {key: time.time()})
+        pipe.hlen(bucket_key)
+        pipe.zcard(self.lru_key)
+        *_, bucket_size, total = await pipe.execute()
+
+        if bucket_size > self.bucket_max_entries:
+            # Evict the bucket's least recently used entries
+            keys = [stored.decode() for stored in await self.client.hkeys(bucket_key)]
+            last_used = await self.client.zmscore(self.lru_key, keys)
+            ranked = sorted(zip((score or 0 for score in last_used), keys))
+            for _, stale in ranked[:bucket_size - self.bucket_max_entries]:
+                await self._remove(stale)
+
+        overflow = total - self.max_entries
+        if overflow > 0:
+            for stale in await self.client.zrange(self.lru_key, 0, overflow - 1):
+                await self._remove(stale.decode())
+
+    async def _remove(self, key):
+        pipe = self.client.pipeline()
+        pipe.hdel(f"{self.bucket_prefix}{key.split(':', 1)[0]}", key)
+        pipe.zrem(self.lru_key, key)
+        pipe.delete(self.value_prefix + key)
+        await pipe.execute()
+
+    async def size(self):
+        return await self.client.zcard(self.lru_key)
+
+
+class SemanticCache:
+    """🔹 Cache keyed on a query embedding: a lookup hits when a stored query is
+    at least `threshold` cosine-similar to the new one"""
+
+    def __init__(self, name, backend, threshold):
+        self.name = name
+        self.backend = backend
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    async def lookup(self, vector):
+        try:
+            found = await self.backend.search(normalize(vector), self.threshold)
+        except Exception as e:
+            print(f"❌ Cache lookup failed ({self.name}): {e}")
+            found = None
+
+        if found is None:
+            self.misses += 1
+            record_cache_lookup(self.name, hit=False)
+            return None
+
+        value, cost, _ = found
+        self.hits += 1
+        self.saved_seconds += cost
+        record_cache_lookup(self.name, hit=True, saved_seconds=cost)
+        return value
+
+    async def store(self, vector, value, cost):
+        """Store a value together with the seconds it took to compute"""
+        try:
+            await self.backend.put(normalize(vector), value, cost)
+        except Exception as e:
+            print(f"❌ Cache store failed ({self.name}): {e}")
+
+    async def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "entries": await self.backend.size()
+        }
+
+
+def create_cache(name, threshold):
+    """🔹 Build a cache on the backend chosen by CACHE_BACKEND (memory | redis)"""
+    if CACHE_BACKEND == "redis":
+        # Vectors from different embedding models must never meet in one cache
+        backend = RedisCacheBackend(f"{name}:{embedding_model_name().rsplit('/', 1)[-1]}")
+    else:
+        backend = InMemoryCacheBackend()
+    return SemanticCache(name, backend, threshold)
@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import json
+import secrets
+import time
+from collections import OrderedDict
+
+from decouple import config
+
+from ai.semantic_cache import CACHE_BACKEND, REDIS_URL
+
+
+# One turn runs at a time per user; at most this many requests of one user
+# may be running or waiting, the rest get 429 straight away
+CHAT_MAX_PENDING_PER_USER = config("CHAT_MAX_PENDING_PER_USER", default=2, cast=int)
+# How long a queued turn waits for the one before it
+CHAT_QUEUE_TIMEOUT = config("CHAT_QUEUE_TIMEOUT", default=30, cast=float)
+# Shared locks expire after this, in case the worker holding one dies mid-turn
+TURN_LOCK_TTL = config("TURN_LOCK_TTL", default=120, cast=float)
+# Results of turns sent with an Idempotency-Key are replayed this long
+IDEMPOTENCY_TTL = config("IDEMPOTENCY_TTL", default=300, cast=int)
+TURN_RESULTS_MAX_ENTRIES = 10000
+
+
+class UserBusy(RuntimeError):
+    """Too many requests of this user are already running or waiting"""
+
+
+def message_key(message):
+    """🔹 Idempotency key for a message sent without one: identical text coalesces while in flight"""
+    return "msg:" + hashlib.sha256(message.strip().encode("utf-8")).hexdigest()[:32]
+
+
+class LocalTurnLocks:
+    """🔹 Per-user locks and recent results inside this process (single worker)"""
+
+    def __init__(self):
+        self._locks = {}
+        self._pending = {}
+        self._results = OrderedDict()
+
+    async def enter(self, user_id, limit):
+        if self._pending.get(user_id, 0) >= limit:
+            return False
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        return True
+
+    async def leave(self, user_id):
+        self._pending[user_id] -= 1
+        if not self._pending[user_id]:
+            del self._pending[user_id]
+            # Nobody holds or waits for the lock any more
+            self._locks.pop(user_id, None)
+
+    async def acquire(self, user_id, timeout):
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            raise UserBusy("timed out waiting for the previous turn") from None
+        return lock
+
+    async def release(self, user_id, token):
+        token.release()
+
+    async def get_result(self, user_id, key):
+        entry = self._results.get((user_id, key))
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    async def put_result(self, user_id, key, value, ttl):
+        self._results[(user_id, key)] = (value, time.monotonic() + ttl)
+        self._results.move_to_end((user_id, key))
+        while len(self._results) > TURN_RESULTS_MAX_ENTRIES:
+            self._results.popitem(last=False)
+
+
+# Deletes the lock only if this holder still owns it
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisTurnLocks:
+    """🔹 The same, shared by every worker through Redis
+
+    The lock is SET NX with an expiry, released by compare-and-delete; the
+    pending count is a counter per user. Waiting polls, which is fine at
+    one user's scale.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, url=REDIS_URL):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the `redis` package (pip install redis)") from e
+
+        self.client = redis.from_url(url)
+        self._release = self.client.register_script(_RELEASE_SCRIPT)
+
+    @staticmethod
+    def _key(user_id, suffix):
+        return f"ncd:turn:{user_id}:{suffix}"
+
+    async def enter(self, user_id, limit):
+        key = self._key(user_id, "pending")
+        pending = await self.client.incr(key)
+        # Heals a count left behind by a worker that died
+        await self.client.expire(key, int(TURN_LOCK_TTL + CHAT_QUEUE_TIMEOUT))
+        if pending > limit:
+            await self.client.decr(key)
+            return False
+        return True
+
+    async def leave(self, user_id):
+        try:
+            await self.client.decr(self._key(user_id, "pending"))
+        except Exception as e:
+            print(f"❌ Turn counter release failed: {e}")
+
+    async def acquire(self, user_id, timeout):
+        token = secrets.token_hex(8)
+        deadline = time.monotonic() + timeout
+        while not await self.client.set(self._key(user_id, "lock"), token, nx=True, px=int(TURN_LOCK_TTL * 1000)):
+            if time.monotonic() >= deadline:
+                raise UserBusy("timed out waiting for the previous turn")
+            await asyncio.sleep(self.POLL_INTERVAL)
+        return token
+
+    async def release(self, user_id, token):
+        try:
+            await self._release(keys=[self._key(user_id, "lock")], args=[token])
+        except Exception as e:
+            # Left to expire after TURN_LOCK_TTL
+            print(f"❌ Turn lock release failed: {e}")
+
+    async def get_result(self, user_id, key):
+        raw = await self.client.get(self._key(user_id, f"result:{key}"))
+        return json.loads(raw) if raw else None
+
+    async def put_result(self, user_id, key, value, ttl):
+        try:
+            await self.client.set(self._key(user_id, f"result:{key}"), json.dumps(value, ensure_ascii=False), ex=int(ttl))
+        except Exception as e:
+            print(f"❌ Turn result store failed: {e}")
+
+
+class TurnGate:
+    """🔹 Runs one chat turn at a time per user
+
+    Requests with the same idempotency key share one turn: while it is in
+    flight in this worker they await the same future; queued behind it in
+    another worker they pick up its stored result. An explicit key (the
+    client's Idempotency-Key) replays the result for IDEMPOTENCY_TTL; a key
+    derived from the message text only matches requests that arrived while
+    that turn was running, so sending the same words again later is a new
+    turn.
+    """
+
+    def __init__(self, locks=None, max_pending=CHAT_MAX_PENDING_PER_USER, queue_timeout=CHAT_QUEUE_TIMEOUT):
+        self.locks = locks or create_turn_locks()
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._in_flight = {}
+        self.counts = {"turns": 0, "coalesced": 0, "rejected": 0}
+
+    async def run(self, user_id, key, turn, explicit=False):
+        """🔹 Await turn() under the user's lock, or share the result of an identical turn"""
+        arrived = time.time()
+        flight = self._in_flight.get((user_id, key))
+        if flight is not None:
+            self.counts["coalesced"] += 1
+            return await asyncio.shield(flight)
+
+        if not await self.locks.enter(user_id, self.max_pending):
+            self.counts["rejected"] += 1
+            raise UserBusy("too many requests in progress for this user")
+        flight = self._in_flight[(user_id, key)] = asyncio.get_running_loop().create_future()
+        try:
+            token = await self.locks.acquire(user_id, self.queue_timeout)
+            try:
+                stored = await self.locks.get_result(user_id, key)
+                if stored and (explicit or stored["started"] <= arrived <= stored["finished"]):
+                    self.counts["coalesced"] += 1
+                    result = stored["result"]
+                else:
+                    self.counts["turns"] += 1
+                    started = time.time()
+                    result = await turn()
+                    await self.locks.put_result(
+                        user_id, key, {"result": result, "started": started, "finished": time.time()},
+                        IDEMPOTENCY_TTL if explicit else max(1, int(self.queue_timeout))
+                    )
+            finally:
+                await self.locks.release(user_id, token)
+            flight.set_result(result)
+            return result
+        except BaseException as e:
+            if not flight.done():
+                if isinstance(e, asyncio.CancelledError):
+                    flight.cancel()
+                else:
+                    flight.set_exception(e)
+                    # Duplicates re-raise it; without any, do not warn that it was never retrieved
+                    flight.exception()
+            raise
+        finally:
+            self._in_flight.pop((user_id, key), None)
+            await self.locks.leave(user_id)
+
+    async def hold(self, user_id):
+        """🔹 Take the user's turn for work that outlives the request (streaming); returns release()"""
+        if not await self.locks.enter(user_id, self.max_pending):
+            self.counts["rejected"] += 1
+            raise UserBusy("too many requests in progress for this user")
+        try:
+            token = await self.locks.acquire(user_id, self.queue_timeout)
+        except BaseException:
+            await self.locks.leave(user_id)
+            raise
+        self.counts["turns"] += 1
+
+        async def release():
+            await self.locks.release(user_id, token)
+            await self.locks.leave(user_id)
+
+        return release
+
+    def stats(self):
+        return {**self.counts, "in_flight": len(self._in_flight)}
+
+
+def create_turn_locks():
+    """🔹 Per-user locks on the backend chosen by CACHE_BACKEND (memory | redis)"""
+    if CACHE_BACKEND == "redis":
+        return RedisTurnLocks()
+    return LocalTurnLocks()
+
+
+turn_gate = TurnGate()
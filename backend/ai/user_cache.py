@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from decouple import config
+from firebase_admin import firestore
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+
+from ai.semantic_cache import CACHE_BACKEND, REDIS_URL
+
+
+# users/{id} is only read for the display name, which the app rarely changes
+PROFILE_CACHE_TTL = config("PROFILE_CACHE_TTL", default=600, cast=float)
+# Session metadata is written through on every read and commit; with the
+# memory backend the TTL bounds how long other workers' writes go unseen, so
+# multi-worker deployments should use CACHE_BACKEND=redis
+SESSION_CACHE_TTL = config("SESSION_CACHE_TTL", default=120, cast=float)
+USER_CACHE_MAX_ENTRIES = config("USER_CACHE_MAX_ENTRIES", default=10000, cast=int)
+
+
+class InMemoryUserCache:
+    """🔹 Process-local LRU of per-user documents; entries expire after `ttl` seconds"""
+
+    def __init__(self, ttl, max_entries=USER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        """Return a copy of the cached value, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+
+    async def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (dict(value), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries)
+        }
+
+
+def _encode(value):
+    if isinstance(value, DatetimeWithNanoseconds):
+        # Document update times keep their nanoseconds for write preconditions
+        return {"$timestamp": value.rfc3339()}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _decode(value):
+    if "$timestamp" in value:
+        return DatetimeWithNanoseconds.from_rfc3339(value["$timestamp"])
+    if "$datetime" in value:
+        return datetime.fromisoformat(value["$datetime"])
+    return value
+
+
+class RedisUserCache:
+    """🔹 Shared across workers: one JSON value per user with a Redis TTL
+
+    Size is bounded by Redis itself (maxmemory with an LRU policy), so every
+    worker sees the others' write-through and invalidations at once.
+    """
+
+    def __init__(self, namespace, ttl, url=REDIS_URL):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the `redis` package (pip install redis)") from e
+
+        self.client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = f"ncd:user:{namespace}:"
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        try:
+            raw = await self.client.get(self.prefix + key)
+        except Exception as e:
+            print(f"❌ User cache lookup failed: {e}")
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw, object_hook=_decode)
+
+    async def put(self, key, value):
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value, default=_encode, ensure_ascii=False), ex=int(self.ttl))
+        except Exception as e:
+            print(f"❌ User cache store failed: {e}")
+
+    async def invalidate(self, key):
+        try:
+            await self.client.delete(self.prefix + key)
+        except Exception as e:
+            # Left to expire: at most `ttl` seconds stale
+            print(f"❌ User cache invalidation failed: {e}")
+
+    async def clear(self):
+        async for key in self.client.scan_iter(match=self.prefix + "*"):
+            await self.client.delete(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+def create_user_cache(name, ttl):
+    """🔹 Build a per-user cache on the backend chosen by CACHE_BACKEND (memory | redis)"""
+    if CACHE_BACKEND == "redis":
+        return RedisUserCache(name, ttl)
+    return InMemoryUserCache(ttl)
+
+
+profile_cache = create_user_cache("profile", PROFILE_CACHE_TTL)
+# Value: {"exists": bool, "data": conversations/{user_id} fields, "update_time": its version}
+session_cache = create_user_cache("session", SESSION_CACHE_TTL)
+
+
+async def remember_session(user_id, exists, data, update_time=None):
+    """🔹 Write-through after a read or commit of conversations/{user_id}
+
+    `update_time` is the document's version as of `data`; opening writes
+    from the cache make it a precondition, so a stale entry fails the write
+    instead of overwriting what another worker wrote.
+    """
+    document = {}
+    for key, value in data.items():
+        # Sentinels such as SERVER_TIMESTAMP only mean something inside a write
+        if value is firestore.SERVER_TIMESTAMP:
+            value = datetime.now(timezone.utc)
+        # Staged updates may use field paths ("risk_classification.delivered")
+        *parents, field = key.split(".")
+        target = document
+        for parent in parents:
+            target[parent] = target = dict(target.get(parent) or {})
+        target[field] = value
+    await session_cache.put(user_id, {"exists": exists, "data": document, "update_time": update_time})
+
+
+async def cached_session(user_id):
+    """(exists, data, update_time) of the cached conversation, or None"""
+    entry = await session_cache.get(user_id)
+    if entry is None or (entry["exists"] and entry.get("update_time") is None):
+        # Without a version the entry cannot be checked at commit time
+        return None
+    return entry["exists"], dict(entry["data"]), entry.get("update_time")
@@ -0,0 +1,103 @@
+"""🔹 Bulk FCM notification benchmark
+
+Seeds an in-memory Firestore with users (some with invalid or missing FCM
+tokens) and sends one campaign through ai.notifications with the FCM
+transport replaced by bench.fakes.FakeMessaging. Reports users/s, FCM
+requests, peak concurrency, Firestore reads and pruned tokens, and checks
+that every user is counted, that the job result stays small and that each
+user's outcome is stored under the job.
+
+    python bench/bulk_notify.py --users 5000 --invalid 0.05 --fcm-latency 0.1
+    python bench/bulk_notify.py --users 5000 --query
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fakes import FakeFirestore, FakeMessaging, install  # noqa: E402
+
+
+def seed_users(store, count, invalid_share, missing_share, rng):
+    user_ids = []
+    for i in range(count):
+        user_id = f"bench-user-{i}"
+        document = {"name": f"User {i}", "reminders": True}
+        roll = rng.random()
+        if roll < invalid_share:
+            document["fcmToken"] = f"invalid-token-{i}"
+        elif roll < invalid_share + missing_share:
+            pass
+        else:
+            document["fcmToken"] = f"token-{i}"
+        store.documents[f"users/{user_id}"] = document
+        user_ids.append(user_id)
+    return user_ids
+
+
+async def run(args):
+    store = FakeFirestore(latency=args.firestore_latency)
+    fcm = FakeMessaging(latency=args.fcm_latency)
+    install(firestore=store, fcm=fcm)
+    user_ids = seed_users(store, args.users, args.invalid, args.missing, random.Random(args.seed))
+
+    from ai.jobs import current_job_id
+    from ai.notifications import send_bulk_notification
+
+    # As if run by the job queue, which is what stores the per-user results
+    current_job_id.set("bench-campaign")
+    started = time.perf_counter()
+    if args.query:
+        report = await send_bulk_notification(
+            "แจ้งเตือน", "อย่าลืมวัดความดันวันนี้นะคะ", query={"where": [["reminders", "==", True]]}
+        )
+    else:
+        report = await send_bulk_notification("แจ้งเตือน", "อย่าลืมวัดความดันวันนี้นะคะ", user_ids=user_ids)
+    elapsed = time.perf_counter() - started
+
+    counted = report["sent"] + report["failed"] + report["invalid_token"] + report["no_token"]
+    size = len(json.dumps(report, ensure_ascii=False).encode("utf-8"))
+    stored = sum(1 for path in store.documents if path.startswith("jobs/bench-campaign/results/"))
+    still_invalid = sum(1 for path, doc in store.documents.items() if doc.get("fcmToken", "").startswith("invalid"))
+    print(f"{args.users} users in {elapsed:.2f}s ({args.users / elapsed:.0f} users/s)")
+    print(f"FCM requests {fcm.requests}, peak in flight {fcm.max_in_flight}, messages sent {fcm.sent}")
+    operations = store.operations["other"]
+    print(f"Firestore reads {operations['reads']}, writes {operations['writes']}, commits {operations['commits']}")
+    print(f"result ({size} bytes) {report}; invalid tokens left {still_invalid}; per-user results {stored}")
+
+    if report["users"] != args.users or counted != args.users:
+        print(f"❌ expected {args.users} users counted, got {report['users']} ({counted} by status)")
+        return 1
+    if size > 4096:
+        print(f"❌ the result is {size} bytes; it must not grow with the campaign")
+        return 1
+    if still_invalid:
+        print("❌ invalid tokens were not pruned")
+        return 1
+    if stored != args.users:
+        print(f"❌ expected {args.users} per-user results, found {stored}")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--invalid", type=float, default=0.05, help="share of users with an invalid token")
+    parser.add_argument("--missing", type=float, default=0.05, help="share of users without a token")
+    parser.add_argument("--fcm-latency", type=float, default=0.1, help="seconds per FCM request")
+    parser.add_argument("--firestore-latency", type=float, default=0.005)
+    parser.add_argument("--query", action="store_true", help="select users with a query instead of ids")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
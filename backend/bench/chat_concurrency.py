@@ -0,0 +1,168 @@
+"""🔹 Concurrent /chat requests for one user, against the fake Firestore
+
+Drives the FastAPI app in-process (as bench/workload.py does) and checks the
+per-user turn gate (ai.turns):
+- double tap: identical messages sent at once make one turn, one answer call
+  and give every request the same reply
+- burst: distinct messages beyond CHAT_MAX_PENDING_PER_USER get 429, and the
+  ones accepted run one after another, so turn_count and the risk state's
+  user_turns match the messages saved
+- retry: a request repeated with the same Idempotency-Key after it finished
+  replays the reply without a new turn
+- stream + chat: a /chat sent during /chat/stream waits for the stream's save
+- many users: different users are not serialised against each other
+Also runs the burst straight through converse() without the gate to show
+the lost updates the gate prevents.
+
+    python bench/chat_concurrency.py
+    python bench/chat_concurrency.py --duplicates 10 --burst 6 --users 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+from prometheus_client import REGISTRY
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fakes import FakeFirestore, FakeGenerativeModel, install  # noqa: E402
+
+MESSAGES = [
+    "ความดันโลหิตสูงมีอาการอย่างไร",
+    "ช่วงนี้ปวดหัวบ่อยและนอนไม่ค่อยหลับ",
+    "สูบบุหรี่วันละครึ่งซอง",
+    "ชอบกินอาหารรสเค็มและของทอด",
+    "พ่อเป็นโรคหัวใจ ฉันมีความเสี่ยงไหม",
+    "ออกกำลังกายสัปดาห์ละ 2 ครั้ง",
+    "น้ำตาลในเลือดเท่าไหร่ถึงเรียกว่าสูง",
+    "เบาหวานป้องกันได้ไหม",
+]
+
+
+def answer_calls():
+    return REGISTRY.get_sample_value("ncd_llm_events_total", {"call": "answer", "event": "success"}) or 0.0
+
+
+def saved_turns(store, user_id):
+    prefix = f"conversations/{user_id}/messages/"
+    return sum(1 for path, data in store.documents.items() if path.startswith(prefix) and "query" in data)
+
+
+def conversation(store, user_id):
+    return store.documents.get(f"conversations/{user_id}", {})
+
+
+def post_chat(client, user_id, message, key=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    return client.post("/chat", json={"user_id": user_id, "message": message}, headers=headers)
+
+
+async def read_stream(client, user_id, message):
+    async with client.stream("POST", "/chat/stream", json={"user_id": user_id, "message": message}) as response:
+        async for _ in response.aiter_text():
+            pass
+    return response
+
+
+async def run(args):
+    store = FakeFirestore(latency=args.firestore_latency)
+    install(genai_model=FakeGenerativeModel(latency=args.llm_latency), firestore=store)
+
+    import main
+    from ai.converse import converse
+    from ai.jobs import job_queue
+    from ai.turns import turn_gate
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    failures = []
+
+    def check(ok, message):
+        print(f"{'✅' if ok else '❌'} {message}")
+        if not ok:
+            failures.append(message)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Double tap
+        calls = answer_calls()
+        responses = await asyncio.gather(*(post_chat(client, "tap", MESSAGES[0]) for _ in range(args.duplicates)))
+        replies = {response.json().get("response") for response in responses}
+        check(all(r.status_code == 200 for r in responses) and len(replies) == 1,
+              f"double tap: {args.duplicates} identical requests, all 200 with one reply")
+        check(saved_turns(store, "tap") == 1 and answer_calls() - calls == 1,
+              f"double tap: {saved_turns(store, 'tap')} turn saved, {answer_calls() - calls:.0f} answer call(s)")
+
+        # Burst of distinct messages
+        responses = await asyncio.gather(*(post_chat(client, "burst", MESSAGES[i % len(MESSAGES)])
+                                           for i in range(args.burst)))
+        statuses = sorted(response.status_code for response in responses)
+        accepted = statuses.count(200)
+        check(accepted == min(args.burst, turn_gate.max_pending) and statuses.count(429) == args.burst - accepted,
+              f"burst: {args.burst} messages -> {accepted} accepted, {statuses.count(429)} got 429")
+        data = conversation(store, "burst")
+        check(saved_turns(store, "burst") == accepted == data.get("turn_count")
+              and data.get("risk_state", {}).get("user_turns") == accepted,
+              f"burst: {saved_turns(store, 'burst')} turns saved, turn_count {data.get('turn_count')}, "
+              f"risk user_turns {data.get('risk_state', {}).get('user_turns')}")
+
+        # Retry after completion with the same key
+        first = await post_chat(client, "retry", MESSAGES[1], key="retry-1")
+        second = await post_chat(client, "retry", MESSAGES[1], key="retry-1")
+        check(first.json() == second.json() and saved_turns(store, "retry") == 1,
+              "retry: a repeated Idempotency-Key replays the reply without a new turn")
+
+        # A chat sent while a stream is running waits for the stream's save
+        async def chat_after_stream_started():
+            await asyncio.sleep(0.01)
+            return await post_chat(client, "mixed", MESSAGES[3])
+
+        stream_response, chat_response = await asyncio.gather(
+            read_stream(client, "mixed", MESSAGES[2]), chat_after_stream_started()
+        )
+        data = conversation(store, "mixed")
+        check(stream_response.status_code == chat_response.status_code == 200
+              and saved_turns(store, "mixed") == 2 == data.get("turn_count")
+              and data.get("risk_state", {}).get("user_turns") == 2,
+              f"stream + chat: both saved in turn, turn_count {data.get('turn_count')}")
+
+        # Many users at once are not serialised (distinct messages, so the answer cache does not help)
+        started = time.perf_counter()
+        await post_chat(client, "single", "ความดันสูงต้องกินยาตลอดชีวิตไหม")
+        single = time.perf_counter() - started
+        started = time.perf_counter()
+        responses = await asyncio.gather(*(post_chat(client, f"user-{i}", f"{MESSAGES[i % len(MESSAGES)]} ({i})")
+                                           for i in range(args.users)))
+        parallel = time.perf_counter() - started
+        check(all(r.status_code == 200 for r in responses) and parallel < single * args.users / 4,
+              f"many users: {args.users} users in {parallel:.2f}s (one turn alone {single:.2f}s)")
+
+    # The same burst without the gate: every turn reads the document before any commits
+    await asyncio.gather(*(converse("ungated", MESSAGES[i % len(MESSAGES)]) for i in range(args.burst)))
+    data = conversation(store, "ungated")
+    print(f"without the gate: {saved_turns(store, 'ungated')} turns saved, "
+          f"risk user_turns {data.get('risk_state', {}).get('user_turns')} (lost updates)")
+
+    await job_queue.join()
+    await job_queue.stop()
+    print(f"gate: {turn_gate.stats()}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duplicates", type=int, default=5)
+    parser.add_argument("--burst", type=int, default=4)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.1)
+    parser.add_argument("--firestore-latency", type=float, default=0.005)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""🔹 Embedding model / runtime comparison
+
+For each option (model@backend) reports load time, single-query latency
+p50/p95, batched throughput, peak memory and retrieval quality (recall@k
+against the labeled query set, by brute-force cosine over the corpus). Each
+option runs in its own process, so the memory figures do not leak into each
+other.
+
+    python bench/embeddings.py
+    python bench/embeddings.py --options \\
+        sentence-transformers/all-MiniLM-L6-v2@torch,\\
+        sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2@torch,\\
+        sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2@onnx-int8 \\
+        --threads 4 --corpus-from-store
+
+The corpus defaults to the canned documents of bench.fakes, which the default
+query set (bench/retrieval_queries.jsonl) is labeled against; --corpus-from-store
+uses the live chroma_db_ncd chunks (label your queries against it). --offline
+swaps every model for bench.fakes.FakeEmbeddings to check the harness itself.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.eval_retrieval import DEFAULT_QUERIES, load_queries, percentile, recall  # noqa: E402
+
+DEFAULT_OPTIONS = ",".join([
+    "sentence-transformers/all-MiniLM-L6-v2@torch",
+    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2@torch",
+    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2@onnx-int8",
+])
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_corpus(args):
+    if args.corpus_from_store:
+        from reindex import iter_chunks, open_collection
+        from ai.resources import CHROMA_DIR
+
+        return [text for _, text, _ in iter_chunks(open_collection(CHROMA_DIR))]
+    from bench.fakes import FakeVectorStore
+
+    return [text for text, _ in FakeVectorStore.DOCUMENTS]
+
+
+def measure(args):
+    """Benchmark one option in this process; prints a JSON result line"""
+    model, _, backend = args.measure.partition("@")
+    corpus = load_corpus(args)
+    queries = load_queries(args.queries)
+    baseline_mb = peak_rss_mb()
+
+    started = time.perf_counter()
+    if args.offline:
+        from bench.fakes import FakeEmbeddings
+        embeddings = FakeEmbeddings(latency=0)
+    else:
+        from ai.resources import create_embeddings
+        embeddings = create_embeddings(model, backend=backend or "torch", threads=args.threads,
+                                       batch_size=args.batch_size)
+    embeddings.embed_query("warm up")
+    load_seconds = time.perf_counter() - started
+
+    latencies = []
+    for _ in range(args.runs):
+        for item in queries:
+            started = time.perf_counter()
+            embeddings.embed_query(item["query"])
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    document_vectors = np.asarray(embeddings.embed_documents(corpus), dtype=np.float32)
+    batch_seconds = time.perf_counter() - started
+
+    document_vectors /= np.linalg.norm(document_vectors, axis=1, keepdims=True)
+    recalls = []
+    for item in queries:
+        vector = np.asarray(embeddings.embed_query(item["query"]), dtype=np.float32)
+        top = np.argsort(-(document_vectors @ vector))[:args.k]
+        recalls.append(recall([corpus[i] for i in top], item.get("relevant", [])))
+
+    print(json.dumps({
+        "option": args.measure,
+        "dimension": int(document_vectors.shape[1]),
+        "load_s": load_seconds,
+        "query_p50_ms": percentile(latencies, 0.5) * 1000,
+        "query_p95_ms": percentile(latencies, 0.95) * 1000,
+        "docs_per_s": len(corpus) / batch_seconds if batch_seconds else 0.0,
+        "model_mb": peak_rss_mb() - baseline_mb,
+        "peak_mb": peak_rss_mb(),
+        "recall": statistics.mean(recalls) if recalls else 0.0,
+    }))
+
+
+def compare(args):
+    print(f"{'option':<72}{'dim':>5}{'load s':>8}{'p50 ms':>8}{'p95 ms':>8}"
+          f"{'docs/s':>9}{'+MB':>7}{'peak MB':>9}{f'R@{args.k}':>7}")
+    failed = 0
+    for option in (o.strip() for o in args.options.split(",") if o.strip()):
+        command = [sys.executable, os.path.abspath(__file__), "--measure", option, "--queries", args.queries,
+                   "--k", str(args.k), "--runs", str(args.runs), "--threads", str(args.threads),
+                   "--batch-size", str(args.batch_size)]
+        command += ["--corpus-from-store"] if args.corpus_from_store else []
+        command += ["--offline"] if args.offline else []
+        completed = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True)
+        lines = [line for line in completed.stdout.splitlines() if line.startswith("{")]
+        if completed.returncode or not lines:
+            failed += 1
+            error = (completed.stderr.strip().splitlines() or ["no output"])[-1]
+            print(f"{option:<72}❌ {error}")
+            continue
+        r = json.loads(lines[-1])
+        print(f"{option:<72}{r['dimension']:>5}{r['load_s']:>8.1f}{r['query_p50_ms']:>8.1f}{r['query_p95_ms']:>8.1f}"
+              f"{r['docs_per_s']:>9.1f}{r['model_mb']:>7.0f}{r['peak_mb']:>9.0f}{r['recall']:>7.3f}")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--options", default=DEFAULT_OPTIONS, help="comma separated model@backend list")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES, help="labeled JSONL query set")
+    parser.add_argument("--corpus-from-store", action="store_true", help="use the chunks of chroma_db_ncd")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=3, help="passes over the queries for latency")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = runtime default)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--offline", action="store_true", help="use FakeEmbeddings for every option")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""🔹 Retrieval quality and latency evaluation
+
+Runs a labeled query set through each retrieval variant and reports
+recall@k (share of a query's relevant passages found in the top k), hit@k
+and p50/p95 latency per retrieval stage.
+
+Each line of the query file is
+    {"query": "...", "relevant": ["substring of a relevant chunk", ...], "category": "optional"}
+
+    python bench/eval_retrieval.py --queries my_labeled_queries.jsonl
+    python bench/eval_retrieval.py --offline   # fakes + bench/retrieval_queries.jsonl
+
+Against the real store this needs the Chroma directory, the embedding model and
+(for the rerank variant) sentence-transformers. --offline uses bench.fakes,
+whose vector "similarity" is arbitrary, so it mainly exercises the keyword,
+fusion and rerank stages.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+DEFAULT_QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retrieval_queries.jsonl")
+
+# name -> retrieve() options; "keyword" is BM25 alone
+VARIANTS = {
+    "vector": {"hybrid": False, "use_reranker": False},
+    "keyword": None,
+    "hybrid": {"hybrid": True, "use_reranker": False},
+    "hybrid+rerank": {"hybrid": True, "use_reranker": True},
+}
+
+
+def load_queries(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def recall(chunks, relevant):
+    found = sum(1 for label in relevant if any(label in chunk for chunk in chunks))
+    return found / len(relevant) if relevant else 0.0
+
+
+async def run(args):
+    if args.offline:
+        from bench.fakes import install
+        install()
+
+    from ai import retrieval
+    from ai.metrics import span, start_request_timing
+    from ai.resources import get_embeddings
+
+    queries = load_queries(args.queries)
+    embeddings = get_embeddings()
+    vectors = [embeddings.embed_query(item["query"]) for item in queries]
+    # Build the keyword index (and load the reranker) outside the measurements
+    retrieval.get_keyword_index()
+
+    variants = [name.strip() for name in args.variants.split(",")]
+    print(f"{len(queries)} queries, k={args.k}, budget {args.budget_ms:.0f} ms")
+    print(f"{'variant':<15}{'recall@k':>10}{'hit@k':>8}{'p50 ms':>9}{'p95 ms':>9}")
+    stage_report = {}
+    for name in variants:
+        recalls, hits, totals = [], [], []
+        stages = defaultdict(list)
+        for _ in range(args.runs):
+            for item, vector in zip(queries, vectors):
+                timings = start_request_timing()
+                started = time.perf_counter()
+                if VARIANTS[name] is None:
+                    with span("retrieval.keyword"):
+                        found = [text for text, _ in retrieval.get_keyword_index().search(
+                            item["query"], args.k, item.get("category"))]
+                else:
+                    found = await retrieval.retrieve(
+                        item["query"], vector, k=args.k, category=item.get("category"),
+                        budget_ms=args.budget_ms, **VARIANTS[name]
+                    )
+                totals.append(time.perf_counter() - started)
+                for stage, elapsed in timings:
+                    stages[stage].append(elapsed)
+                score = recall(found, item.get("relevant", []))
+                recalls.append(score)
+                hits.append(1.0 if score > 0 else 0.0)
+        print(
+            f"{name:<15}{statistics.mean(recalls):>10.3f}{statistics.mean(hits):>8.3f}"
+            f"{percentile(totals, 0.5) * 1000:>9.1f}{percentile(totals, 0.95) * 1000:>9.1f}"
+        )
+        stage_report[name] = stages
+
+    print("\nper-stage latency (ms)")
+    for name, stages in stage_report.items():
+        for stage, values in sorted(stages.items()):
+            print(f"  {name:<15}{stage:<26}p50 {percentile(values, 0.5) * 1000:7.1f}  "
+                  f"p95 {percentile(values, 0.95) * 1000:7.1f}")
+    retrieval.retrieval_executor.shutdown(wait=False)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", default=DEFAULT_QUERIES, help="labeled JSONL query set")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--variants", default=",".join(VARIANTS), help=f"comma separated from {', '.join(VARIANTS)}")
+    parser.add_argument("--budget-ms", type=float, default=400)
+    parser.add_argument("--runs", type=int, default=3, help="passes over the query set (later passes hit the rerank cache)")
+    parser.add_argument("--offline", action="store_true", help="use bench.fakes instead of the real models and store")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
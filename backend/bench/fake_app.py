@@ -0,0 +1,24 @@
+"""🔹 The backend app with every external service replaced by bench.fakes
+
+For serving benchmarks under a real server without credentials:
+
+    ALLOW_LOCAL_BACKENDS=true BENCH_EMBED_CPU=0.02 gunicorn -c gunicorn.conf.py bench.fake_app:app --workers 4
+
+BENCH_LLM_LATENCY sets the fake Gemini's seconds to first token and
+BENCH_EMBED_CPU the CPU seconds each query embedding burns. Each worker gets
+its own copy of the fake Firestore, so sessions are not shared between them.
+"""
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fakes import FakeEmbeddings, FakeGenerativeModel, install  # noqa: E402
+
+install(
+    genai_model=FakeGenerativeModel(latency=float(os.environ.get("BENCH_LLM_LATENCY", "0.05"))),
+    embeddings=FakeEmbeddings(latency=0, cpu_seconds=float(os.environ.get("BENCH_EMBED_CPU", "0.02"))),
+)
+
+from main import app  # noqa: E402,F401
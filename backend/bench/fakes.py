@@ -0,0 +1,759 @@
+"""🔹 Local stand-ins for Gemini, Firestore, the embedder, Chroma and FCM
+
+They let the benchmarks drive the real FastAPI app and conversation pipeline
+offline and deterministically:
+
+- FakeGenerativeModel answers after a configurable latency plus a per-token
+  generation time, and can stream.
+- FakeFirestore is an in-memory async Firestore that counts reads, writes and
+  commits per endpoint label (see `operation_label`).
+- FlakyModel wraps a model stand-in with injected 429/503s and slow calls,
+  for exercising the retries, breaker and hedging of ai.llm.
+- FakeEmbeddings and FakeVectorStore replace MiniLM and Chroma with hash-based
+  vectors and a small canned corpus; FakeReranker scores by shared bigrams.
+- FakeMessaging stands in for the FCM transport and rejects "invalid*" tokens.
+
+install() registers all of them through ai.resources.set_resource().
+"""
+import asyncio
+import contextvars
+import copy
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, ResourceExhausted, ServiceUnavailable
+from google.cloud.firestore_v1.transforms import (
+    DELETE_FIELD,
+    SERVER_TIMESTAMP,
+    ArrayRemove,
+    ArrayUnion,
+    Increment,
+)
+
+from ai import followup
+from ai.prompts import RAG_SYSTEM_INSTRUCTION
+from ai.resources import set_resource
+
+# Which endpoint the current Firestore operations are attributed to
+operation_label = contextvars.ContextVar("operation_label", default="other")
+
+
+# ---------------------------------------------------------------- Gemini ---
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = completion_tokens
+
+
+class FakeResponse:
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage_metadata = usage
+
+
+class FakeStream:
+    def __init__(self, chunks, delay, usage):
+        self._chunks = chunks
+        self._delay = delay
+        self.usage_metadata = usage
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self._chunks:
+            await asyncio.sleep(self._delay)
+            yield FakeResponse(chunk)
+
+
+class FakeGenerativeModel:
+    """Gemini stand-in: `latency` seconds to first token, then `tokens_per_second`"""
+
+    ANSWER = (
+        "ความดันโลหิตสูงมักไม่มีอาการชัดเจน แต่บางคนอาจปวดศีรษะหรือเวียนศีรษะ "
+        "ควรวัดความดันเป็นประจำ ลดเค็ม และออกกำลังกายสม่ำเสมอ "
+        "แนะนำให้ปรึกษาแพทย์หรือบุคลากรทางการแพทย์เพื่อรับคำแนะนำเฉพาะบุคคลค่ะ"
+    )
+    FOLLOWUP = "คุณออกกำลังกายสัปดาห์ละกี่ครั้งคะ?"
+    RISK = "green\nผู้ใช้มีพฤติกรรมสุขภาพที่ดีและไม่มีอาการที่เกี่ยวข้องกับโรค NCDs"
+    SUMMARY = "ผู้ใช้ถามเรื่องความดันโลหิตสูงและเบาหวาน ออกกำลังกายสัปดาห์ละ 2 ครั้ง"
+
+    def __init__(self, latency=0.3, tokens_per_second=200.0, jitter=0.0, seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def _reply_for(self, prompt):
+        if "classify them as" in prompt:
+            return self.RISK
+        if "Next Question" in prompt:
+            return self.FOLLOWUP
+        if "Updated Summary" in prompt:
+            return self.SUMMARY
+        return self.ANSWER
+
+    @staticmethod
+    def count_tokens_estimate(text):
+        # Thai runs ~3 characters per token in Gemini's tokenizer
+        return max(1, len(text) // 3)
+
+    def _account(self, prompt, reply, system_instruction=None):
+        # Gemini bills the system instruction as prompt tokens on every call
+        prompt_tokens = self.count_tokens_estimate(prompt)
+        if system_instruction:
+            prompt_tokens += self.count_tokens_estimate(system_instruction)
+        usage = FakeUsage(prompt_tokens, self.count_tokens_estimate(reply))
+        self.calls += 1
+        self.prompt_tokens += usage.prompt_token_count
+        self.completion_tokens += usage.candidates_token_count
+        return usage
+
+    def _first_token_delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def with_system_instruction(self, system_instruction):
+        """The same stand-in (shared counters) behind a model built with system_instruction="""
+        return FakeInstructedModel(self, system_instruction)
+
+    async def generate_content_async(self, prompt, stream=False, request_options=None, system_instruction=None, **kwargs):
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        reply = self._reply_for(prompt)
+        usage = self._account(prompt, reply, system_instruction)
+        await asyncio.sleep(self._first_token_delay())
+
+        generation_time = usage.candidates_token_count / self.tokens_per_second
+        if not stream:
+            await asyncio.sleep(generation_time)
+            return FakeResponse(reply, usage)
+
+        chunks = [reply[i:i + 24] for i in range(0, len(reply), 24)]
+        return FakeStream(chunks, generation_time / len(chunks), usage)
+
+    def generate_content(self, prompt, **kwargs):
+        raise RuntimeError("FakeGenerativeModel only supports generate_content_async")
+
+
+class FakeInstructedModel:
+    def __init__(self, model, system_instruction):
+        self.model = model
+        self.system_instruction = system_instruction
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return await self.model.generate_content_async(prompt, system_instruction=self.system_instruction, **kwargs)
+
+
+class FlakyModel:
+    """Stub transport for ai.llm: failure injection around a model stand-in
+
+    Each request fails with 503 with probability `error_rate`, is held back an
+    extra `slow_latency` seconds with probability `slow_rate`, and gets a 429
+    whenever more than `capacity` requests are in flight (a quota). The
+    attributes can be changed mid-run, e.g. error_rate=1.0 for an outage.
+    """
+
+    def __init__(self, model=None, error_rate=0.0, slow_rate=0.0, slow_latency=2.0, capacity=None, seed=0):
+        self.model = model or FakeGenerativeModel()
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.capacity = capacity
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.in_flight = 0
+
+    def with_system_instruction(self, system_instruction):
+        return FakeInstructedModel(self, system_instruction)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self.requests += 1
+        if self.capacity is not None and self.in_flight >= self.capacity:
+            raise ResourceExhausted("quota exceeded")
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(0.005)
+            if self.random.random() < self.error_rate:
+                raise ServiceUnavailable("backend unavailable")
+            if self.random.random() < self.slow_rate:
+                await asyncio.sleep(self.slow_latency)
+            return await self.model.generate_content_async(prompt, **kwargs)
+        finally:
+            self.in_flight -= 1
+
+
+# ---------------------------------------------------- Embeddings / Chroma ---
+
+class FakeEmbeddings:
+    """Deterministic hash-seeded unit vectors: equal texts embed identically"""
+
+    def __init__(self, dimensions=384, latency=0.005, cpu_seconds=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        # Busy-loop per query, like a real model holding a core
+        self.cpu_seconds = cpu_seconds
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        until = time.process_time() + self.cpu_seconds
+        while time.process_time() < until:
+            pass
+        return self._vector(text)
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+
+class FakeDocument:
+    def __init__(self, page_content, metadata=None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+
+
+class FakeVectorStore:
+    """Chroma stand-in over a small canned Thai corpus with `category` metadata
+
+    Vector "similarity" is arbitrary (the embeddings are hashes), which keeps
+    keyword search and reranking honest in the retrieval evaluation.
+    """
+
+    DOCUMENTS = [
+        ("โรคเบาหวานชนิดที่ 2 สัมพันธ์กับน้ำหนักเกินและการขาดการออกกำลังกาย", "diabetes"),
+        ("อาการของโรคเบาหวาน ได้แก่ ปัสสาวะบ่อย กระหายน้ำ หิวบ่อย น้ำหนักลด และแผลหายช้า", "diabetes"),
+        ("ระดับน้ำตาลในเลือดขณะอดอาหารตั้งแต่ 126 มก./ดล. ขึ้นไป ถือว่าเป็นโรคเบาหวาน", "diabetes"),
+        ("ความดันโลหิตสูง หมายถึงความดันตั้งแต่ 140/90 มิลลิเมตรปรอทขึ้นไป", "hypertension"),
+        ("ความดันโลหิตสูงมักไม่มีอาการ บางคนอาจปวดศีรษะ เวียนศีรษะ หรือตามัว", "hypertension"),
+        ("ควรลดการบริโภคเกลือไม่เกิน 1 ช้อนชาต่อวัน เพื่อควบคุมความดันโลหิต", "hypertension"),
+        ("การสูบบุหรี่เพิ่มความเสี่ยงโรคหัวใจและหลอดเลือด", "heart_disease"),
+        ("อาการเจ็บแน่นหน้าอก เหนื่อยง่าย อาจเป็นสัญญาณของโรคหัวใจขาดเลือด ควรรีบพบแพทย์", "heart_disease"),
+        ("สัญญาณเตือนโรคหลอดเลือดสมอง คือ หน้าเบี้ยว แขนขาอ่อนแรง พูดไม่ชัด ต้องรีบไปโรงพยาบาลภายใน 4.5 ชั่วโมง", "stroke"),
+        ("ไขมันแอลดีแอลคอเลสเตอรอลสูงเพิ่มความเสี่ยงหลอดเลือดแข็งตัว ควรตรวจไขมันในเลือดทุกปี", "dyslipidemia"),
+        ("โรคไตเรื้อรังมักเกิดจากเบาหวานและความดันโลหิตสูงที่ควบคุมไม่ได้", "kidney_disease"),
+        ("ถุงลมโป่งพองเกิดจากการสูบบุหรี่เป็นเวลานาน ทำให้หายใจลำบาก", "copd"),
+        ("การออกกำลังกายระดับปานกลาง 150 นาทีต่อสัปดาห์ช่วยลดความเสี่ยง NCDs", None),
+        ("การนอนหลับวันละ 7-9 ชั่วโมงและจัดการความเครียดช่วยลดความเสี่ยงโรคเรื้อรัง", None),
+        ("ดัชนีมวลกายตั้งแต่ 25 ขึ้นไปถือว่าเป็นโรคอ้วนสำหรับคนเอเชีย", "obesity"),
+        ("การดื่มแอลกอฮอล์เป็นประจำเพิ่มความเสี่ยงโรคตับ ความดันโลหิตสูง และมะเร็ง", None),
+    ]
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+        self._collection = FakeChromaCollection(self)
+
+    def _documents(self, filter=None):
+        category = (filter or {}).get("category")
+        return [
+            FakeDocument(text, {"category": doc_category} if doc_category else {})
+            for text, doc_category in self.DOCUMENTS
+            if not category or doc_category == category
+        ]
+
+    def similarity_search_by_vector(self, embedding, k=5, filter=None, **kwargs):
+        time.sleep(self.latency)
+        documents = self._documents(filter)
+        if embedding is not None:
+            # Arbitrary but deterministic order per query vector
+            offset = int(abs(float(np.sum(embedding))) * 1000) % max(1, len(documents))
+            documents = documents[offset:] + documents[:offset]
+        return documents[:k]
+
+    def similarity_search(self, query, k=5, **kwargs):
+        return self.similarity_search_by_vector(None, k=k, **kwargs)
+
+
+class FakeChromaCollection:
+    def __init__(self, store):
+        self._store = store
+
+    def count(self):
+        return len(self._store.DOCUMENTS)
+
+    def get(self, ids=None, include=None, **kwargs):
+        documents = self._store._documents()
+        return {
+            "ids": [hashlib.sha256(d.page_content.encode("utf-8")).hexdigest() for d in documents],
+            "documents": [d.page_content for d in documents],
+            "metadatas": [d.metadata for d in documents],
+        }
+
+
+class FakeReranker:
+    """Cross-encoder stand-in: scores pairs by shared character bigrams"""
+
+    def __init__(self, latency_per_pair=0.002):
+        self.latency_per_pair = latency_per_pair
+
+    @staticmethod
+    def _bigrams(text):
+        text = "".join(text.lower().split())
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def predict(self, pairs):
+        time.sleep(self.latency_per_pair * len(pairs))
+        scores = []
+        for query, text in pairs:
+            query_grams = self._bigrams(query)
+            scores.append(len(query_grams & self._bigrams(text)) / (len(query_grams) or 1))
+        return np.array(scores, dtype=np.float32)
+
+
+# ------------------------------------------------------------- Firestore ---
+
+def _apply_value(current, value):
+    if value is SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, ArrayUnion):
+        existing = list(current or [])
+        return existing + [v for v in value.values if v not in existing]
+    if isinstance(value, ArrayRemove):
+        return [v for v in (current or []) if v not in value.values]
+    if isinstance(value, Increment):
+        return (current or 0) + value.value
+    if isinstance(value, dict):
+        return {k: _apply_value(None, v) for k, v in value.items() if v is not DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _set_path(data, field_path, value):
+    *parents, leaf = field_path.split(".")
+    for part in parents:
+        data = data.setdefault(part, {})
+    if value is DELETE_FIELD:
+        data.pop(leaf, None)
+    else:
+        data[leaf] = _apply_value(data.get(leaf), value)
+
+
+def _merge(document, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(document.get(key), dict):
+            _merge(document[key], value)
+        elif value is DELETE_FIELD:
+            document.pop(key, None)
+        else:
+            document[key] = _apply_value(document.get(key), value)
+
+
+def _get_path(data, field_path):
+    for part in field_path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return _get_path(self._data or {}, field_path)
+
+
+class FakeDocumentReference:
+    def __init__(self, store, path):
+        self._store = store
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._store, f"{self.path}/{name}")
+
+    async def get(self, field_paths=None):
+        await self._store.round_trip()
+        self._store.count("reads")
+        return FakeSnapshot(self, copy.deepcopy(self._store.documents.get(self.path)), self._store.update_times.get(self.path))
+
+    def _check(self, option):
+        last_update_time = getattr(option, "last_update_time", None)
+        if last_update_time is not None and self._store.update_times.get(self.path) != last_update_time:
+            raise FailedPrecondition(f"Document was updated since {last_update_time}: {self.path}")
+
+    async def create(self, data):
+        await self._store.round_trip()
+        self._store.count("commits")
+        if self.path in self._store.documents:
+            raise AlreadyExists(f"Document already exists: {self.path}")
+        self._store.apply_set(self.path, data)
+        return FakeWriteResult(self._store.update_times.get(self.path))
+
+    async def set(self, data, merge=False):
+        await self._store.round_trip()
+        self._store.count("commits")
+        self._store.apply_set(self.path, data, merge)
+        return FakeWriteResult(self._store.update_times.get(self.path))
+
+    async def update(self, data, option=None):
+        await self._store.round_trip()
+        self._store.count("commits")
+        self._check(option)
+        self._store.apply_update(self.path, data)
+        return FakeWriteResult(self._store.update_times.get(self.path))
+
+    async def delete(self, option=None):
+        await self._store.round_trip()
+        self._store.count("commits")
+        self._check(option)
+        self._store.apply_delete(self.path)
+
+
+class FakeQuery:
+    def __init__(self, store, path, filters=(), orders=(), limit=None, start_after=None, fields=None):
+        self._store = store
+        self._path = path
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._start_after = start_after
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = {
+            "filters": self._filters, "orders": self._orders, "limit": self._limit,
+            "start_after": self._start_after, "fields": self._fields,
+        }
+        state.update(changes)
+        return FakeQuery(self._store, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    @staticmethod
+    def _field_value(snapshot, field_path):
+        if field_path == "__name__":
+            return snapshot.id
+        return _get_path(snapshot._data, field_path)
+
+    @classmethod
+    def _sort_key(cls, snapshot, field_path):
+        value = cls._field_value(snapshot, field_path)
+        return (value is not None, value)
+
+    def _matches(self, data):
+        for field_path, op, expected in self._filters:
+            value = _get_path(data, field_path)
+            if op == "==" and value != expected:
+                return False
+            if op == "!=" and value == expected:
+                return False
+            if op == "in" and value not in expected:
+                return False
+            if op == "array_contains" and expected not in (value or []):
+                return False
+            if op in ("<", "<=", ">", ">="):
+                if value is None:
+                    return False
+                if op == "<" and not value < expected:
+                    return False
+                if op == "<=" and not value <= expected:
+                    return False
+                if op == ">" and not value > expected:
+                    return False
+                if op == ">=" and not value >= expected:
+                    return False
+        return True
+
+    def _run(self):
+        prefix = self._path + "/"
+        snapshots = []
+        for path, data in self._store.documents.items():
+            if path.startswith(prefix) and "/" not in path[len(prefix):] and self._matches(data):
+                snapshots.append(FakeSnapshot(FakeDocumentReference(self._store, path), data,
+                                              self._store.update_times.get(path)))
+
+        orders = self._orders or [("__name__", "ASCENDING")]
+        for field_path, direction in reversed(orders):
+            snapshots.sort(key=lambda s: self._sort_key(s, field_path), reverse=direction == "DESCENDING")
+
+        if self._start_after is not None:
+            cursor = self._start_after
+            cursor_id = cursor.id if isinstance(cursor, FakeSnapshot) else None
+            if cursor_id is not None:
+                ids = [s.id for s in snapshots]
+                snapshots = snapshots[ids.index(cursor_id) + 1:] if cursor_id in ids else []
+            else:
+                field_path, direction = orders[0]
+                cursor_value = cursor.get(field_path)
+                if direction == "DESCENDING":
+                    snapshots = [s for s in snapshots if self._field_value(s, field_path) < cursor_value]
+                else:
+                    snapshots = [s for s in snapshots if self._field_value(s, field_path) > cursor_value]
+
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+
+        # Copied only now: like Firestore, only the selected fields of the returned page are sent
+        for snapshot in snapshots:
+            if self._fields is not None:
+                snapshot._data = {f: copy.deepcopy(_get_path(snapshot._data, f)) for f in self._fields}
+            else:
+                snapshot._data = copy.deepcopy(snapshot._data)
+
+        # Firestore bills at least one read per query, then one per document
+        self._store.count("reads", max(1, len(snapshots)))
+        self._store.count("queries")
+        return snapshots
+
+    async def get(self):
+        await self._store.round_trip()
+        return self._run()
+
+    async def stream(self):
+        await self._store.round_trip()
+        for snapshot in self._run():
+            yield snapshot
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        document_id = document_id or uuid.uuid4().hex[:20]
+        return FakeDocumentReference(self._store, f"{self._path}/{document_id}")
+
+
+class FakeWriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference.path, data, merge))
+
+    def create(self, reference, data):
+        self._writes.append(("create", reference.path, data, None))
+
+    def update(self, reference, data, option=None):
+        self._writes.append(("update", reference.path, data, option))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference.path, None, None))
+
+    async def commit(self):
+        """Apply every write, or none when a precondition fails; returns the write results"""
+        await self._store.round_trip()
+        self._store.count("commits")
+        for kind, path, _, option in self._writes:
+            if kind == "create" and path in self._store.documents:
+                raise AlreadyExists(f"Document already exists: {path}")
+            last_update_time = getattr(option, "last_update_time", None)
+            if kind == "update" and last_update_time is not None and self._store.update_times.get(path) != last_update_time:
+                raise FailedPrecondition(f"Document was updated since {last_update_time}: {path}")
+        results = []
+        for kind, path, data, option in self._writes:
+            if kind in ("set", "create"):
+                self._store.apply_set(path, data, option if kind == "set" else False)
+            elif kind == "update":
+                self._store.apply_update(path, data)
+            else:
+                self._store.apply_delete(path)
+            results.append(FakeWriteResult(self._store.update_times.get(path)))
+        self._writes = []
+        return results
+
+
+class FakeWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class FakeWriteOption:
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+class FakeFirestore:
+    """In-memory async Firestore client with per-label operation counters"""
+
+    def __init__(self, latency=0.005):
+        self.latency = latency
+        self.documents = {}
+        # Like Firestore's update_time: changes on every write, checked by write preconditions
+        self.update_times = {}
+        self.operations = defaultdict(lambda: defaultdict(int))
+
+    async def round_trip(self):
+        self.count("round_trips")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def count(self, kind, amount=1):
+        self.operations[operation_label.get()][kind] += amount
+
+    def count_write(self):
+        self.count("writes")
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path):
+        return FakeDocumentReference(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    @staticmethod
+    def write_option(**kwargs):
+        return FakeWriteOption(**kwargs)
+
+    def _touch(self, path):
+        now = datetime.now(timezone.utc)
+        previous = self.update_times.get(path)
+        if previous is not None and now <= previous:
+            now = previous + timedelta(microseconds=1)
+        self.update_times[path] = now
+
+    async def get_all(self, references, field_paths=None):
+        await self.round_trip()
+        for reference in references:
+            self.count("reads")
+            yield FakeSnapshot(reference, copy.deepcopy(self.documents.get(reference.path)),
+                               self.update_times.get(reference.path))
+
+    def apply_set(self, path, data, merge=False):
+        self.count_write()
+        self._touch(path)
+        if merge and path in self.documents:
+            _merge(self.documents[path], data)
+            return
+        document = {}
+        for key, value in data.items():
+            if value is not DELETE_FIELD:
+                document[key] = _apply_value(None, value)
+        self.documents[path] = document
+
+    def apply_update(self, path, data):
+        self.count_write()
+        if path not in self.documents:
+            raise KeyError(f"No document to update: {path}")
+        self._touch(path)
+        document = self.documents[path]
+        for field_path, value in data.items():
+            _set_path(document, field_path, value)
+
+    def apply_delete(self, path):
+        self.count_write()
+        self.documents.pop(path, None)
+        self.update_times.pop(path, None)
+
+    def reset_counters(self):
+        self.operations.clear()
+
+
+# ------------------------------------------------------------------- FCM ---
+class FakeMessaging:
+    """Stand-in for the firebase_admin.messaging transport
+
+    Accepts real Message / MulticastMessage objects. Tokens starting with
+    "invalid" are answered with UnregisteredError, like an uninstalled app.
+    """
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.requests = 0
+        self.sent = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _track(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+
+    def _response(self, token):
+        from firebase_admin import messaging
+
+        if token.startswith("invalid"):
+            error = messaging.UnregisteredError("Requested entity was not found.")
+            return messaging.SendResponse(None, error)
+        self.sent += 1
+        return messaging.SendResponse({"name": f"projects/bench/messages/{uuid.uuid4().hex}"}, None)
+
+    def send(self, message, dry_run=False, app=None):
+        self._track(1)
+        try:
+            time.sleep(self.latency)
+            self.requests += 1
+            response = self._response(message.token)
+            if response.exception:
+                raise response.exception
+            return response.message_id
+        finally:
+            self._track(-1)
+
+    def send_each_for_multicast(self, multicast_message, dry_run=False, app=None):
+        from firebase_admin import messaging
+
+        if len(multicast_message.tokens) > 500:
+            raise ValueError("Multicast message may contain at most 500 tokens")
+        self._track(1)
+        try:
+            time.sleep(self.latency)
+            self.requests += 1
+            return messaging.BatchResponse([self._response(token) for token in multicast_message.tokens])
+        finally:
+            self._track(-1)
+
+
+def install(genai_model=None, firestore=None, embeddings=None, vector_db=None, fcm=None, reranker=None):
+    """🔹 Register the stand-ins as the backend's components; returns them"""
+    components = {
+        "genai_model": genai_model or FakeGenerativeModel(),
+        "firestore": firestore or FakeFirestore(),
+        "embeddings": embeddings or FakeEmbeddings(),
+        "vector_db": vector_db or FakeVectorStore(),
+        "fcm": fcm or FakeMessaging(),
+        "reranker": reranker or FakeReranker(),
+    }
+    # Answers use the same stand-in (it picks its reply from the prompt)
+    components["answer_model"] = components["genai_model"].with_system_instruction(RAG_SYSTEM_INSTRUCTION)
+    for name, component in components.items():
+        set_resource(name, component)
+    # The question bank is embedded with the fake embedder: keep those vectors out of the tree
+    followup.QUESTION_VECTORS_FILE = os.path.join(tempfile.gettempdir(), "ncd-bench-question-bank.npz")
+    set_resource("question_bank", followup.build_question_bank())
+    return components
@@ -0,0 +1,166 @@
+"""🔹 Follow-up question benchmark: question bank vs. a Gemini call per turn
+
+Runs the same simulated conversations through ai.converse.converse() with
+FOLLOWUP_MODE=llm and FOLLOWUP_MODE=bank (Gemini, Firestore, the embedder
+and Chroma replaced by bench.fakes) and reports, per mode:
+- turn latency p50/p95 and the follow-up's own latency
+- Gemini calls and tokens per turn, and what the follow-up calls cost
+- where follow-ups came from (bank / llm / none)
+It also checks that the bank never repeats a question within a session and
+spreads its questions over the topics.
+
+    python bench/followup.py
+    python bench/followup.py --users 50 --turns 8 --llm-latency 0.4 --price-in 0.075 --price-out 0.30
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+from prometheus_client import REGISTRY
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fakes import FakeFirestore, FakeGenerativeModel, install  # noqa: E402
+from bench.workload import QUESTIONS, percentile  # noqa: E402
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def followup_counters():
+    return {
+        "calls": sample("ncd_llm_events_total", call="followup", event="success"),
+        "prompt_tokens": sample("ncd_llm_tokens_total", call="followup", kind="prompt"),
+        "completion_tokens": sample("ncd_llm_tokens_total", call="followup", kind="completion"),
+        **{source: sample("ncd_followup_questions_total", source=source) for source in ("bank", "llm", "none")},
+    }
+
+
+async def run_mode(mode, args):
+    import ai.converse as converse_module
+    from ai.converse import converse
+    from ai.jobs import job_queue
+
+    store = FakeFirestore(latency=args.firestore_latency)
+    model = FakeGenerativeModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second, seed=args.seed)
+    install(genai_model=model, firestore=store)
+    converse_module.FOLLOWUP_MODE = mode
+
+    followup_latencies = []
+    next_followup = converse_module.next_followup
+
+    async def timed_followup(ctx, query):
+        started = time.perf_counter()
+        try:
+            return await next_followup(ctx, query)
+        finally:
+            followup_latencies.append(time.perf_counter() - started)
+
+    converse_module.next_followup = timed_followup
+    before = followup_counters()
+    turn_latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rng = random.Random(args.seed)
+
+    async def user(user_id, user_rng):
+        async with semaphore:
+            for _ in range(args.turns):
+                started = time.perf_counter()
+                await converse(user_id, user_rng.choice(QUESTIONS))
+                turn_latencies.append(time.perf_counter() - started)
+
+    try:
+        await asyncio.gather(*(user(f"bench-{mode}-{i}", random.Random(rng.random())) for i in range(args.users)))
+        await job_queue.join()
+    finally:
+        converse_module.next_followup = next_followup
+
+    after = followup_counters()
+    delta = {key: after[key] - before[key] for key in after}
+    turns = args.users * args.turns
+    sessions = [data for path, data in store.documents.items() if path.count("/") == 1]
+    return {
+        "turns": turns,
+        "turn_p50": percentile(turn_latencies, 0.5),
+        "turn_p95": percentile(turn_latencies, 0.95),
+        "followup_p50": percentile(followup_latencies, 0.5),
+        "followup_p95": percentile(followup_latencies, 0.95),
+        "llm_calls_per_turn": model.calls / turns,
+        "tokens_per_turn": (model.prompt_tokens + model.completion_tokens) / turns,
+        "followup_cost": (delta["prompt_tokens"] * args.price_in + delta["completion_tokens"] * args.price_out) / 1e6,
+        "followup": delta,
+        "asked": [data.get("questions") or [] for data in sessions],
+    }
+
+
+async def run(args):
+    from ai.jobs import job_queue
+    from ai.resources import get_question_bank
+
+    await job_queue.start()
+    results = {}
+    try:
+        for mode in ("llm", "bank"):
+            results[mode] = await run_mode(mode, args)
+    finally:
+        await job_queue.stop()
+
+    print(f"{args.users} users x {args.turns} turns, Gemini {args.llm_latency}s to first token")
+    print(f"{'mode':<6}{'turn p50':>9}{'p95 ms':>8}{'fu p50':>8}{'fu p95':>8}{'LLM/turn':>9}"
+          f"{'tok/turn':>9}{'fu LLM':>7}{'bank':>6}{'none':>6}{'fu cost $':>11}")
+    for mode, r in results.items():
+        f = r["followup"]
+        print(f"{mode:<6}{r['turn_p50'] * 1000:>9.0f}{r['turn_p95'] * 1000:>8.0f}{r['followup_p50'] * 1000:>8.1f}"
+              f"{r['followup_p95'] * 1000:>8.1f}{r['llm_calls_per_turn']:>9.2f}{r['tokens_per_turn']:>9.0f}"
+              f"{f['calls']:>7.0f}{f['bank']:>6.0f}{f['none']:>6.0f}{r['followup_cost']:>11.5f}")
+
+    llm, bank = results["llm"], results["bank"]
+    saved_calls = llm["llm_calls_per_turn"] - bank["llm_calls_per_turn"]
+    print(f"saved per turn: {saved_calls:.2f} Gemini calls, {llm['tokens_per_turn'] - bank['tokens_per_turn']:.0f} tokens, "
+          f"follow-up p50 {(llm['followup_p50'] - bank['followup_p50']) * 1000:.0f} ms; "
+          f"${(llm['followup_cost'] - bank['followup_cost']) / llm['turns'] * 1e6:.0f} per million turns")
+
+    failures = []
+    questions = {question["id"]: question["topic"] for question in get_question_bank().questions}
+    topics = Counter()
+    for asked in bank["asked"]:
+        if len(asked) != len(set(asked)):
+            failures.append("a question was asked twice in one session")
+            break
+        topics.update(questions[question_id] for question_id in asked)
+    print(f"bank questions by topic: {dict(topics.most_common())}")
+    if bank["followup"]["calls"]:
+        failures.append(f"the bank still made {bank['followup']['calls']:.0f} Gemini follow-up calls")
+    if saved_calls < 0.5:
+        failures.append("the bank did not remove the follow-up call")
+    if len(topics) < min(4, len(set(questions.values()))):
+        failures.append("bank questions covered too few topics")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--firestore-latency", type=float, default=0.005)
+    parser.add_argument("--price-in", type=float, default=0.075, help="USD per million prompt tokens")
+    parser.add_argument("--price-out", type=float, default=0.30, help="USD per million completion tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""🔹 History API / export benchmark
+
+Seeds an in-memory Firestore with users, archived sessions and messages, then:
+- pages through one user's sessions and messages with the cursors and checks
+  that every document comes back once
+- exports every user's messages at several concurrency levels (records/s,
+  Firestore queries and reads, peak Python memory of the export)
+- exports sessions projected to risk_level,timestamp as CSV and checks the
+  columns and row count
+
+    python bench/history_export.py
+    python bench/history_export.py --users 500 --sessions 5 --messages 20 --levels 1,8,32
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from ai.ids import ulid_at  # noqa: E402
+from bench.fakes import FakeFirestore, install  # noqa: E402
+
+RISK_LEVELS = ["ต่ำ", "ปานกลาง", "สูง"]
+
+
+def seed(store, args, rng):
+    started_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for u in range(args.users):
+        user_id = f"bench-user-{u:05d}"
+        store.documents[f"conversations/{user_id}"] = {"risk_level": rng.choice(RISK_LEVELS), "turn_count": 0}
+        for s in range(args.sessions):
+            session_time = started_at + timedelta(days=s, minutes=u)
+            session_id = str(int(session_time.timestamp() * 1000))
+            store.documents[f"conversations/{user_id}/sessions/{session_id}"] = {
+                "session_id": session_id,
+                "risk_level": rng.choice(RISK_LEVELS),
+                "timestamp": session_time,
+                "turn_count": args.messages,
+            }
+            for seq in range(1, args.messages + 1):
+                millis = int(session_time.timestamp() * 1000) + seq
+                message_id = ulid_at(millis, f"{user_id}:{session_id}:{seq}")
+                store.documents[f"conversations/{user_id}/messages/{message_id}"] = {
+                    "id": message_id,
+                    "session_id": session_id,
+                    "seq": seq,
+                    "query": "ความดันโลหิตสูงมีอาการอย่างไร " * 4,
+                    "response": "ความดันโลหิตสูงมักไม่มีอาการ ควรวัดความดันเป็นประจำ " * 12,
+                    "timestamp": session_time + timedelta(seconds=seq),
+                }
+
+
+async def page_all(list_page, key, cursor_arg="cursor", **kwargs):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page = await list_page("bench-user-00000", **{cursor_arg: cursor}, **kwargs)
+        pages += 1
+        ids += [item["session_id"] if key == "sessions" else item["id"] for item in page[key]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+async def run(args):
+    store = FakeFirestore(latency=args.firestore_latency)
+    install(firestore=store)
+    seed(store, args, random.Random(args.seed))
+    failures = []
+
+    from ai import history
+    from ai.converse import get_messages
+
+    sessions, pages = await page_all(history.list_sessions, "sessions", limit=2, fields="risk_level")
+    print(f"sessions of one user: {len(sessions)} in {pages} pages, newest first: {sessions == sorted(sessions, reverse=True)}")
+    if sorted(sessions, reverse=True) != sessions or len(set(sessions)) != args.sessions:
+        failures.append("session paging lost, repeated or misordered sessions")
+    messages, pages = await page_all(get_messages, "messages", cursor_arg="after", limit=7)
+    print(f"messages of one user: {len(messages)} in {pages} pages")
+    if sorted(messages) != messages or len(set(messages)) != args.sessions * args.messages:
+        failures.append("message paging lost, repeated or misordered messages")
+
+    expected = args.users * args.sessions * args.messages
+    print(f"\nexport {expected} messages of {args.users} users as NDJSON")
+    print(f"{'concurrency':>12}{'seconds':>9}{'records/s':>11}{'queries':>9}{'reads':>8}{'peak MB':>9}")
+    for level in [int(x) for x in args.levels.split(",")]:
+        store.reset_counters()
+        tracemalloc.start()
+        started = time.perf_counter()
+        lines = 0
+        async for chunk in history.export_stream("messages", "ndjson", concurrency=level):
+            lines += chunk.count("\n")
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        operations = store.operations["other"]
+        print(f"{level:>12}{elapsed:>9.2f}{lines / elapsed:>11.0f}{operations['queries']:>9}"
+              f"{operations['reads']:>8}{peak:>9.1f}")
+        if lines != expected:
+            failures.append(f"concurrency {level}: exported {lines} of {expected} messages")
+
+    store.reset_counters()
+    where = [["risk_level", "==", "สูง"]]
+    cohort = sum(1 for path, doc in store.documents.items()
+                 if path.count("/") == 1 and doc["risk_level"] == "สูง")
+    text = "".join([chunk async for chunk in history.export_stream(
+        "sessions", "csv", where=where, fields="risk_level,timestamp")])
+    rows = list(csv.DictReader(io.StringIO(text)))
+    print(f"\nhigh-risk cohort: {cohort} users, {len(rows)} session rows, columns {list(rows[0]) if rows else []}")
+    if len(rows) != cohort * args.sessions or (rows and list(rows[0]) != ["user_id", "risk_level", "timestamp"]):
+        failures.append("projected CSV export has the wrong rows or columns")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=10, help="messages per session")
+    parser.add_argument("--levels", default="1,8,32", help="comma separated export concurrency levels")
+    parser.add_argument("--firestore-latency", type=float, default=0.02, help="seconds per round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
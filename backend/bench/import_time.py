@@ -0,0 +1,49 @@
+"""🔹 Import-time benchmark for the backend
+
+Imports `main` in fresh interpreters and reports the best/median wall time.
+Models and clients load lazily (or in the startup warm-up), so this number
+should stay small. It exits non-zero if the median exceeds --max-seconds, so
+a regression can fail CI.
+
+    python bench/import_time.py --runs 5 --max-seconds 3
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+
+
+def measure(module):
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(module=module)],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None, help="fail when the median import time is above this")
+    args = parser.parse_args()
+
+    timings = [measure(args.module) for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"import {args.module}: best {min(timings):.3f}s, median {median:.3f}s over {args.runs} runs")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"❌ median import time {median:.3f}s exceeds {args.max_seconds:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""🔹 Gemini client resilience benchmark
+
+Drives ai.llm.LLMClient against bench.fakes.FlakyModel (injected 503s, slow
+calls and a 429 quota) and compares client settings per scenario: success
+rate, latency percentiles, requests that reached "Gemini", retries, hedges
+and calls rejected without being sent.
+
+    python bench/llm_resilience.py
+    python bench/llm_resilience.py --calls 400 --concurrency 100
+
+Scenarios:
+- flaky:  15% 503s and a 5% slow tail; retries and hedging
+- burst:  every call at once against a quota of 8 in flight; rate and
+          concurrency limits
+- outage: every request fails; the circuit breaker fails fast
+Also checks that a streamed answer arrives whole through LLMClient.stream().
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from ai.llm import CircuitBreaker, LLMClient  # noqa: E402
+from bench.fakes import FakeGenerativeModel, FlakyModel  # noqa: E402
+
+PROMPT = "### User's Question:\nความดันโลหิตสูงมีอาการอย่างไร"
+
+# name -> LLMClient settings
+CLIENTS = {
+    "bare": {"rate": 0, "max_attempts": 1},
+    "retry": {"rate": 0, "max_attempts": 3, "retry_delay": 0.1},
+    # Normal calls take ~0.5s, so hedge a little past that
+    "retry+hedge": {"rate": 0, "max_attempts": 3, "retry_delay": 0.1, "hedge_after": 0.8},
+    # Kept under the quota: queued calls that cannot start before their deadline are shed at once
+    "limited": {"rate": 15, "burst": 8, "max_concurrency": 8, "max_attempts": 3, "retry_delay": 0.1},
+}
+
+SCENARIOS = {
+    "flaky": ({"error_rate": 0.15, "slow_rate": 0.05, "slow_latency": 2.0}, ["bare", "retry", "retry+hedge"]),
+    "burst": ({"capacity": 8}, ["bare", "retry", "limited"]),
+    "outage": ({"error_rate": 1.0}, ["retry"]),
+}
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+async def run_scenario(flaky_kwargs, client_kwargs, args):
+    model = FlakyModel(FakeGenerativeModel(latency=args.llm_latency), seed=args.seed, **flaky_kwargs)
+    client = LLMClient(breaker=CircuitBreaker(cooldown=5), **client_kwargs)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, successes = [], 0
+
+    async def one():
+        nonlocal successes
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await client.generate("answer", PROMPT, model=lambda: model, deadline=args.deadline, hedge=True)
+                successes += 1
+            except Exception:
+                pass
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.calls)))
+    return {
+        "success": successes / args.calls,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "elapsed": time.perf_counter() - started,
+        "sent": model.requests,
+        **client.stats(),
+    }
+
+
+async def check_stream():
+    client = LLMClient(rate=0)
+    # Fails the first request: the stream must be retried before any chunk is shown
+    model = FlakyModel(FakeGenerativeModel(latency=0.01), error_rate=1.0)
+    chunks = []
+
+    async def recover():
+        await asyncio.sleep(0.02)
+        model.error_rate = 0.0
+
+    asyncio.create_task(recover())
+    client.retry_delay = 0.05
+    async for text in client.stream("answer", PROMPT, model=lambda: model, deadline=5):
+        chunks.append(text)
+    return "".join(chunks) == FakeGenerativeModel.ANSWER and client.counts["retries"] >= 1
+
+
+async def run(args):
+    failures = []
+    print(f"{'scenario':<8}{'client':<14}{'ok %':>6}{'p50 s':>7}{'p95 s':>7}{'p99 s':>7}"
+          f"{'sent':>6}{'retry':>6}{'hedge':>6}{'reject':>7}  circuit")
+    for scenario, (flaky_kwargs, clients) in SCENARIOS.items():
+        results = {}
+        for name in clients:
+            r = results[name] = await run_scenario(flaky_kwargs, CLIENTS[name], args)
+            print(f"{scenario:<8}{name:<14}{r['success'] * 100:>6.1f}{r['p50']:>7.2f}{r['p95']:>7.2f}{r['p99']:>7.2f}"
+                  f"{r['sent']:>6}{r['retries']:>6}{r['hedges']:>6}{r['rejected']:>7}  "
+                  f"{r['circuit']} (opened {r['circuit_opened']}x)")
+        if scenario == "flaky" and results["retry"]["success"] <= results["bare"]["success"]:
+            failures.append("retries did not improve the success rate")
+        if scenario == "flaky" and results["retry+hedge"]["p99"] >= results["retry"]["p99"]:
+            failures.append("hedging did not cut the tail latency")
+        if scenario == "burst" and results["limited"]["success"] <= results["bare"]["success"]:
+            failures.append("rate limiting did not avoid the quota errors")
+        if scenario == "outage" and results["retry"]["sent"] >= args.calls:
+            failures.append("the circuit breaker did not stop calls during the outage")
+
+    stream_ok = await check_stream()
+    print(f"stream retried before the first chunk and arrived whole: {stream_ok}")
+    if not stream_ok:
+        failures.append("streamed answer incomplete")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="seconds to first token")
+    parser.add_argument("--deadline", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""🔹 Load benchmark for /chat
+
+Fires concurrent /chat requests at a running backend and reports requests per
+second at each concurrency level. Levels above Starlette's default threadpool
+size (40) show whether the async pipeline keeps scaling past it.
+
+    python -m uvicorn main:app --port 8080
+    python bench/load_chat.py --url http://127.0.0.1:8080 --levels 10,40,80,160
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def run_level(client, url, concurrency, total_requests):
+    queue = asyncio.Queue()
+    for i in range(total_requests):
+        queue.put_nowait(i)
+
+    latencies = []
+    errors = 0
+
+    async def worker(worker_id):
+        nonlocal errors
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = {"user_id": f"bench-user-{worker_id}", "message": f"ความดันโลหิตสูงมีอาการอย่างไร ({i})"}
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/chat", json=payload)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": errors,
+        "rps": total_requests / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--levels", default="10,40,80,160", help="comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=4, help="requests per concurrent client at each level")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        print(f"{'concurrency':>12} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for level in [int(x) for x in args.levels.split(",")]:
+            result = await run_level(client, args.url, level, level * args.requests)
+            print(
+                f"{result['concurrency']:>12} {result['requests']:>9} {result['errors']:>7} "
+                f"{result['rps']:>9.1f} {result['p50_ms']:>9.0f} {result['p95_ms']:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
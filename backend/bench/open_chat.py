@@ -0,0 +1,78 @@
+"""🔹 Firestore operations needed to open a chat
+
+Drives /start_chat and /new_chat against the in-memory Firestore of
+bench.fakes with the per-user caches cold and warm, and checks that each
+opening costs at most one batched read (none when warm) and one commit.
+Exits 1 when a budget is exceeded or the stored conversation is wrong.
+
+    python bench/open_chat.py
+"""
+import asyncio
+import logging
+import os
+import sys
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fakes import FakeFirestore, install, operation_label  # noqa: E402
+
+USER_ID = "bench-user-open"
+# (label, path, caches cleared first, max read round trips)
+STEPS = [
+    ("start_chat cold", "/start_chat", True, 1),
+    ("start_chat warm", "/start_chat", False, 0),
+    ("new_chat warm", "/new_chat", False, 0),
+    ("new_chat cold", "/new_chat", True, 1),
+    ("start_chat after new_chat", "/start_chat", False, 0),
+]
+
+
+async def run():
+    store = FakeFirestore(latency=0.001)
+    install(firestore=store)
+    store.documents[f"users/{USER_ID}"] = {"name": "สมศรี"}
+
+    import main
+    from ai.jobs import job_queue
+    from ai.user_cache import profile_cache, session_cache
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    failures = []
+    print(f"{'step':<28}{'round trips':>12}{'reads':>7}{'commits':>9}{'writes':>8}")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, path, cold, max_read_trips in STEPS:
+            if cold:
+                await profile_cache.clear()
+                await session_cache.clear()
+            token = operation_label.set(label)
+            try:
+                response = (await client.get(path, params={"user_id": USER_ID})).json()
+            finally:
+                operation_label.reset(token)
+
+            operations = store.operations[label]
+            commits = operations["commits"]
+            read_trips = operations["round_trips"] - commits
+            print(f"{label:<28}{read_trips:>12}{operations['reads']:>7}{commits:>9}{operations['writes']:>8}")
+            if read_trips > max_read_trips or commits != 1:
+                failures.append(f"{label}: {read_trips} read round trips, {commits} commits")
+            if "สมศรี" not in response.get("response", ""):
+                failures.append(f"{label}: greeting without the user's name")
+            if path == "/new_chat":
+                conversation = store.documents[f"conversations/{USER_ID}"]
+                if conversation.get("session_id") != response.get("session_id") or conversation.get("turn_count") != 1:
+                    failures.append(f"{label}: conversation not reset to the new session")
+
+    await job_queue.join()
+    await job_queue.stop()
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run()))
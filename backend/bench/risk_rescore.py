@@ -0,0 +1,167 @@
+"""🔹 Batch risk re-scoring benchmark (rescore_risk.py / ai.rescore)
+
+Seeds an in-memory Firestore with users, each with an open session (risk
+state on the conversation document) and archived sessions whose messages
+carry the risk signals, then re-scores them with the local stub model:
+- users/min and model calls/s at several concurrency levels under one rate
+  limit, with Firestore reads, queries and batch commits
+- every session gets a new level, and a second run gives the same levels
+- a run interrupted part way resumes from its checkpoint and finishes
+  without re-scoring the users before the checkpoint
+
+    python bench/risk_rescore.py
+    python bench/risk_rescore.py --users 500 --sessions 3 --rate 50 --levels 1,8,32
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from ai.ids import ulid_at  # noqa: E402
+from ai.risk import update_risk_state  # noqa: E402
+from bench.fakes import FakeFirestore, install  # noqa: E402
+
+HEALTHY = ["ออกกำลังกายทุกวัน", "กินผักผลไม้ทุกมื้อ", "นอนวันละ 8 ชั่วโมง", "ความดันโลหิตสูงมีอาการอย่างไร"]
+RISKY = ["สูบบุหรี่วันละครึ่งซอง", "ชอบกินของทอดและน้ำอัดลม", "ช่วงนี้ปวดหัวบ่อย", "พ่อเป็นเบาหวาน"]
+OLD_LEVEL = {"red": "ระดับความเสี่ยง: **แดง (red)** เหตุผล: -", "green": "ระดับความเสี่ยง: **เขียว (green)** เหตุผล: -"}
+
+
+def seed(store, args, rng):
+    """Users with `args.sessions` archived sessions plus an open one; returns the number of sessions"""
+    started_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    sessions = 0
+    for u in range(args.users):
+        user_id = f"bench-user-{u:05d}"
+        for s in range(args.sessions + 1):
+            session_time = started_at + timedelta(days=s, minutes=u)
+            session_id = str(int(session_time.timestamp() * 1000))
+            state = None
+            for seq in range(1, args.messages + 1):
+                query = rng.choice(RISKY if rng.random() < 0.2 else HEALTHY)
+                state, _ = update_risk_state(state, query)
+                message_id = ulid_at(int(session_time.timestamp() * 1000) + seq, f"{user_id}:{session_id}:{seq}")
+                store.documents[f"conversations/{user_id}/messages/{message_id}"] = {
+                    "id": message_id, "session_id": session_id, "seq": seq, "query": query,
+                    "response": "ความดันโลหิตสูงมักไม่มีอาการ", "timestamp": session_time + timedelta(seconds=seq),
+                }
+            level = OLD_LEVEL[rng.choice(["red", "green"])]
+            if s < args.sessions:
+                store.documents[f"conversations/{user_id}/sessions/{session_id}"] = {
+                    "session_id": session_id, "risk_level": level, "timestamp": session_time,
+                    "turn_count": args.messages,
+                }
+            else:
+                store.documents[f"conversations/{user_id}"] = {
+                    "session_id": session_id, "risk_state": state, "risk_level": level,
+                    "turn_count": args.messages, "recent": [],
+                }
+            sessions += 1
+    return sessions
+
+
+def levels(store):
+    return {path: data.get("risk_level") for path, data in store.documents.items()
+            if "/messages/" not in path and "risk_level" in data}
+
+
+async def run(args):
+    from ai.rescore import Rescorer, StubRiskModel
+    from ai.resources import set_resource
+
+    store = FakeFirestore(latency=args.firestore_latency)
+    install(firestore=store)
+    model = StubRiskModel(args.model_latency)
+    set_resource("genai_model", model)
+    sessions = seed(store, args, random.Random(args.seed))
+    checkpoint = os.path.join(tempfile.gettempdir(), "ncd-bench-rescore.json")
+    failures = []
+
+    print(f"{args.users} users, {sessions} sessions, stub model {args.model_latency}s, rate {args.rate}/s")
+    print(f"{'concurrency':>12}{'seconds':>9}{'users/min':>11}{'calls/s':>9}{'queries':>9}{'reads':>8}{'commits':>9}")
+    results = []
+    first_report = None
+    for level in [int(x) for x in args.levels.split(",")]:
+        store.reset_counters()
+        calls = model.calls
+        rescorer = Rescorer("all", concurrency=level, rate=args.rate, checkpoint_file=None)
+        started = time.perf_counter()
+        report = await rescorer.run()
+        elapsed = time.perf_counter() - started
+        operations = store.operations["other"]
+        calls_per_second = (model.calls - calls) / elapsed
+        print(f"{level:>12}{elapsed:>9.2f}{report['users_per_minute']:>11.0f}{calls_per_second:>9.1f}"
+              f"{operations['queries']:>9}{operations['reads']:>8}{operations['commits']:>9}")
+        results.append(levels(store))
+        if first_report is None:
+            first_report = report
+        if report["users"] != args.users or report["sessions"] != sessions:
+            failures.append(f"concurrency {level}: re-scored {report['users']} users / {report['sessions']} sessions")
+        # The bucket starts full, so allow one burst on top of the rate
+        if model.calls - calls > args.rate * elapsed + max(1, int(args.rate)) + 1:
+            failures.append(f"concurrency {level}: {calls_per_second:.1f} calls/s exceeds the {args.rate}/s limit")
+
+    print(f"first run: {first_report['unchanged']} levels unchanged, {first_report['to_red']} green→red, "
+          f"{first_report['to_green']} red→green")
+    if any(result != results[0] for result in results):
+        failures.append("runs over the same data gave different levels")
+    if any(OLD_LEVEL["red"] == value or OLD_LEVEL["green"] == value for value in results[0].values()):
+        failures.append("some sessions kept their old level text")
+
+    # Interrupt a run part way through, then resume it from the checkpoint
+    for path in list(store.documents):
+        if "/messages/" not in path and "risk_rescored_at" in store.documents[path]:
+            del store.documents[path]["risk_rescored_at"]
+    interrupted = Rescorer("all", concurrency=8, rate=args.rate, flush_interval=0.2, checkpoint_file=checkpoint)
+    interrupted.clear_checkpoint()
+    task = asyncio.create_task(interrupted.run())
+    calls = model.calls
+    while interrupted.cursor is None or interrupted.counts["users"] < args.users // 2:
+        await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    first_calls = model.calls - calls
+    resumed = Rescorer("all", concurrency=8, rate=args.rate, checkpoint_file=checkpoint)
+    loaded = resumed.load_checkpoint()
+    report = await resumed.run()
+    resumed.clear_checkpoint()
+    missing = [path for path, data in store.documents.items()
+               if "/messages/" not in path and "risk_rescored_at" not in data]
+    redone = first_calls + report["model_calls"] - sessions
+    print(f"interrupted after {interrupted.counts['users']} users (checkpoint {interrupted.cursor}); "
+          f"resumed for {resumed.run_users} more, {redone} sessions scored twice")
+    if not loaded or missing:
+        failures.append(f"resume left {len(missing)} documents without a new level")
+    if resumed.run_users >= args.users:
+        failures.append("the resumed run started over instead of at the checkpoint")
+
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=2, help="archived sessions per user")
+    parser.add_argument("--messages", type=int, default=6, help="user messages per session")
+    parser.add_argument("--levels", default="1,8,32", help="comma separated concurrency levels")
+    parser.add_argument("--rate", type=float, default=100.0, help="model calls per second")
+    parser.add_argument("--model-latency", type=float, default=0.1, help="seconds per stub call")
+    parser.add_argument("--firestore-latency", type=float, default=0.01, help="seconds per round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
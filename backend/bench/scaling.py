@@ -0,0 +1,100 @@
+"""🔹 Worker scaling benchmark
+
+Starts the fake-backed app (bench/fake_app.py) under gunicorn with each
+worker count in turn, loads /chat with the same concurrency and reports
+requests per second, speedup over one worker and scaling efficiency
+(speedup / workers). Exits 1 when the efficiency at the largest worker count
+is below --min-efficiency.
+
+    python bench/scaling.py
+    python bench/scaling.py --workers 1,2,4,8 --concurrency 64 --embed-cpu 0.02
+
+Embeddings burn CPU (--embed-cpu) so the run is CPU-bound the way real
+inference is; with more workers than cores the efficiency necessarily drops.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.load_chat import run_level  # noqa: E402
+
+
+def start_server(workers, port, args):
+    env = {
+        **os.environ,
+        "BENCH_LLM_LATENCY": str(args.llm_latency),
+        "BENCH_EMBED_CPU": str(args.embed_cpu),
+        # No Redis needed: load_chat numbers every message, so none hits a cache
+        "CACHE_BACKEND": "memory",
+        "ALLOW_LOCAL_BACKENDS": "true",
+    }
+    command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "bench.fake_app:app",
+               "--workers", str(workers), "--bind", f"127.0.0.1:{port}"]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client, url, timeout=60):
+    until = time.monotonic() + timeout
+    while time.monotonic() < until:
+        try:
+            if (await client.get(f"{url}/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not become ready")
+
+
+async def run(args):
+    levels = [int(x) for x in args.workers.split(",")]
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    results = {}
+    print(f"{'workers':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}{'speedup':>9}{'efficiency':>12}")
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        for workers in levels:
+            url = f"http://127.0.0.1:{args.port}"
+            server = start_server(workers, args.port, args)
+            try:
+                await wait_ready(client, url)
+                # Warm-up pass: first requests load the fakes and the keyword index
+                await run_level(client, url, args.concurrency, args.concurrency)
+                r = results[workers] = await run_level(client, url, args.concurrency, args.concurrency * args.requests)
+            finally:
+                server.terminate()
+                server.wait()
+            speedup = r["rps"] / results[levels[0]]["rps"] * levels[0]
+            r["efficiency"] = speedup / workers
+            print(f"{workers:>8}{r['rps']:>9.1f}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}{r['errors']:>8}"
+                  f"{speedup:>9.2f}{r['efficiency']:>12.2f}")
+
+    efficiency = results[levels[-1]]["efficiency"]
+    if efficiency < args.min_efficiency:
+        print(f"❌ {levels[-1]} workers scale at {efficiency:.2f}, below {args.min_efficiency}"
+              f" ({os.cpu_count()} CPUs here)")
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default=f"1,{max(2, (os.cpu_count() or 1))}", help="comma separated worker counts")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=8, help="requests per concurrent client")
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument("--embed-cpu", type=float, default=0.02, help="CPU seconds per query embedding")
+    parser.add_argument("--min-efficiency", type=float, default=0.7)
+    parser.add_argument("--port", type=int, default=8181)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
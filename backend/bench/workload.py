@@ -0,0 +1,196 @@
+"""🔹 Offline multi-user chat workload
+
+Drives the real FastAPI app in-process (httpx ASGI transport), with Gemini,
+Firestore, the embedder and Chroma replaced by the stand-ins in
+bench/fakes.py. Each simulated user opens a chat, sends a few messages,
+fetches one message and a page of history back and starts a new chat. The
+report gives p50/p95/p99 latency, RPS and Firestore operations per request
+for every endpoint. Save it as a baseline and compare later runs against it.
+
+    python bench/workload.py --users 50 --turns 6 --concurrency 25
+    python bench/workload.py --save bench/baseline.json
+    python bench/workload.py --compare bench/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fakes import FakeFirestore, FakeGenerativeModel, install, operation_label  # noqa: E402
+
+QUESTIONS = [
+    "ความดันโลหิตสูงมีอาการอย่างไร",
+    "เบาหวานป้องกันได้ไหม",
+    "ช่วงนี้ปวดหัวบ่อยและนอนไม่ค่อยหลับ",
+    "พ่อเป็นโรคหัวใจ ฉันมีความเสี่ยงไหม",
+    "สูบบุหรี่วันละครึ่งซอง",
+    "ออกกำลังกายสัปดาห์ละ 2 ครั้ง",
+    "ชอบกินอาหารรสเค็มและของทอด",
+    "น้ำตาลในเลือดเท่าไหร่ถึงเรียกว่าสูง",
+]
+
+FIRESTORE_OPERATIONS = ("reads", "writes", "commits", "queries")
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, label, request):
+        token = operation_label.set(label)
+        started = time.perf_counter()
+        try:
+            response = await request
+            if response.status_code >= 400:
+                self.errors[label] += 1
+            return response
+        except Exception:
+            self.errors[label] += 1
+        finally:
+            self.latencies[label].append(time.perf_counter() - started)
+            operation_label.reset(token)
+
+
+def latest_message_id(store, user_id):
+    prefix = f"conversations/{user_id}/messages/"
+    ids = [path[len(prefix):] for path, data in store.documents.items() if path.startswith(prefix) and "query" in data]
+    return max(ids) if ids else "missing"
+
+
+async def user_session(client, store, recorder, user_id, turns, rng):
+    await recorder.call("start_chat", client.get("/start_chat", params={"user_id": user_id}))
+    for _ in range(turns):
+        message = rng.choice(QUESTIONS)
+        await recorder.call("chat", client.post("/chat", json={"user_id": user_id, "message": message}))
+    message_id = latest_message_id(store, user_id)
+    await recorder.call("get_message", client.get("/get_message", params={"user_id": user_id, "message_id": message_id}))
+    await recorder.call("messages", client.get("/messages", params={"user_id": user_id, "limit": 10}))
+    await recorder.call("new_chat", client.get("/new_chat", params={"user_id": user_id}))
+
+
+async def run(args):
+    store = FakeFirestore(latency=args.firestore_latency)
+    model = FakeGenerativeModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second, seed=args.seed)
+    install(genai_model=model, firestore=store)
+
+    import main
+    from ai.jobs import job_queue
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rng = random.Random(args.seed)
+    plans = [(f"bench-user-{i}", random.Random(rng.random())) for i in range(args.users)]
+
+    async def session(user_id, user_rng):
+        async with semaphore:
+            await user_session(client, store, recorder, user_id, args.turns, user_rng)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(session(user_id, user_rng) for user_id, user_rng in plans))
+        elapsed = time.perf_counter() - started
+        # Risk analysis, archiving and notifications finish in the background
+        await job_queue.join()
+        await job_queue.stop()
+
+    endpoints = {}
+    for label, latencies in sorted(recorder.latencies.items()):
+        operations = store.operations.get(label, {})
+        endpoints[label] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[label],
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "rps": len(latencies) / elapsed,
+            **{f"firestore_{kind}_per_request": operations.get(kind, 0) / len(latencies) for kind in FIRESTORE_OPERATIONS},
+        }
+
+    # Background jobs run outside any request, so their operations land under "other"
+    background = store.operations.get("other", {})
+
+    return {
+        "config": vars(args).copy(),
+        "elapsed_s": elapsed,
+        "total_rps": sum(len(v) for v in recorder.latencies.values()) / elapsed,
+        "llm": {"calls": model.calls, "prompt_tokens": model.prompt_tokens, "completion_tokens": model.completion_tokens},
+        "endpoints": endpoints,
+        "background_firestore": {kind: background.get(kind, 0) for kind in FIRESTORE_OPERATIONS},
+    }
+
+
+def print_report(result, baseline=None):
+    print(
+        f"{result['config']['users']} users x {result['config']['turns']} turns in {result['elapsed_s']:.2f}s "
+        f"({result['total_rps']:.1f} req/s), LLM calls {result['llm']['calls']}, "
+        f"prompt tokens {result['llm']['prompt_tokens']}"
+    )
+    if result.get("background_firestore"):
+        ops = result["background_firestore"]
+        print(f"background jobs: {ops['reads']} reads, {ops['writes']} writes, {ops['commits']} commits")
+    header = f"{'endpoint':<12} {'reqs':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'rps':>7} {'reads':>6} {'writes':>6} {'commits':>7}"
+    print(header)
+    for label, stats in result["endpoints"].items():
+        print(
+            f"{label:<12} {stats['requests']:>5} {stats['errors']:>4} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+            f"{stats['p99_ms']:>8.1f} {stats['rps']:>7.1f} {stats['firestore_reads_per_request']:>6.2f} "
+            f"{stats['firestore_writes_per_request']:>6.2f} {stats['firestore_commits_per_request']:>7.2f}"
+        )
+        if baseline and label in baseline["endpoints"]:
+            before = baseline["endpoints"][label]
+            deltas = []
+            for key in ("p50_ms", "p95_ms", "rps", "firestore_reads_per_request", "firestore_commits_per_request"):
+                if before[key]:
+                    deltas.append(f"{key} {100.0 * (stats[key] - before[key]) / before[key]:+.1f}%")
+            print(f"{'':<12} vs baseline: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5, help="chat messages per user")
+    parser.add_argument("--concurrency", type=int, default=10, help="users active at the same time")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--firestore-latency", type=float, default=0.005, help="seconds per Firestore round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the result as JSON (e.g. a baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
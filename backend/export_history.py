@@ -0,0 +1,79 @@
+"""🔹 Export conversation history as NDJSON or CSV
+
+Streams archived sessions or individual messages, for one user, a list of
+users or every user matching a filter on conversations/{user_id}, straight to
+a file (or stdout) without loading the history into memory.
+
+    python export_history.py --user USER_ID --kind messages
+    python export_history.py --where risk_level == สูง --fields risk_level,timestamp --format csv -o high.csv
+    python export_history.py --users-file cohort.txt --kind sessions --concurrency 16
+
+Histories are read from the per-message layout; run migrate_conversations.py
+first on a database that still has `conversation` arrays.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from ai.history import EXPORT_CONCURRENCY, KINDS, export_stream
+
+
+def parse_value(text):
+    """Numbers and booleans in --where are compared as such, everything else as a string"""
+    if text in ("true", "false"):
+        return text == "true"
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", default="sessions", choices=list(KINDS))
+    parser.add_argument("--format", default="ndjson", choices=["ndjson", "csv"])
+    parser.add_argument("--user", action="append", help="user_id to export (repeatable)")
+    parser.add_argument("--users-file", help="file with one user_id per line")
+    parser.add_argument("--where", nargs=3, action="append", metavar=("FIELD", "OP", "VALUE"),
+                        help="filter users on their conversation document (repeatable)")
+    parser.add_argument("--fields", help="comma separated projection, e.g. risk_level,timestamp")
+    parser.add_argument("--concurrency", type=int, default=EXPORT_CONCURRENCY, help="users read at once")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    user_ids = list(args.user or [])
+    if args.users_file:
+        with open(args.users_file, encoding="utf-8") as f:
+            user_ids += [line.strip() for line in f if line.strip()]
+    if user_ids and args.where:
+        parser.error("--where selects users itself; do not combine it with --user/--users-file")
+    where = [[field, op, parse_value(value)] for field, op, value in args.where or []]
+
+    try:
+        chunks = export_stream(args.kind, args.format, user_ids=user_ids, where=where, fields=args.fields,
+                               concurrency=args.concurrency)
+    except ValueError as e:
+        parser.error(str(e))
+
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    started = time.perf_counter()
+    written = 0
+    try:
+        async for chunk in chunks:
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    # Progress goes to stderr so stdout stays a clean export
+    print(f"✅ Exported {args.kind} ({written / 1024:.0f} KiB) in {time.perf_counter() - started:.1f}s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
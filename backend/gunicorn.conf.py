@@ -0,0 +1,91 @@
+"""🔹 Multi-worker deployment: gunicorn -c gunicorn.conf.py main:app
+
+Each worker is a uvicorn event loop of its own, so /chat scales past one core.
+State that must agree across workers is shared, not per process:
+- CACHE_BACKEND=redis for the semantic caches, the per-user profile and
+  session caches and the turn gate (with the memory backend each worker
+  keeps its own, and another worker's writes stay unseen until the TTL)
+- JOB_BACKEND=firestore: background jobs are leased, so every worker resumes
+  them at startup but each one runs once, and /jobs/{id} answers from any
+  worker (with the memory backend only the worker that enqueued a job knows it)
+While either is still `memory`, workers default to 1 and gunicorn refuses to
+start more (ALLOW_LOCAL_BACKENDS=true overrides this for benchmarks).
+- RETRIEVAL_URL (optional) moves the embedder, reranker and Chroma into
+  retrieval_service.py. Without it each worker opens chroma_db_ncd read-only,
+  which is safe because reindex.py never writes to the active build, it
+  swaps in a new one
+- Prometheus samples go to files in PROMETHEUS_MULTIPROC_DIR and /metrics
+  merges every worker's. /health, /cache/stats and the LLM and turn-gate
+  counters in them are still those of the worker that answered
+"""
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from decouple import config
+
+# prometheus_client picks its multi-process mode when first imported (by ai.*
+# below), so the directory is set before anything else
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "ncd-prometheus")
+)
+os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+from ai.jobs import JOB_BACKEND  # noqa: E402
+from ai.semantic_cache import CACHE_BACKEND  # noqa: E402
+
+# Backends whose state is per process, so workers would not see each other's
+LOCAL_BACKENDS = [name for name, backend in (("CACHE_BACKEND", CACHE_BACKEND), ("JOB_BACKEND", JOB_BACKEND))
+                  if backend == "memory"]
+ALLOW_LOCAL_BACKENDS = config("ALLOW_LOCAL_BACKENDS", default=False, cast=bool)
+
+bind = config("BIND", default="0.0.0.0:8080")
+workers = config("WEB_CONCURRENCY", default=1 if LOCAL_BACKENDS else multiprocessing.cpu_count(), cast=int)
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = config("WORKER_TIMEOUT", default=120, cast=int)
+graceful_timeout = 30
+# Import main (and the shared models, below) once in the master; workers fork from it
+preload_app = True
+
+
+def on_starting(server):
+    # --workers on the command line overrides WEB_CONCURRENCY, so check what gunicorn will actually run
+    if server.cfg.workers > 1 and LOCAL_BACKENDS and not ALLOW_LOCAL_BACKENDS:
+        raise RuntimeError(
+            f"{server.cfg.workers} workers need shared backends, but {' and '.join(LOCAL_BACKENDS)} "
+            f"{'are' if len(LOCAL_BACKENDS) > 1 else 'is'} memory: set CACHE_BACKEND=redis and JOB_BACKEND=firestore, or run one worker"
+        )
+    # Samples of a previous run would be added to this one's
+    for name in os.listdir(PROMETHEUS_MULTIPROC_DIR):
+        path = os.path.join(PROMETHEUS_MULTIPROC_DIR, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def when_ready(server):
+    from ai.resources import preload_shared
+
+    preload_shared()
+    # Objects loaded so far are never freed: keep the collector from touching
+    # (and so copying) their pages in every worker
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from ai.llm import llm
+    from ai.resources import configure_worker_threads
+
+    # The Gemini quota and the CPU are split between the workers
+    llm.share_limits(server.cfg.workers)
+    configure_worker_threads(server.cfg.workers)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Its counters stay in the totals; only live-process gauges are dropped
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,192 @@
+"""🔹 Bulk ingestion into the NCD knowledge base (chroma_db_ncd)
+
+Streams text, markdown, PDF and JSONL documents through chunking and batched
+embedding, then upserts them into the same Chroma collection the chat uses.
+Chunk ids are content hashes, so re-ingesting unchanged material only costs
+the hashing: existing chunks are skipped before they are embedded.
+
+    python ingest.py knowledge/ --category diabetes
+    python ingest.py articles.jsonl --batch-size 128 --workers 4
+
+JSONL lines are {"text": "...", "metadata": {...}}; "page_content" is accepted
+in place of "text".
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from ai.resources import get_embeddings, get_vector_db
+
+SUPPORTED_EXTENSIONS = (".txt", ".md", ".pdf", ".jsonl")
+
+
+def iter_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def read_documents(path):
+    """Yield (text, metadata) for every document in a file"""
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".jsonl":
+        with open(path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                text = record.get("text") or record.get("page_content") or ""
+                metadata = {"source": path, "line": line_number, **record.get("metadata", {})}
+                yield text, metadata
+
+    elif extension == ".pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            print(f"❌ Skipping {path}: PDF ingestion requires the `pypdf` package")
+            return
+        for page_number, page in enumerate(PdfReader(path).pages, start=1):
+            yield page.extract_text() or "", {"source": path, "page": page_number}
+
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield f.read(), {"source": path}
+
+
+def iter_chunks(paths, splitter, category=None):
+    """Yield (chunk_id, text, metadata) with content-hash ids"""
+    for path in iter_files(paths):
+        for text, metadata in read_documents(path):
+            if category:
+                metadata.setdefault("category", category)
+            for chunk in splitter.split_text(text):
+                chunk = chunk.strip()
+                if chunk:
+                    chunk_id = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+                    yield chunk_id, chunk, dict(metadata)
+
+
+def iter_batches(chunks, size):
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def new_chunks_only(collection, batch):
+    """Drop chunks already stored (and duplicates within the batch)"""
+    unique = {}
+    for chunk_id, text, metadata in batch:
+        unique.setdefault(chunk_id, (chunk_id, text, metadata))
+    existing = set(collection.get(ids=list(unique), include=[])["ids"])
+    return [chunk for chunk_id, chunk in unique.items() if chunk_id not in existing]
+
+
+def init_worker(threads):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def embed_texts(texts):
+    return get_embeddings().embed_documents(texts)
+
+
+def upsert(collection, batch, vectors):
+    collection.upsert(
+        ids=[chunk_id for chunk_id, _, _ in batch],
+        documents=[text for _, text, _ in batch],
+        metadatas=[metadata for _, _, metadata in batch],
+        embeddings=vectors,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="files or directories to ingest")
+    parser.add_argument("--category", help="disease category stored in each chunk's metadata")
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1, help="processes used for embedding")
+    args = parser.parse_args()
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    collection = get_vector_db()._collection
+
+    pool = None
+    if args.workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // args.workers)
+        pool = ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(threads,),
+        )
+
+    seen = skipped = written = 0
+    started = time.perf_counter()
+    in_flight = deque()
+
+    def report():
+        elapsed = time.perf_counter() - started
+        rate = written / elapsed if elapsed else 0.0
+        print(f"🔹 {seen} chunks seen, {written} embedded, {skipped} unchanged ({rate:.1f} chunks/s)")
+
+    def drain(limit):
+        nonlocal written
+        while len(in_flight) > limit:
+            batch, future = in_flight.popleft()
+            upsert(collection, batch, future.result())
+            written += len(batch)
+            report()
+
+    try:
+        for batch in iter_batches(iter_chunks(args.paths, splitter, args.category), args.batch_size):
+            seen += len(batch)
+            new_batch = new_chunks_only(collection, batch)
+            skipped += len(batch) - len(new_batch)
+            if not new_batch:
+                continue
+
+            texts = [text for _, text, _ in new_batch]
+            if pool is None:
+                upsert(collection, new_batch, embed_texts(texts))
+                written += len(new_batch)
+                report()
+            else:
+                in_flight.append((new_batch, pool.submit(embed_texts, texts)))
+                drain(args.workers * 2)
+        drain(0)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"✅ Done in {elapsed:.1f}s: {written} chunks embedded, {skipped} unchanged, "
+        f"{written / elapsed if elapsed else 0.0:.1f} chunks/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
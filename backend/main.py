@@ -1,24 +1,32 @@
-from fastapi import FastAPI, HTTPException,Request
+from fastapi import Depends, FastAPI, Header, HTTPException,Query,Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from ai.converse import converse  
 from decouple import config
+import asyncio
+import json
 import logging
+import secrets
 import traceback
-from ai.converse import start_chat
-from ai.converse import new_chat 
-import firebase_admin
-from firebase_admin import credentials, firestore
-from ai.converse import get_specific_message
-from ai.converse import send_fcm_notification
-from ai.converse import get_user_name
-
-if not firebase_admin._apps:
-    cred = credentials.Certificate("firebase-adminsdk.json")  
-    firebase_admin.initialize_app(cred)
-
-db = firestore.client()  
+from ai.converse import (
+    ConversationContext,
+    converse,
+    converse_stream,
+    get_cache_stats,
+    get_messages,
+    get_specific_message,
+    new_chat,
+    save_streamed_turn,
+    start_chat,
+)
+from ai.history import export_stream, list_sessions
+from ai.jobs import job_queue
+from ai.llm import llm
+from ai.notifications import list_campaign_results, send_bulk_notification  # noqa: F401 (registers the bulk_notification job)
+from ai.metrics import export_metrics, server_timing_header, start_request_timing
+from ai.resources import readiness, warm_up
+from ai.turns import UserBusy, message_key, turn_gate
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,16 +41,98 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-BOT_NAME = config("NCD_NAME", default="Health Assistant")
+WARM_UP_ON_STARTUP = config("WARM_UP_ON_STARTUP", default=True, cast=bool)
+# Shared secret for the operator endpoints (exports, campaigns), sent as
+# X-Admin-Key; they answer 403 to everyone while it is unset
+ADMIN_API_KEY = config("ADMIN_API_KEY", default="")
+# The ids travel in the job record, which Firestore caps at 1 MiB; larger campaigns select users with `query`
+BULK_MAX_USER_IDS = config("BULK_MAX_USER_IDS", default=10000, cast=int)
+
+
+def is_admin(x_admin_key):
+    """🔹 Whether the X-Admin-Key header matches ADMIN_API_KEY (never while it is unset)"""
+    return bool(ADMIN_API_KEY and x_admin_key) and secrets.compare_digest(
+        x_admin_key.encode("utf-8"), ADMIN_API_KEY.encode("utf-8")
+    )
+
+
+def require_admin(x_admin_key: str | None = Header(None)):
+    """🔹 Dependency of the operator endpoints: the request must carry ADMIN_API_KEY"""
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="admin endpoints are disabled (ADMIN_API_KEY is not set)")
+    if not is_admin(x_admin_key):
+        raise HTTPException(status_code=403, detail="invalid admin key")
+
+
+@app.on_event("startup")
+async def warm_up_models():
+    """Load Firebase, the embedder, Chroma and Gemini before serving traffic"""
+    if WARM_UP_ON_STARTUP:
+        await asyncio.to_thread(warm_up)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Start the background workers (risk analysis, session archiving, notifications)"""
+    await job_queue.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_queue.stop()
 
 class ChatRequest(BaseModel):
     user_id: str  
     message: str
+    idempotency_key: str | None = None
+
+
+def user_busy_response():
+    # The app retries after a moment; the user's earlier message is still being answered
+    return JSONResponse(
+        content={"error": "A previous message is still being answered, please wait"},
+        status_code=429,
+        headers={"Retry-After": "2"}
+    )
+
+
+# Saves that must finish even when the request awaiting them is cancelled;
+# the set keeps the tasks referenced until they are done
+_detached_tasks = set()
+
+
+async def run_detached(coroutine):
+    """🔹 Await a coroutine that keeps running if the caller is cancelled"""
+    task = asyncio.ensure_future(coroutine)
+    _detached_tasks.add(task)
+    task.add_done_callback(_detached_tasks.discard)
+    await asyncio.shield(task)
+
+
+class TurnStreamingResponse(StreamingResponse):
+    """🔹 StreamingResponse that always closes its body iterator.
+
+    On a disconnect under ASGI spec 2.4 Starlette stops at the failed send,
+    leaving the generator suspended and skipping the background task; closing
+    the generator here runs its finally block right away instead of at
+    garbage collection.
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
 
 
 @app.post("/chat")
-def chat(request: ChatRequest):
-    """Receives a user ID and message from Flutter and returns an AI response."""
+async def chat(request: ChatRequest, http_request: Request):
+    """Receives a user ID and message from Flutter and returns an AI response.
+
+    Turns of one user run one at a time. A retry or double tap with the same
+    Idempotency-Key (header or body), or the same text while the first is
+    still running, gets the first request's answer instead of a second turn.
+    """
     user_id = request.user_id  
     user_message = request.message.strip()
 
@@ -52,8 +142,16 @@ def chat(request: ChatRequest):
             status_code=400
         )
 
+    timings = start_request_timing()
+    idempotency_key = http_request.headers.get("Idempotency-Key") or request.idempotency_key
+
     try:
-        ai_response = converse(user_id, user_message)
+        ai_response = await turn_gate.run(
+            user_id,
+            f"key:{idempotency_key}" if idempotency_key else message_key(user_message),
+            lambda: converse(user_id, user_message),
+            explicit=bool(idempotency_key)
+        )
 
         
         if not ai_response:
@@ -67,11 +165,19 @@ def chat(request: ChatRequest):
         if "risk_level" in ai_response and ai_response["risk_level"]:
             response_data["risk_level"] = ai_response["risk_level"]
 
+        if ai_response.get("risk_job_id"):
+            response_data["risk_job_id"] = ai_response["risk_job_id"]
+
         return JSONResponse(
             content=response_data,
-            headers={"Content-Type": "application/json; charset=utf-8"}
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+                "Server-Timing": server_timing_header(timings)
+            }
         )
 
+    except UserBusy:
+        return user_busy_response()
     except Exception as e:
         error_details = traceback.format_exc()
         logger.error(f"❌ Internal Server Error: {e}\n{error_details}")
@@ -81,6 +187,70 @@ def chat(request: ChatRequest):
             status_code=500
         )
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Streams the AI response to Flutter as Server-Sent Events.
+
+    Events: `token` ({"text"}) for each answer chunk, then `followup`
+    ({"question"}) and `risk` ({"risk_level"}) when available, then `done`.
+    The turn is saved to Firestore when the stream ends, including when the
+    client disconnects midway, and the user's next turn waits until then.
+    """
+    user_id = request.user_id
+    user_message = request.message.strip()
+
+    if not user_message:
+        return JSONResponse(
+            content={"error": "Message cannot be empty"},
+            status_code=400
+        )
+
+    try:
+        release_turn = await turn_gate.hold(user_id)
+    except UserBusy:
+        return user_busy_response()
+
+    try:
+        ctx = await ConversationContext.load(user_id)
+    except BaseException:
+        await release_turn()
+        raise
+    result = {}
+    finished = False
+
+    async def save_and_release():
+        # Runs from the stream's finally and again as the response's background
+        # task; only the first call saves, so the fallback is safe to repeat
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        try:
+            await save_streamed_turn(ctx, result)
+        finally:
+            await release_turn()
+
+    async def event_stream():
+        try:
+            async for event, data in converse_stream(ctx, user_message, result):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            error_details = traceback.format_exc()
+            logger.error(f"❌ Streaming Error: {e}\n{error_details}")
+            yield f"event: error\ndata: {json.dumps({'error': 'Internal server error'})}\n\n"
+        finally:
+            # A client disconnect cancels this generator (or closes it without
+            # running the background task), and the turn must still be saved
+            # and the user's lock released
+            await run_detached(save_and_release())
+
+    return TurnStreamingResponse(
+        event_stream(),
+        media_type="text/event-stream; charset=utf-8",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(save_and_release)
+    )
+
 @app.get("/start_chat")
 async def start_chat_route(request: Request):
     """🔹 เริ่มการสนทนา พร้อมแสดงชื่อผู้ใช้"""
@@ -88,17 +258,22 @@ async def start_chat_route(request: Request):
     if not user_id:
         return JSONResponse(content={"error": "user_id is required"}, status_code=400)
 
-    
-    user_name = get_user_name(user_id)
-
-    response_data = start_chat(user_id, user_name)
+    # ชื่อผู้ใช้อ่านพร้อมกับเอกสารการสนทนา (หรือจาก cache) ภายใน start_chat
+    # Queued behind a running chat turn like any other write to the conversation
+    try:
+        response_data = await turn_gate.run(user_id, "op:start_chat", lambda: start_chat(user_id))
+    except UserBusy:
+        return user_busy_response()
 
     return JSONResponse(content=response_data, media_type="application/json; charset=utf-8")
 
 
 @app.get("/new_chat")
-def reset_chat(user_id: str):
-    return new_chat(user_id)
+async def reset_chat(user_id: str):
+    try:
+        return await turn_gate.run(user_id, "op:new_chat", lambda: new_chat(user_id))
+    except UserBusy:
+        return user_busy_response()
 
 
 @app.get("/")
@@ -108,23 +283,107 @@ def read_root():
 @app.get("/health")
 def health_check():
     """✅ Health Check Endpoint"""
-    return {"status": "ok", "message": "Service is running"}
+    components = readiness()
+    # Gemini call counters and circuit state ("open" means answers are failing fast)
+    llm_stats = llm.stats()
+    if any(state.startswith("error") for state in components.values()):
+        return JSONResponse(
+            content={"status": "error", "message": "Some components failed to load", "components": components, "llm": llm_stats, "turns": turn_gate.stats()},
+            status_code=503
+        )
+    if all(state == "ready" for state in components.values()):
+        return {"status": "ok", "message": "Service is running", "components": components, "llm": llm_stats, "turns": turn_gate.stats()}
+    return {"status": "starting", "message": "Components load on first use", "components": components, "llm": llm_stats, "turns": turn_gate.stats()}
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, LLM tokens, cache hits"""
+    body, content_type = export_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit rate and saved latency of the retrieval and answer caches"""
+    return await get_cache_stats()
 
 
 @app.get("/get_message")
-def get_message_route(user_id: str, message_id: str):
+async def get_message_route(user_id: str, message_id: str):
     """🔹 ดึงข้อความเฉพาะจากประวัติการสนทนา"""
     if not user_id or not message_id:
         return JSONResponse(content={"error": "ต้องระบุ user_id และ message_id"}, status_code=400)
     
     try:
-        result = get_specific_message(user_id, message_id)
+        result = await get_specific_message(user_id, message_id)
         return JSONResponse(content=result, media_type="application/json; charset=utf-8")
     except Exception as e:
         error_details = traceback.format_exc()
         logger.error(f"❌ Error fetching specific message: {e}\n{error_details}")
         return JSONResponse(content={"error": f"ข้อผิดพลาดในการค้นหาข้อความ: {str(e)}"}, status_code=500)
 
+@app.get("/messages")
+async def list_messages_route(
+    user_id: str,
+    after: str | None = None,
+    before: str | None = None,
+    limit: int = 20,
+    session_id: str | None = None
+):
+    """🔹 ประวัติการสนทนาแบบแบ่งหน้า: ?after=<id> หน้าถัดไป, ?before=<id> ย้อนหลัง (ใหม่สุดก่อน)"""
+    if after and before:
+        return JSONResponse(content={"error": "ระบุได้อย่างใดอย่างหนึ่ง: after หรือ before"}, status_code=400)
+
+    try:
+        result = await get_messages(user_id, after=after, before=before, limit=limit, session_id=session_id)
+        return JSONResponse(content=result, media_type="application/json; charset=utf-8")
+    except Exception as e:
+        error_details = traceback.format_exc()
+        logger.error(f"❌ Error listing messages: {e}\n{error_details}")
+        return JSONResponse(content={"error": f"ข้อผิดพลาดในการดึงประวัติ: {str(e)}"}, status_code=500)
+
+
+@app.get("/history/sessions")
+async def history_sessions_route(user_id: str, cursor: str | None = None, limit: int = 50, fields: str | None = None):
+    """🔹 Archived sessions of a user, newest first; ?fields=risk_level,timestamp reads only those"""
+    try:
+        result = await list_sessions(user_id, cursor=cursor, limit=limit, fields=fields)
+        return JSONResponse(content=result, media_type="application/json; charset=utf-8")
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"❌ Error listing sessions: {e}\n{traceback.format_exc()}")
+        return JSONResponse(content={"error": f"ข้อผิดพลาดในการดึงประวัติ: {str(e)}"}, status_code=500)
+
+
+@app.get("/history/export", dependencies=[Depends(require_admin)])
+async def history_export_route(
+    kind: str = "sessions",
+    format: str = "ndjson",
+    user_id: list[str] | None = Query(None),
+    risk_level: str | None = None,
+    fields: str | None = None
+):
+    """🔹 Stream sessions or messages as NDJSON or CSV
+
+    For the given ?user_id=...&user_id=... or, without any, for every user
+    (optionally only those whose current risk_level matches). Operators
+    only: requires the X-Admin-Key header.
+    """
+    where = [["risk_level", "==", risk_level]] if risk_level and not user_id else None
+    try:
+        chunks = export_stream(kind, format, user_ids=user_id, where=where, fields=fields)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson; charset=utf-8"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{kind}.{format}"'}
+    )
+
+
 @app.post("/send_notification")
 async def send_notification(request: Request):
     data = await request.json()
@@ -136,21 +395,100 @@ async def send_notification(request: Request):
     if not all([user_id, title, body]):
         return JSONResponse(content={"error": "Missing required fields"}, status_code=400)
     
+    # A retried request with the same key does not send the notification twice
+    idempotency_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    
     try:
-        user_doc = db.collection("users").document(user_id).get()
-        if not user_doc.exists:
-            return JSONResponse(content={"error": "User not found"}, status_code=404)
-        
-        fcm_token = user_doc.to_dict().get("fcmToken")
-        if not fcm_token:
-            return JSONResponse(content={"error": "FCM token not found for user"}, status_code=404)
-        
-        result = send_fcm_notification(fcm_token, title, body, additional_data)
-        return JSONResponse(content={"success": result}, status_code=200)
+        job_id = await job_queue.enqueue(
+            "notification",
+            {"user_id": user_id, "title": title, "body": body, "data": additional_data},
+            ordering_key=user_id,
+            idempotency_key=idempotency_key
+        )
+        # Same 200 {"success"} contract as before the send was queued; poll /jobs/{job_id} for delivery
+        return JSONResponse(content={"success": True, "job_id": job_id}, status_code=200)
     except Exception as e:
-        logger.error(f"Error sending notification: {e}")
+        logger.error(f"Error queueing notification: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+
+@app.post("/notifications/bulk", dependencies=[Depends(require_admin)])
+async def send_bulk_notification_route(request: Request):
+    """🔹 Queue one notification for many users
+
+    Body: title, body, optional data, and either `user_ids` (list) or
+    `query` ({"where": [[field, op, value], ...], "limit": n}) over users.
+    Operators only: requires the X-Admin-Key header. Poll /jobs/{job_id}
+    for the counts, and page /notifications/bulk/{job_id}/results for each
+    user's outcome once it is done. A campaign is sent at most once: if it is interrupted it
+    is marked failed rather than sent again.
+    """
+    data = await request.json()
+    title = data.get("title")
+    body = data.get("body")
+    user_ids = data.get("user_ids")
+    query = data.get("query")
+
+    if not all([title, body]) or (user_ids is None and query is None):
+        return JSONResponse(content={"error": "title, body and user_ids or query are required"}, status_code=400)
+    if user_ids is not None and not isinstance(user_ids, list):
+        return JSONResponse(content={"error": "user_ids must be a list"}, status_code=400)
+    if user_ids is not None and len(user_ids) > BULK_MAX_USER_IDS:
+        return JSONResponse(
+            content={"error": f"at most {BULK_MAX_USER_IDS} user_ids per campaign; select more users with query"},
+            status_code=400
+        )
+
+    idempotency_key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+
+    try:
+        job_id = await job_queue.enqueue(
+            "bulk_notification",
+            {"title": title, "body": body, "data": data.get("data", {}), "user_ids": user_ids, "query": query},
+            # Campaigns run one after another so they share the FCM concurrency budget
+            ordering_key="notifications:bulk",
+            idempotency_key=idempotency_key
+        )
+        return JSONResponse(content={"job_id": job_id}, status_code=202)
+    except Exception as e:
+        logger.error(f"Error queueing bulk notification: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@app.get("/notifications/bulk/{job_id}/results", dependencies=[Depends(require_admin)])
+async def bulk_notification_results_route(job_id: str, cursor: str | None = None, limit: int = 500, status: str | None = None):
+    """🔹 Per-user outcomes of a campaign (sent, failed, invalid_token, no_token), in pages"""
+    try:
+        result = await list_campaign_results(job_id, cursor=cursor, limit=limit, status=status)
+        return JSONResponse(content=result, media_type="application/json; charset=utf-8")
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"❌ Error listing campaign results: {e}\n{traceback.format_exc()}")
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, user_id: str | None = None, x_admin_key: str | None = Header(None)):
+    """Status of a background job: queued, running, done or failed, with its result
+
+    Only for the user the job belongs to (?user_id=, e.g. a risk job from
+    /chat) or an operator with X-Admin-Key. Job ids derived from an
+    idempotency key can be worked out, so the id alone is not enough; any
+    other caller gets the same 404 as for an unknown id.
+    """
+    job = await job_queue.get(job_id)
+    owner = (job or {}).get("payload", {}).get("user_id")
+    if not job or not (is_admin(x_admin_key) or (user_id and user_id == owner)):
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return JSONResponse(
+        content={key: job.get(key) for key in ("id", "kind", "status", "attempts", "result", "error")},
+        media_type="application/json; charset=utf-8"
+    )
+
 if __name__ == '__main__':
+    # Single process, for development. Production runs several workers (with
+    # shared cache and job backends, see gunicorn.conf.py):
+    #   gunicorn -c gunicorn.conf.py main:app
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8080)
+    uvicorn.run(app, host=config("HOST", default="127.0.0.1"), port=config("PORT", default=8080, cast=int))
@@ -0,0 +1,170 @@
+"""🔹 One-shot migration to the per-turn message layout
+
+Moves every entry of the legacy `conversation` array, on conversations/{user_id}
+and on its archived sessions/{session_id}, into its own document under
+conversations/{user_id}/messages. It then sets `turn_count`/`recent` on the
+parent and drops the array. Messages are keyed by ULIDs built from the time
+each entry was written (the old id is kept as `legacy_id` for /get_message).
+The ids are deterministic, so the script can be re-run safely after an
+interruption.
+
+    python migrate_conversations.py --dry-run
+    python migrate_conversations.py [--user USER_ID]
+"""
+import argparse
+import asyncio
+import time
+
+from firebase_admin import firestore
+
+from ai.converse import RECENT_WINDOW, new_session_id
+from ai.ids import ulid_at
+from ai.resources import get_db
+
+# Firestore allows 500 writes per batch
+BATCH_LIMIT = 450
+
+
+class BatchWriter:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.batch = get_db().batch()
+        self.pending = 0
+        self.written = 0
+
+    async def set(self, ref, data):
+        self.batch.set(ref, data)
+        await self._count()
+
+    async def update(self, ref, data):
+        self.batch.update(ref, data)
+        await self._count()
+
+    async def _count(self):
+        self.pending += 1
+        if self.pending >= BATCH_LIMIT:
+            await self.flush()
+
+    async def flush(self):
+        if self.pending and not self.dry_run:
+            await self.batch.commit()
+        self.written += self.pending
+        self.batch = get_db().batch()
+        self.pending = 0
+
+
+def legacy_millis(entry, session_id, seq):
+    """When a legacy entry was written: from its `{user_id}_{ms}` id, else from the session id"""
+    suffix = str(entry.get("id", "")).rsplit("_", 1)[-1]
+    if suffix.isdigit():
+        return int(suffix)
+    # Session ids are millisecond timestamps; seq keeps the entries in order
+    return int(session_id) + seq if str(session_id).isdigit() else int(time.time() * 1000)
+
+
+async def stage_messages(writer, doc_ref, entries, session_id):
+    """Write one message document per entry; returns the entries as stored (ULID ids, seq)"""
+    migrated = []
+    for seq, entry in enumerate(entries, start=1):
+        # Re-keyed as ULIDs so migrated history pages in order with new messages;
+        # the seed makes a re-run write the same documents
+        message_id = ulid_at(legacy_millis(entry, session_id, seq), f"{doc_ref.id}:{session_id}:{seq}")
+        data = {**entry, "id": message_id, "session_id": session_id, "seq": seq}
+        if entry.get("id"):
+            data["legacy_id"] = entry["id"]
+        await writer.set(doc_ref.collection("messages").document(message_id), data)
+        migrated.append(data)
+    return migrated
+
+
+def rekey_recent(recent, migrated):
+    """`recent` entries that still carry legacy ids, pointed at their message documents"""
+    by_legacy_id = {entry["legacy_id"]: entry for entry in migrated if entry.get("legacy_id")}
+    rekeyed = []
+    for entry in recent:
+        match = by_legacy_id.get(entry.get("id"))
+        rekeyed.append({**entry, "id": match["id"], "seq": match["seq"]} if match else entry)
+    return rekeyed
+
+
+def window_entry(data):
+    """A message document as it is kept in `recent` (without the per-message fields)"""
+    return {key: value for key, value in data.items() if key not in ("session_id", "legacy_id")}
+
+
+async def migrate_user(doc, writer):
+    doc_ref = doc.reference
+    data = doc.to_dict() or {}
+    migrated = 0
+
+    async for session in doc_ref.collection("sessions").stream():
+        session_data = session.to_dict() or {}
+        entries = session_data.get("conversation")
+        if not entries:
+            continue
+        await stage_messages(writer, doc_ref, entries, session_data.get("session_id") or session.id)
+        await writer.update(session.reference, {
+            "turn_count": len(entries),
+            "conversation": firestore.DELETE_FIELD
+        })
+        migrated += len(entries)
+
+    entries = data.get("conversation")
+    if entries is not None:
+        session_id = data.get("session_id") or new_session_id()
+        staged = await stage_messages(writer, doc_ref, entries, session_id)
+
+        update_data = {"session_id": session_id, "conversation": firestore.DELETE_FIELD}
+        # Documents touched after the new layout shipped already count their newer turns,
+        # but their window may still hold legacy entries
+        if "turn_count" not in data:
+            update_data["turn_count"] = len(entries)
+            update_data["recent"] = [window_entry(entry) for entry in staged[-RECENT_WINDOW:]]
+        elif data.get("recent"):
+            update_data["recent"] = rekey_recent(data["recent"], staged)
+        # Summary coverage is tracked by seq; legacy ids do not order against ULIDs
+        summary_upto = data.get("summary_upto")
+        summarized = next((entry for entry in staged if summary_upto and entry.get("legacy_id") == summary_upto), None)
+        if summarized and "summary_seq" not in data:
+            update_data["summary_seq"] = summarized["seq"]
+            update_data["summary_upto"] = firestore.DELETE_FIELD
+        await writer.update(doc_ref, update_data)
+        migrated += len(entries)
+
+    return migrated
+
+
+async def conversation_documents(user_id=None):
+    if user_id:
+        yield await get_db().collection("conversations").document(user_id).get()
+        return
+    async for doc in get_db().collection("conversations").stream():
+        yield doc
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", help="only migrate this user_id")
+    parser.add_argument("--dry-run", action="store_true", help="count the work without writing anything")
+    args = parser.parse_args()
+
+    writer = BatchWriter(args.dry_run)
+    users = 0
+    messages = 0
+
+    async for doc in conversation_documents(args.user):
+        if not doc.exists:
+            continue
+        migrated = await migrate_user(doc, writer)
+        if migrated:
+            users += 1
+            messages += migrated
+            print(f"✅ {doc.id}: {migrated} messages")
+
+    await writer.flush()
+    mode = "would write" if args.dry_run else "wrote"
+    print(f"Migrated {users} users / {messages} messages ({mode} {writer.written} documents)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
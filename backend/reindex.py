@@ -0,0 +1,152 @@
+"""🔹 Rebuild the knowledge base (chroma_db_ncd) for another embedding model
+
+Re-embeds every chunk of the live store into a new build directory next to
+it, checks the build, then swaps it in by renaming a symlink over CHROMA_DIR,
+so readers always see either the old or the new store, never a half-built
+one. Earlier builds stay on disk for rollback.
+
+    python reindex.py --model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2
+    python reindex.py --model sentence-transformers/paraphrase-multilingual-mpnet-base-v2 --backend onnx-int8 --threads 4
+    python reindex.py --list
+    python reindex.py --activate legacy
+
+The first swap turns a plain chroma_db_ncd directory into the "legacy" build.
+Running servers keep the store and model they loaded; restart them to pick up
+the new build (the query model follows the store's embedding.json unless
+EMBEDDING_MODEL is set).
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+from ai.resources import (
+    CHROMA_DIR, EMBEDDING_BACKEND, EMBEDDING_BATCH_SIZE, EMBEDDING_THREADS, INDEX_INFO_FILE,
+    create_embeddings, read_index_info
+)
+from ingest import iter_batches, upsert
+
+LINK_PATH = os.path.abspath(CHROMA_DIR.rstrip("/"))
+BUILDS_DIR = f"{LINK_PATH}.builds"
+READ_PAGE_SIZE = 1000
+
+
+def open_collection(directory):
+    from langchain_chroma import Chroma
+
+    # Vectors are supplied explicitly, so the store needs no embedding function
+    return Chroma(persist_directory=directory)._collection
+
+
+def iter_chunks(collection):
+    """Yield (chunk_id, text, metadata) for every chunk, a page at a time"""
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=READ_PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            return
+        for chunk_id, text, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            yield chunk_id, text, metadata or {}
+        offset += len(page["ids"])
+
+
+def build(model, backend, threads, batch_size):
+    """🔹 Embed the live store's chunks with `model` into a new build directory"""
+    slug = re.sub(r"[^A-Za-z0-9.-]+", "-", model.rsplit("/", 1)[-1])
+    build_dir = os.path.join(BUILDS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}")
+    os.makedirs(build_dir)
+
+    source = open_collection(CHROMA_DIR)
+    target = open_collection(build_dir)
+    embeddings = create_embeddings(model, backend=backend, threads=threads, batch_size=batch_size)
+
+    total = source.count()
+    written = 0
+    dimension = None
+    started = time.perf_counter()
+    for batch in iter_batches(iter_chunks(source), batch_size):
+        vectors = embeddings.embed_documents([text for _, text, _ in batch])
+        dimension = dimension or len(vectors[0])
+        upsert(target, batch, vectors)
+        written += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f"🔹 {written}/{total} chunks embedded ({written / elapsed if elapsed else 0.0:.1f} chunks/s)")
+
+    if target.count() != total:
+        raise RuntimeError(f"build has {target.count()} chunks, the live store {total}")
+    if total:
+        # The first chunk must come back as its own nearest neighbour
+        chunk_id, text, _ = next(iter_chunks(target))
+        found = target.query(query_embeddings=[embeddings.embed_query(text)], n_results=1, include=[])
+        if found["ids"][0] != [chunk_id]:
+            raise RuntimeError("build failed the self-retrieval check")
+
+    info = {
+        "model": model,
+        "dimension": dimension,
+        "chunks": total,
+        "built_with_backend": backend,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    with open(os.path.join(build_dir, INDEX_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    print(f"✅ Built {build_dir} in {time.perf_counter() - started:.1f}s")
+    return build_dir
+
+
+def activate(build_dir):
+    """🔹 Point CHROMA_DIR at build_dir with a single atomic rename"""
+    if os.path.isdir(LINK_PATH) and not os.path.islink(LINK_PATH):
+        # One-time conversion of the original plain directory into a build
+        os.makedirs(BUILDS_DIR, exist_ok=True)
+        os.rename(LINK_PATH, os.path.join(BUILDS_DIR, "legacy"))
+
+    temporary = f"{LINK_PATH}.swap-{os.getpid()}"
+    os.symlink(os.path.relpath(build_dir, os.path.dirname(LINK_PATH)), temporary)
+    os.replace(temporary, LINK_PATH)
+    print(f"✅ {CHROMA_DIR} -> {build_dir} ({read_index_info(build_dir)['model']})")
+
+
+def list_builds():
+    active = os.path.realpath(LINK_PATH)
+    names = sorted(os.listdir(BUILDS_DIR)) if os.path.isdir(BUILDS_DIR) else []
+    if not names:
+        print(f"No builds yet; {CHROMA_DIR} is a plain directory ({read_index_info(LINK_PATH)['model']})")
+    for name in names:
+        path = os.path.join(BUILDS_DIR, name)
+        info = read_index_info(path)
+        marker = "*" if os.path.realpath(path) == active else " "
+        print(f"{marker} {name:<45} {info.get('model')}  {info.get('chunks', '?')} chunks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="sentence-transformers model name or local path")
+    parser.add_argument("--backend", default=EMBEDDING_BACKEND, choices=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--threads", type=int, default=EMBEDDING_THREADS)
+    parser.add_argument("--batch-size", type=int, default=max(EMBEDDING_BATCH_SIZE, 64))
+    parser.add_argument("--no-swap", action="store_true", help="build only; activate later with --activate")
+    parser.add_argument("--activate", metavar="BUILD", help="switch to an existing build (e.g. to roll back)")
+    parser.add_argument("--list", action="store_true", help="list builds; * marks the active one")
+    args = parser.parse_args()
+
+    if args.list:
+        list_builds()
+    elif args.activate:
+        build_dir = os.path.join(BUILDS_DIR, args.activate)
+        if not os.path.isdir(build_dir):
+            parser.error(f"no build named {args.activate} in {BUILDS_DIR}")
+        activate(build_dir)
+    elif args.model:
+        build_dir = build(args.model, args.backend, args.threads, args.batch_size)
+        if args.no_swap:
+            print(f"🔹 Activate with: python reindex.py --activate {os.path.basename(build_dir)}")
+        else:
+            activate(build_dir)
+    else:
+        parser.error("one of --model, --activate or --list is required")
+
+
+if __name__ == "__main__":
+    main()
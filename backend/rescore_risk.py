@@ -0,0 +1,80 @@
+"""🔹 Re-score every user's risk level with the current classification prompt
+
+Risk levels are only classified during a chat, so after the prompt or the
+criteria in ai.converse.analyze_risk change, stored levels go stale. This
+re-classifies the open session (conversations/{user_id}) and the archived
+sessions (sessions/{session_id}) of every user, a page of users at a time,
+with bounded concurrency and a Gemini rate limit of its own, and writes the
+results back in batches.
+
+    python rescore_risk.py --model stub --dry-run
+    python rescore_risk.py --scope all --concurrency 8 --rate 4
+    python rescore_risk.py --user USER_ID --scope current
+
+Progress is checkpointed to RESCORE_CHECKPOINT_FILE after every batch; run
+the same command again to resume an interrupted run (--restart starts over).
+`--model stub` answers from a local deterministic stand-in instead of
+Gemini, for rehearsals and reproducible comparisons. Archived sessions are
+rebuilt from the per-message layout; run migrate_conversations.py first on a
+database that still has `conversation` arrays.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from ai.rescore import (
+    RESCORE_CHECKPOINT_FILE, RESCORE_CONCURRENCY, RESCORE_RATE, SCOPES, Rescorer, StubRiskModel
+)
+from ai.resources import set_resource
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scope", default="all", choices=SCOPES)
+    parser.add_argument("--user", action="append", help="only re-score this user_id (repeatable, no checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=RESCORE_CONCURRENCY, help="users scored at once")
+    parser.add_argument("--rate", type=float, default=RESCORE_RATE, help="Gemini calls per second")
+    parser.add_argument("--model", default="gemini", choices=["gemini", "stub"])
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="seconds per stub call")
+    parser.add_argument("--checkpoint", default=RESCORE_CHECKPOINT_FILE)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first user")
+    parser.add_argument("--dry-run", action="store_true", help="classify without writing anything (or a checkpoint)")
+    args = parser.parse_args()
+
+    if args.model == "stub":
+        set_resource("genai_model", StubRiskModel(args.stub_latency))
+
+    rescorer = Rescorer(args.scope, concurrency=args.concurrency, rate=args.rate,
+                        checkpoint_file=None if args.user or args.dry_run else args.checkpoint, dry_run=args.dry_run)
+    if args.restart:
+        rescorer.clear_checkpoint()
+    try:
+        if rescorer.load_checkpoint():
+            print(f"Resuming after {rescorer.cursor} ({rescorer.counts['users']} users done)")
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        report = await rescorer.run(args.user)
+    except Exception as e:
+        print(f"❌ Re-score stopped: {e}; run the same command again to resume after {rescorer.cursor}")
+        sys.exit(1)
+
+    if not args.user and not args.dry_run:
+        rescorer.clear_checkpoint()
+    mode = "would write" if args.dry_run else "wrote"
+    print(f"Re-scored {report['users']} users / {report['sessions']} sessions in {report['seconds']}s "
+          f"({report['users_per_minute']} users/min, {report['model_calls']} model calls, {mode} {report['writes']} documents)")
+    print(f"levels: {report['unchanged']} unchanged, {report['to_red']} green→red, "
+          f"{report['to_green']} red→green, {report['new']} without a previous level")
+    if report["failed_users"]:
+        print(f"⚠️ {report['failed']} users could not be classified; retry them with --user: "
+              f"{json.dumps(report['failed_users'][:20])}{' ...' if report['failed'] > 20 else ''}")
+    if report["stale_users"]:
+        print(f"⚠️ {report['stale']} users chatted during the run and were skipped; re-score them with --user: "
+              f"{json.dumps(report['stale_users'][:20])}{' ...' if report['stale'] > 20 else ''}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+"""🔹 Retrieval service: one process owns the embedder, the reranker and Chroma
+
+API workers started with RETRIEVAL_URL pointing here send it their query
+embeddings and retrievals instead of each loading the models (hundreds of MB
+per worker) and opening the Chroma store.
+
+    python -m uvicorn retrieval_service:app --host 127.0.0.1 --port 8090
+    RETRIEVAL_URL=http://127.0.0.1:8090 gunicorn -c gunicorn.conf.py main:app
+
+Run it with a single worker: requests from all API workers are embedded in
+one thread pool, and concurrent /embed calls are batched together.
+"""
+import asyncio
+from typing import List, Optional
+
+from decouple import config
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from ai.resources import RERANK_MODEL, RETRIEVAL_URL, get_embeddings, get_reranker, get_vector_db
+from ai.retrieval import (
+    HYBRID_RETRIEVAL, RETRIEVAL_BUDGET_MS, RETRIEVAL_K, get_keyword_index, retrieval_executor, retrieve
+)
+
+# Wait this long for other /embed calls to share a model batch; 0 embeds each call on its own
+EMBED_BATCH_WINDOW_MS = config("EMBED_BATCH_WINDOW_MS", default=2, cast=float)
+EMBED_MAX_BATCH = config("EMBED_MAX_BATCH", default=32, cast=int)
+
+if RETRIEVAL_URL:
+    # The service would forward every retrieval to itself
+    raise RuntimeError("retrieval_service must run without RETRIEVAL_URL")
+
+app = FastAPI()
+_pending = []
+_flush_task = None
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+    query: bool = True
+
+
+class RetrieveRequest(BaseModel):
+    query: str
+    vector: Optional[List[float]] = None
+    k: int = RETRIEVAL_K
+    category: Optional[str] = None
+    hybrid: bool = HYBRID_RETRIEVAL
+    use_reranker: bool = bool(RERANK_MODEL)
+    budget_ms: float = RETRIEVAL_BUDGET_MS
+
+
+def _embed(texts, query):
+    embeddings = get_embeddings()
+    if query and len(texts) == 1:
+        return [embeddings.embed_query(texts[0])]
+    # The bundled sentence-transformers models use no query prefix, so a
+    # batch of queries embeds the same as one query at a time
+    return embeddings.embed_documents(texts)
+
+
+async def _flush():
+    global _flush_task
+    await asyncio.sleep(EMBED_BATCH_WINDOW_MS / 1000)
+    batch, _pending[:] = _pending[:EMBED_MAX_BATCH], _pending[EMBED_MAX_BATCH:]
+    _flush_task = asyncio.create_task(_flush()) if _pending else None
+
+    texts = [text for texts, _ in batch for text in texts]
+    loop = asyncio.get_running_loop()
+    try:
+        vectors = await loop.run_in_executor(retrieval_executor, _embed, texts, True)
+    except Exception as e:
+        for _, future in batch:
+            future.set_exception(e)
+        return
+    offset = 0
+    for texts, future in batch:
+        future.set_result(vectors[offset:offset + len(texts)])
+        offset += len(texts)
+
+
+async def embed_batched(texts):
+    """Queue query texts for the next model batch"""
+    global _flush_task
+    future = asyncio.get_running_loop().create_future()
+    _pending.append((texts, future))
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush())
+    return await future
+
+
+@app.on_event("startup")
+async def warm_up_retrieval():
+    """Load everything up front; the first chat must not pay for it"""
+    def load():
+        get_embeddings()
+        get_vector_db()
+        get_keyword_index()
+        if RERANK_MODEL:
+            get_reranker()
+        print("✅ Retrieval service ready")
+
+    await asyncio.to_thread(load)
+
+
+@app.get("/health")
+def health_check():
+    return {"status": "ok"}
+
+
+@app.post("/embed")
+async def embed(request: EmbedRequest):
+    try:
+        if request.query and EMBED_BATCH_WINDOW_MS > 0:
+            vectors = await embed_batched(request.texts)
+        else:
+            loop = asyncio.get_running_loop()
+            vectors = await loop.run_in_executor(retrieval_executor, _embed, request.texts, request.query)
+        return {"vectors": [[float(value) for value in vector] for vector in vectors]}
+    except Exception as e:
+        print(f"❌ Embedding failed: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@app.post("/retrieve")
+async def retrieve_chunks(request: RetrieveRequest):
+    try:
+        vector = request.vector
+        if vector is None:
+            vector = (await embed_batched([request.query]))[0]
+        chunks = await retrieve(
+            request.query, vector, k=request.k, category=request.category, hybrid=request.hybrid,
+            use_reranker=request.use_reranker, budget_ms=request.budget_ms
+        )
+        return {"chunks": chunks}
+    except Exception as e:
+        print(f"❌ Retrieval failed: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=500)
@@ -0,0 +1,40 @@
+"""🔹 Shared fixtures: the backend wired to the in-memory stand-ins of bench.fakes"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.fakes import FakeFirestore, FakeGenerativeModel, install  # noqa: E402
+
+
+@pytest.fixture
+def store():
+    """A fresh fake Firestore (no latency) installed with the other stand-ins"""
+    store = FakeFirestore(latency=0)
+    install(genai_model=FakeGenerativeModel(latency=0), firestore=store)
+    return store
+
+
+@pytest.fixture
+def run(store):
+    """Run a coroutine on its own event loop with empty per-user caches, then drain the job workers"""
+    from ai.jobs import job_queue
+    from ai.user_cache import profile_cache, session_cache
+
+    def runner(coroutine):
+        async def main():
+            await session_cache.clear()
+            await profile_cache.clear()
+            try:
+                return await coroutine
+            finally:
+                await job_queue.join()
+                await job_queue.stop()
+
+        return asyncio.run(main())
+
+    return runner
@@ -0,0 +1,149 @@
+import httpx
+
+from ai.converse import (
+    ConversationContext, SUMMARY_BATCH_TURNS, SUMMARY_KEEP_TURNS, converse, get_conversation_history, new_chat, start_chat,
+    summary_coverage, unsummarized_turns
+)
+from ai.ids import new_ulid
+from ai.user_cache import session_cache
+from bench.fakes import operation_label
+
+
+def saved_turns(store, user_id):
+    prefix = f"conversations/{user_id}/messages/"
+    return [data for path, data in store.documents.items() if path.startswith(prefix) and "query" in data]
+
+
+def test_chat_turn_reads_once_and_commits_once(store, run):
+    import main
+
+    async def scenario():
+        await start_chat("u1")
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            await client.post("/chat", json={"user_id": "u1", "message": "ความดันโลหิตสูงมีอาการอย่างไร"})
+            store.reset_counters()
+            token = operation_label.set("chat")
+            try:
+                response = await client.post("/chat", json={"user_id": "u1", "message": "สูบบุหรี่วันละครึ่งซอง"})
+            finally:
+                operation_label.reset(token)
+        return response
+
+    response = run(scenario())
+    assert response.status_code == 200
+    # Background jobs (risk, summary) run in their own context and are not counted here
+    operations = store.operations["chat"]
+    assert operations["reads"] == 1
+    assert operations["commits"] == 1
+    assert operations["queries"] == 0
+
+
+def test_summary_coverage_finds_legacy_id_in_window():
+    legacy_id = "u1_1700000000002"
+    window = [
+        {"id": legacy_id, "query": "q", "response": "a", "seq": 3},
+        {"id": new_ulid(), "query": "q", "response": "a", "seq": 4},
+        {"id": new_ulid(), "query": "q", "response": "a", "seq": 5},
+    ]
+    # Legacy ids sort above ULIDs, so comparing ids would call the newer turns covered
+    assert legacy_id > window[1]["id"]
+    data = {"recent": window, "turn_count": 5, "summary": "s", "summary_upto": legacy_id}
+    assert summary_coverage(data, window) == 3
+
+    ctx = ConversationContext("u1", None, True, data)
+    assert [entry["seq"] for entry in unsummarized_turns(ctx)] == [4, 5]
+
+    assert summary_coverage({"summary_seq": 4}, window) == 4
+    # Once the summarised turn has left the window, every turn still in it is newer
+    assert summary_coverage({"summary_upto": "u1_1600000000000"}, window) == 0
+
+
+def test_summary_keeps_up_after_migrating_from_legacy_ids(store, run):
+    legacy = [{"id": f"u1_170000000000{i}", "query": f"legacy q{i}", "response": f"legacy a{i}"} for i in range(3)]
+    store.documents["conversations/u1"] = {
+        "conversation": legacy, "session_id": "1700000000000", "summary": "old", "summary_upto": "u1_1700000000002"
+    }
+
+    async def scenario():
+        from ai.jobs import job_queue
+
+        for i in range(5):
+            await converse("u1", f"คำถามใหม่ {i} ความดันสูง")
+            await job_queue.join()
+        return get_conversation_history(await ConversationContext.load("u1"))
+
+    history = run(scenario())
+    data = store.documents["conversations/u1"]
+    assert data["turn_count"] == 8
+    # Turns are folded in batches once they are behind the kept window
+    behind = data["turn_count"] - SUMMARY_KEEP_TURNS
+    assert behind - SUMMARY_BATCH_TURNS < data["summary_seq"] <= behind
+    assert "summary_upto" not in data
+    assert "คำถามใหม่ 4" in history
+
+
+def test_opening_from_stale_cache_keeps_other_workers_turns(store, run):
+    async def scenario():
+        await start_chat("u1")
+        await converse("u1", "ความดันโลหิตสูงมีอาการอย่างไร")
+        stale = await session_cache.get("u1")
+        # Another worker saves two turns; this worker's cache still holds the entry from before
+        await converse("u1", "สูบบุหรี่วันละครึ่งซอง")
+        await converse("u1", "เบาหวานป้องกันได้ไหม")
+        await session_cache.put("u1", stale)
+        await start_chat("u1")
+        opened = dict(store.documents["conversations/u1"])
+        await session_cache.put("u1", stale)
+        reset = await new_chat("u1")
+        return opened, reset
+
+    opened, reset = run(scenario())
+    assert opened["turn_count"] == 5
+    assert [entry["seq"] for entry in opened["recent"]] == [1, 2, 3, 4, 5]
+    assert len(saved_turns(store, "u1")) == 3
+
+    assert reset["is_new_chat"] and reset["archive_job_id"]
+    sessions = [data for path, data in store.documents.items() if "/sessions/" in path]
+    assert [session["turn_count"] for session in sessions] == [5]
+    assert store.documents["conversations/u1"]["turn_count"] == 1
+
+
+def test_one_risk_job_while_a_classification_is_pending(store, run, monkeypatch):
+    import asyncio
+    from ai import converse as converse_module
+    from ai.jobs import job_queue
+
+    earlier_jobs = set(job_queue.backend._jobs)
+    classifying = asyncio.Event()
+    release = {}
+
+    async def slow_analyze_risk(risk_state, client=None):
+        classifying.set()
+        await release["event"].wait()
+        return {"status": "success", "original_risk_level": "red", "risk_level": "ระดับความเสี่ยง: **แดง (red)**"}
+
+    monkeypatch.setattr(converse_module, "analyze_risk", slow_analyze_risk)
+
+    async def scenario():
+        release["event"] = asyncio.Event()
+        await converse("u1", "ความดันโลหิตสูงมีอาการอย่างไร")
+        await converse("u1", "ควรออกกำลังกายแบบไหน")
+        await converse("u1", "สูบบุหรี่วันละครึ่งซอง")
+        await classifying.wait()
+        # Still classifying turn 3: these turns add nothing new and must not queue more
+        for _ in range(3):
+            await converse("u1", "ขอบคุณค่ะ")
+        pending = store.documents["conversations/u1"].get("risk_pending")
+        release["event"].set()
+        await job_queue.join()
+        return pending
+
+    pending = run(scenario())
+    risk_jobs = [job for job in job_queue.backend._jobs.values()
+                 if job["kind"] == "risk_analysis" and job["id"] not in earlier_jobs]
+    assert len(risk_jobs) == 1
+    assert pending["at_turn"] == 3
+    data = store.documents["conversations/u1"]
+    assert "risk_pending" not in data
+    assert data["risk_classification"]["at_turn"] == 3
@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+from ai import jobs
+from ai.jobs import FirestoreJobBackend, JobQueue
+
+
+def expired_job(queue, job_id, kind, status="queued"):
+    """A job whose owner stopped: its lease ran out a minute ago"""
+    return {
+        "id": job_id, "kind": kind, "payload": {}, "ordering_key": "u1", "status": status, "attempts": 0,
+        "result": None, "error": None, "created_at": time.time() - 120, "owner": "gone:1",
+        "lease_until": time.time() - 60
+    }
+
+
+def new_queue(calls, at_most_once=False, **kwargs):
+    queue = JobQueue(FirestoreJobBackend(), retry_delay=0, **kwargs)
+
+    @queue.handler("work", at_most_once=at_most_once)
+    async def work():
+        calls.append(1)
+        return {"ok": True}
+
+    return queue
+
+
+def test_reclaim_runs_an_expired_job_once_across_workers(store):
+    calls = []
+
+    async def scenario():
+        first, second = new_queue(calls), new_queue(calls)
+        await first.backend.create(expired_job(first, "job-1", "work"))
+        await asyncio.gather(first.reclaim(), second.reclaim())
+        await asyncio.gather(first.join(), second.join())
+        job = await first.get("job-1")
+        await asyncio.gather(first.stop(), second.stop())
+        return job
+
+    job = asyncio.run(scenario())
+    assert calls == [1]
+    assert job["status"] == "done" and job["result"] == {"ok": True}
+
+
+def test_reclaim_leaves_a_live_lease_alone(store):
+    calls = []
+
+    async def scenario():
+        queue = new_queue(calls)
+        job = expired_job(queue, "job-1", "work")
+        job["lease_until"] = time.time() + 600
+        await queue.backend.create(job)
+        await queue.reclaim()
+        await queue.join()
+        await queue.stop()
+        return await queue.get("job-1")
+
+    job = asyncio.run(scenario())
+    assert calls == []
+    assert job["status"] == "queued"
+
+
+def test_interrupted_at_most_once_job_is_not_run_again(store):
+    calls = []
+
+    async def scenario():
+        queue = new_queue(calls, at_most_once=True)
+        await queue.backend.create(expired_job(queue, "job-1", "work", status="running"))
+        await queue.reclaim()
+        await queue.join()
+        await queue.stop()
+        return await queue.get("job-1")
+
+    job = asyncio.run(scenario())
+    assert calls == []
+    assert job["status"] == "failed"
+
+
+def test_unsaveable_result_still_records_the_outcome(store):
+    calls = []
+
+    class SizeLimitedBackend(FirestoreJobBackend):
+        async def save(self, job):
+            if job.get("result") is not None:
+                raise ValueError("document exceeds the maximum size")
+            await super().save(job)
+
+    async def scenario():
+        queue = new_queue(calls, at_most_once=True)
+        queue.backend = SizeLimitedBackend()
+        job_id = await queue.enqueue("work", {}, ordering_key="u1")
+        await queue.join()
+        # A later reclaim must not send it again
+        await queue.reclaim()
+        await queue.join()
+        await queue.stop()
+        return await queue.get(job_id)
+
+    job = asyncio.run(scenario())
+    assert calls == [1]
+    assert job["status"] == "done"
+    assert job["result"] is None and "could not be stored" in job["error"]
+
+
+def test_jobs_of_one_key_run_one_at_a_time_across_workers(store, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_KEY_RETRY_DELAY", 0.01)
+    running, peak, done = {"u1": 0, "u2": 0}, {"u1": 0, "u2": 0}, []
+
+    def slow_queue():
+        queue = JobQueue(FirestoreJobBackend(), retry_delay=0)
+
+        @queue.handler("slow")
+        async def slow(user_id, name):
+            running[user_id] += 1
+            peak[user_id] = max(peak[user_id], running[user_id])
+            await asyncio.sleep(0.05)
+            running[user_id] -= 1
+            done.append(name)
+
+        return queue
+
+    async def scenario():
+        first, second = slow_queue(), slow_queue()
+        for i in range(3):
+            await first.enqueue("slow", {"user_id": "u1", "name": f"first-{i}"}, ordering_key="u1")
+            await second.enqueue("slow", {"user_id": "u1", "name": f"second-{i}"}, ordering_key="u1")
+        await second.enqueue("slow", {"user_id": "u2", "name": "other-user"}, ordering_key="u2")
+        await asyncio.gather(first.join(), second.join())
+        await asyncio.gather(first.stop(), second.stop())
+
+    asyncio.run(scenario())
+    assert len(done) == 7
+    assert peak["u1"] == 1
+    u1 = [name for name in done if name != "other-user"]
+    assert [name for name in u1 if name.startswith("first")] == ["first-0", "first-1", "first-2"]
+    assert [name for name in u1 if name.startswith("second")] == ["second-0", "second-1", "second-2"]
+    assert not [path for path in store.documents if path.startswith("jobs_keys/")]
+
+
+def test_heartbeat_keeps_a_long_job_from_being_reclaimed(store, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.1)
+    monkeypatch.setattr(jobs, "JOB_HEARTBEAT_INTERVAL", 0.02)
+    calls = []
+
+    async def scenario():
+        first, second = new_queue(calls), new_queue(calls)
+
+        @first.handler("work")
+        async def long_work():
+            calls.append(1)
+            await asyncio.sleep(0.3)
+            return {"ok": True}
+
+        job_id = await first.enqueue("work", {}, ordering_key="u1")
+        await asyncio.sleep(0.2)
+        # Well past the lease it was enqueued with
+        await second.reclaim()
+        await asyncio.gather(first.join(), second.join())
+        await asyncio.gather(first.stop(), second.stop())
+        return await first.get(job_id)
+
+    job = asyncio.run(scenario())
+    assert calls == [1]
+    assert job["status"] == "done"
+
+
+def test_job_status_is_only_shown_to_its_user_or_an_operator(store, run, monkeypatch):
+    import httpx
+    import main
+    from ai.jobs import job_queue
+
+    monkeypatch.setattr(main, "ADMIN_API_KEY", "secret")
+
+    async def scenario():
+        job_id = await job_queue.enqueue("no-such-kind", {"user_id": "u1"}, ordering_key="u1", idempotency_key="u1:1")
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [
+                (await client.get(f"/jobs/{job_id}", **request)).status_code
+                for request in ({}, {"params": {"user_id": "u2"}}, {"params": {"user_id": "u1"}},
+                                {"headers": {"X-Admin-Key": "secret"}}, {"headers": {"X-Admin-Key": "wrong"}})
+            ]
+
+    assert run(scenario()) == [404, 404, 200, 200, 404]
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_metrics_add_up_across_worker_processes(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+
+    def python(code):
+        return subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env,
+                              capture_output=True, text=True, check=True).stdout
+
+    # Two workers each record a follow-up question, then exit
+    for _ in range(2):
+        python("from ai.metrics import record_followup; record_followup('bank')")
+    body = python("from ai.metrics import export_metrics; print(export_metrics()[0].decode())")
+    assert 'ncd_followup_questions_total{source="bank"} 2.0' in body
@@ -0,0 +1,52 @@
+import httpx
+from firebase_admin import exceptions, messaging
+
+from ai.notifications import is_invalid_token_error
+from bench.fakes import FakeGenerativeModel, FakeMessaging, install
+
+
+def test_only_token_errors_prune_the_token():
+    assert is_invalid_token_error(messaging.UnregisteredError("Requested entity was not found."))
+    assert is_invalid_token_error(messaging.SenderIdMismatchError("sender id does not match"))
+    # FCM answers a malformed message (bad data payload) with INVALID_ARGUMENT for every token
+    assert not is_invalid_token_error(exceptions.InvalidArgumentError("Invalid value at 'message.data'"))
+    assert not is_invalid_token_error(exceptions.NotFoundError("not found"))
+    assert not is_invalid_token_error(RuntimeError("multicast failed"))
+
+
+def test_campaign_results_are_stored_per_user_and_paged(store, run, monkeypatch):
+    import main
+    from ai.jobs import job_queue
+
+    install(genai_model=FakeGenerativeModel(latency=0), firestore=store, fcm=FakeMessaging(latency=0))
+    monkeypatch.setattr(main, "ADMIN_API_KEY", "secret")
+    for i in range(7):
+        store.documents[f"users/u{i}"] = {"fcmToken": f"token-{i}"}
+    store.documents["users/u7"] = {"fcmToken": "invalid-token-7"}
+    store.documents["users/u8"] = {}
+
+    async def scenario():
+        job_id = await job_queue.enqueue(
+            "bulk_notification", {"title": "t", "body": "b", "user_ids": [f"u{i}" for i in range(10)]}, "notifications:bulk"
+        )
+        await job_queue.join()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers={"X-Admin-Key": "secret"}) as client:
+            pages, cursor = [], None
+            while True:
+                params = {"limit": 4, **({"cursor": cursor} if cursor else {})}
+                page = (await client.get(f"/notifications/bulk/{job_id}/results", params=params)).json()
+                pages.append(page["results"])
+                cursor = page["next_cursor"]
+                if not cursor:
+                    break
+            invalid = (await client.get(f"/notifications/bulk/{job_id}/results", params={"status": "invalid_token"})).json()
+        return await job_queue.get(job_id), pages, invalid
+
+    job, pages, invalid = run(scenario())
+    assert job["result"]["sent"] == 7
+    assert job["result"]["results_saved"]
+    assert [len(page) for page in pages] == [4, 4, 2]
+    statuses = {result["user_id"]: result["status"] for page in pages for result in page}
+    assert statuses == {**{f"u{i}": "sent" for i in range(7)}, "u7": "invalid_token", "u8": "no_token", "u9": "no_token"}
+    assert [result["user_id"] for result in invalid["results"]] == ["u7"]
@@ -0,0 +1,25 @@
+from ai.rescore import Rescorer, StubRiskModel
+from ai.resources import set_resource
+from ai.risk import update_risk_state
+
+
+def test_users_who_chat_during_the_rescore_are_skipped(store, run):
+    for user_id in ("u1", "u2", "u3"):
+        state, _ = update_risk_state(None, "สูบบุหรี่วันละครึ่งซอง")
+        store.apply_set(f"conversations/{user_id}", {"session_id": "1700000000000", "risk_state": state, "turn_count": 1})
+
+    class ChatDuringScoring(StubRiskModel):
+        async def generate_content_async(self, prompt, request_options=None, **kwargs):
+            if not self.calls:
+                # u2 sends a message between the re-score's read and its write
+                store.apply_update("conversations/u2", {"turn_count": 2})
+            return await super().generate_content_async(prompt, request_options, **kwargs)
+
+    set_resource("genai_model", ChatDuringScoring(latency=0))
+    report = run(Rescorer("current", concurrency=1, rate=100, checkpoint_file=None).run())
+
+    assert report["stale"] == 1 and report["stale_users"] == ["u2"]
+    assert report["users"] == 3 and report["sessions"] == 2
+    assert "risk_rescored_at" not in store.documents["conversations/u2"]
+    assert store.documents["conversations/u2"]["turn_count"] == 2
+    assert all("risk_rescored_at" in store.documents[f"conversations/{user_id}"] for user_id in ("u1", "u3"))
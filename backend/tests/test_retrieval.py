@@ -0,0 +1,48 @@
+import asyncio
+
+from ai import retrieval
+from ai.retrieval import fuse, retrieve
+from bench.fakes import FakeVectorStore
+
+
+def test_fuse_ranks_chunks_found_by_both_searches_first():
+    vector = ["a", "b", "c"]
+    keyword = ["c", "a", "d"]
+    # a: ranks 1 and 2, c: ranks 3 and 1, then the chunks only one search found
+    assert fuse(vector, keyword) == ["a", "c", "b", "d"]
+
+
+def test_fuse_of_one_ranking_keeps_its_order():
+    assert fuse(["x", "y", "z"]) == ["x", "y", "z"]
+    assert fuse() == []
+
+
+class OrderedVectorStore(FakeVectorStore):
+    """Vector search that always returns the corpus in a fixed order, whatever the query"""
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None):
+        documents = super().similarity_search_by_vector(embedding, k=len(self.DOCUMENTS), filter=filter)
+        return sorted(documents, key=lambda document: document.page_content, reverse=True)[:k]
+
+
+def test_retrieve_fuses_keyword_matches_into_vector_results(store):
+    from ai.resources import set_resource
+
+    set_resource("vector_db", OrderedVectorStore())
+    query = "อาการของโรคเบาหวาน"
+    keyword_top = retrieval.get_keyword_index().search(query, 1)[0][0]
+    vector_only = asyncio.run(retrieve(query, [0.0] * 384, k=3, hybrid=False, use_reranker=False))
+    fused = asyncio.run(retrieve(query, [0.0] * 384, k=3, hybrid=True, use_reranker=False))
+
+    assert keyword_top not in vector_only
+    assert keyword_top in fused
+
+
+def test_retrieve_falls_back_to_vector_search_when_keyword_search_fails(store, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("index unavailable")
+
+    monkeypatch.setattr(retrieval, "get_keyword_index", broken)
+    vector_only = asyncio.run(retrieve("ความดันโลหิตสูง", [0.1] * 384, k=3, hybrid=False, use_reranker=False))
+    degraded = asyncio.run(retrieve("ความดันโลหิตสูง", [0.1] * 384, k=3, hybrid=True, use_reranker=False))
+    assert degraded == vector_only and len(degraded) == 3
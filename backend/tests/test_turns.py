@@ -0,0 +1,158 @@
+import asyncio
+import json
+
+import httpx
+
+from ai.turns import TurnGate, UserBusy, message_key
+
+
+class Turn:
+    """A chat turn that takes `seconds` and counts how often it ran"""
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.runs = 0
+
+    async def __call__(self):
+        self.runs += 1
+        await asyncio.sleep(self.seconds)
+        return {"response": f"reply {self.runs}"}
+
+
+def test_identical_messages_in_flight_share_one_turn():
+    gate, turn = TurnGate(), Turn()
+
+    async def scenario():
+        key = message_key("ความดันสูงมีอาการอย่างไร")
+        return await asyncio.gather(*(gate.run("u1", key, turn) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert turn.runs == 1
+    assert all(result == {"response": "reply 1"} for result in results)
+
+
+def test_explicit_key_replays_after_the_turn_finished():
+    gate, turn = TurnGate(), Turn(0)
+
+    async def scenario():
+        first = await gate.run("u1", "key:retry-1", turn, explicit=True)
+        second = await gate.run("u1", "key:retry-1", turn, explicit=True)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert turn.runs == 1
+    assert first == second
+
+
+def test_same_text_sent_again_later_is_a_new_turn():
+    gate, turn = TurnGate(), Turn(0)
+
+    async def scenario():
+        key = message_key("สวัสดี")
+        await gate.run("u1", key, turn)
+        await asyncio.sleep(0.01)
+        await gate.run("u1", key, turn)
+
+    asyncio.run(scenario())
+    assert turn.runs == 2
+
+
+def test_requests_beyond_the_pending_limit_are_rejected():
+    gate = TurnGate(max_pending=2)
+    turns = [Turn() for _ in range(3)]
+
+    async def scenario():
+        return await asyncio.gather(
+            *(gate.run("u1", f"msg:{i}", turn) for i, turn in enumerate(turns)), return_exceptions=True
+        )
+
+    results = asyncio.run(scenario())
+    assert sum(isinstance(result, UserBusy) for result in results) == 1
+    assert sum(turn.runs for turn in turns) == 2
+
+
+def test_turns_of_one_user_run_one_at_a_time():
+    gate = TurnGate()
+    running = {"u1": 0, "u2": 0}
+    peak = {"u1": 0, "u2": 0, "all": 0}
+
+    def turn(user_id):
+        async def run():
+            running[user_id] += 1
+            peak[user_id] = max(peak[user_id], running[user_id])
+            peak["all"] = max(peak["all"], sum(running.values()))
+            await asyncio.sleep(0.02)
+            running[user_id] -= 1
+        return run
+
+    async def scenario():
+        await asyncio.gather(
+            gate.run("u1", "msg:a", turn("u1")), gate.run("u1", "msg:b", turn("u1")), gate.run("u2", "msg:c", turn("u2"))
+        )
+
+    asyncio.run(scenario())
+    assert peak["u1"] == 1
+    # Different users are not serialised against each other
+    assert peak["all"] == 2
+
+
+async def disconnected_stream(app, body):
+    """POST /chat/stream as an ASGI 2.4 client that goes away once the first event is sent"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/chat/stream", "raw_path": b"/chat/stream", "root_path": "", "query_string": b"",
+        "headers": [(b"content-type", b"application/json")], "server": ("test", 80), "client": ("client", 1)
+    }
+    request = [{"type": "http.request", "body": json.dumps(body).encode("utf-8"), "more_body": False}]
+
+    async def receive():
+        if request:
+            return request.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            raise OSError("client disconnected")
+
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        # ClientDisconnect propagates to the server, which just drops the connection
+        pass
+
+
+def test_duplicate_chat_and_stream_requests_save_one_turn(store, run):
+    import main
+    from ai.jobs import job_queue
+    from ai.turns import turn_gate
+
+    message = "สูบบุหรี่วันละครึ่งซอง"
+    earlier_jobs = set(job_queue.backend._jobs)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for text in ("ความดันโลหิตสูงมีอาการอย่างไร", "ควรออกกำลังกายแบบไหน"):
+                await client.post("/chat", json={"user_id": "u1", "message": text})
+            responses = await asyncio.gather(
+                client.post("/chat", json={"user_id": "u1", "message": message}),
+                client.post("/chat", json={"user_id": "u1", "message": message}),
+                disconnected_stream(main.app, {"user_id": "u1", "message": message})
+            )
+        await job_queue.join()
+        return responses
+
+    first, second, _ = run(scenario())
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+
+    prefix = "conversations/u1/messages/"
+    turns = [data for path, data in store.documents.items() if path.startswith(prefix) and "query" in data]
+    assert [turn["query"] for turn in turns].count(message) == 1
+    assert store.documents["conversations/u1"]["turn_count"] == 3
+    risk_jobs = [job for job in job_queue.backend._jobs.values()
+                 if job["kind"] == "risk_analysis" and job["id"] not in earlier_jobs]
+    assert len(risk_jobs) == 1
+    # The disconnected stream gave the user's turn back
+    assert "u1" not in turn_gate.locks._pending
+    assert "u1" not in turn_gate.locks._locks
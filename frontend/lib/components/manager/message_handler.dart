@@ -16,6 +16,12 @@ class MessageHandler {
   final Function(String) completeInterviewIfScheduled;
   final AppColors colors;
 
+  // ผลการประเมินความเสี่ยงมาจาก background job (risk_job_id) และ /chat รอบถัดไป
+  // ส่ง risk_level ข้อความเดิมมาอีกครั้ง จึงจำไว้เพื่อแสดงครั้งเดียว
+  String? _shownRiskLevel;
+  static const Duration _riskPollInterval = Duration(seconds: 2);
+  static const int _riskPollAttempts = 30;
+
   MessageHandler({
     required this.userId,
     required this.chatService,
@@ -61,19 +67,47 @@ class MessageHandler {
         });
       }
 
-      if (responseData.containsKey('risk_level')) {
+      if (responseData['risk_level'] != null) {
         await _handleRiskLevel(responseData['risk_level'], context);
         if (responseData.containsKey('interview_complete') &&
             responseData['interview_complete'] == true) {
           completeInterviewIfScheduled(responseData['risk_level'] ?? 'unknown');
         }
       }
+
+      final riskJobId = responseData['risk_job_id'];
+      if (riskJobId is String && riskJobId.isNotEmpty) {
+        // ไม่ต้องรอ: ผลจะแสดงเมื่อ job เสร็จ
+        _waitForRiskResult(riskJobId, context);
+      }
     } catch (e) {
       throw e;
     }
   }
 
+  Future<void> _waitForRiskResult(String jobId, BuildContext context) async {
+    for (var attempt = 0; attempt < _riskPollAttempts; attempt++) {
+      await Future.delayed(_riskPollInterval);
+      final job = await chatService.fetchJob(jobId);
+      if (job == null || job['status'] == 'queued' || job['status'] == 'running') {
+        continue;
+      }
+      final result = job['result'];
+      if (job['status'] == 'done' &&
+          result is Map &&
+          result['status'] == 'success' &&
+          result['risk_level'] is String &&
+          context.mounted) {
+        await _handleRiskLevel(result['risk_level'], context);
+      }
+      return;
+    }
+  }
+
   Future<void> _handleRiskLevel(String riskLevel, BuildContext context) async {
+    if (riskLevel == _shownRiskLevel) return;
+    _shownRiskLevel = riskLevel;
+
     String riskLevelLower = riskLevel.toLowerCase();
     bool isHighRisk = riskLevelLower == "red" ||
         riskLevelLower.contains("สูง") ||
@@ -130,7 +130,8 @@ class _VoiceScreenState extends State<VoiceScreen> {
       if (response.statusCode == 200) {
         var responseData = jsonDecode(utf8.decode(response.bodyBytes));
         String botReply = responseData["response"];
-        String riskLevel = responseData["risk_level"] ?? "ไม่ระบุ";
+        // risk_level มาเฉพาะรอบที่การประเมิน (background job) เสร็จแล้ว: เก็บค่าเดิมไว้จนกว่าจะมีค่าใหม่
+        String riskLevel = responseData["risk_level"] ?? _riskLevel;
 
         if (mounted) {
           setState(() {
@@ -38,6 +38,21 @@ class ChatService {
     }
   }
 
+  /// สถานะของ background job (เช่น risk_job_id จาก /chat); null ถ้ายังไม่รู้จักหรือเรียกไม่สำเร็จ
+  /// ส่ง user_id ไปด้วย: server ตอบเฉพาะ job ของผู้ใช้คนนั้น
+  Future<Map<String, dynamic>?> fetchJob(String jobId) async {
+    try {
+      final response = await http.get(Uri.parse('$baseUrl/jobs/$jobId?user_id=$userId'));
+      if (response.statusCode == 200) {
+        return jsonDecode(utf8.decode(response.bodyBytes));
+      }
+      return null;
+    } catch (e) {
+      print("❌ Error fetching job $jobId: $e");
+      return null;
+    }
+  }
+
   Future<Map<String, dynamic>> resetChat({required String sessionId}) async {
     try {
       final url = Uri.parse('$baseUrl/new_chat?user_id=$userId');
@@ -70,7 +70,7 @@ class FCMService {
       );
 
       if (response.statusCode == 200) {
-        print('Notification sent successfully');
+        print('Notification queued: ${jsonDecode(response.body)['job_id']}');
         return true;
       } else {
         print('Failed to send notification: ${response.body}');